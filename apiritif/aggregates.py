@@ -0,0 +1,252 @@
+"""
+Aggregated results: per-label counters and latency histograms for every time interval instead of samples
+
+Copyright 2019 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import heapq
+import json
+import math
+import time
+from contextlib import ExitStack
+
+from apiritif.loadgen import JTLSampleWriter, open_report
+from apiritif.utils import to_json_line
+
+PERCENTILES = (50.0, 90.0, 95.0, 99.0, 99.9)
+
+
+def get_order(key):
+    timestamp, label = key
+    return timestamp, str(label)
+
+
+class LatencyHistogram(object):
+    """
+    Log-linear histogram of latencies in microseconds (like HdrHistogram):
+    values below 2 * HALF are counted exactly, greater ones go into buckets of relative width 1/HALF.
+    Only non-empty buckets are stored, so its size depends on spread of values rather than their number.
+    """
+    SUB_BUCKET_BITS = 7
+    HALF = 1 << (SUB_BUCKET_BITS - 1)
+
+    def __init__(self, counts=None):
+        self.counts = counts or {}  # bucket index -> number of values
+        self.total = sum(self.counts.values())
+
+    @classmethod
+    def get_index(cls, value):
+        shift = value.bit_length() - cls.SUB_BUCKET_BITS
+        if shift <= 0:
+            return value
+        return shift * cls.HALF + (value >> shift)
+
+    @classmethod
+    def get_value(cls, index):
+        """ Middle of the bucket """
+        if index < 2 * cls.HALF:
+            return index
+        shift = index // cls.HALF - 1
+        return ((index - shift * cls.HALF) << shift) + (1 << (shift - 1))
+
+    def add(self, seconds, count=1):
+        index = self.get_index(max(int(seconds * 1000000), 0))
+        self.counts[index] = self.counts.get(index, 0) + count
+        self.total += count
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.total += other.total
+
+    def percentile(self, percent):
+        """ Value in seconds below which given percent of values fall """
+        if not self.total:
+            return None
+        threshold = max(int(math.ceil(self.total * percent / 100.0)), 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return self.get_value(index) / 1000000.0
+
+
+class Aggregate(object):
+    """ Results of one label for one time interval """
+    MAX_ERRORS = 100  # distinct messages, the rest are counted as 'other'
+    OTHER_ERRORS = "Other errors"
+
+    def __init__(self, timestamp, label):
+        self.timestamp = timestamp
+        self.label = label
+        self.count = 0
+        self.failures = 0
+        self.min = None
+        self.max = None
+        self.sum = 0.0
+        self.codes = {}
+        self.errors = {}
+        self.histogram = LatencyHistogram()
+
+    def add(self, duration, success, code, message):
+        self.count += 1
+        self.sum += duration
+        self.min = duration if self.min is None else min(self.min, duration)
+        self.max = duration if self.max is None else max(self.max, duration)
+        self.histogram.add(duration)
+        if code is not None:
+            self.codes[str(code)] = self.codes.get(str(code), 0) + 1
+        if not success:
+            self.failures += 1
+            self._add_error(message or "", 1)
+
+    def merge(self, other):
+        self.count += other.count
+        self.failures += other.failures
+        self.sum += other.sum
+        self.min = other.min if self.min is None else min(self.min, other.min)
+        self.max = other.max if self.max is None else max(self.max, other.max)
+        self.histogram.merge(other.histogram)
+        for code, count in other.codes.items():
+            self.codes[code] = self.codes.get(code, 0) + count
+        for message, count in other.errors.items():
+            self._add_error(message, count)
+
+    def _add_error(self, message, count):
+        if message not in self.errors and len(self.errors) >= self.MAX_ERRORS:
+            message = self.OTHER_ERRORS
+        self.errors[message] = self.errors.get(message, 0) + count
+
+    def to_dict(self):
+        return {
+            "type": "aggregate",
+            "timestamp": self.timestamp,
+            "label": self.label,
+            "count": self.count,
+            "failures": self.failures,
+            "min": self.min,
+            "max": self.max,
+            "avg": self.sum / self.count,
+            "sum": self.sum,
+            "percentiles": {str(perc): self.histogram.percentile(perc) for perc in PERCENTILES},
+            "codes": self.codes,
+            "errors": self.errors,
+            "histogram": sorted(self.histogram.counts.items()),
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        aggregate = cls(data["timestamp"], data["label"])
+        aggregate.count = data["count"]
+        aggregate.failures = data["failures"]
+        aggregate.min = data["min"]
+        aggregate.max = data["max"]
+        aggregate.sum = data["sum"]
+        aggregate.codes = data["codes"]
+        aggregate.errors = data["errors"]
+        aggregate.histogram = LatencyHistogram(dict((index, count) for index, count in data["histogram"]))
+        return aggregate
+
+
+class AggregatingSampleWriter(JTLSampleWriter):
+    """
+    Aggregates the same request samples as JTL writer does into LDJSON records of time intervals.
+    Interval is written when it's finished and samples of long requests had time to arrive,
+    late samples make one more record of the interval. Raw samples of failures can be kept too.
+    """
+    DELAY = 5.0  # seconds to wait for samples of interval after it's finished
+
+    def __init__(self, output_file, interval=1.0, keep_failures=False, flush_interval=None, flush_size=None):
+        super(AggregatingSampleWriter, self).__init__(output_file, flush_interval, flush_size)
+        self.interval = interval
+        self.keep_failures = keep_failures
+        self.aggregates = {}  # (timestamp, label) -> Aggregate
+
+    @classmethod
+    def merge(cls, parts, output_file):
+        """
+        Records of the same interval and label from different workers are joined.
+        Parts are read together in order of time and interval is written once every part has passed it,
+        so only intervals in progress are kept in memory. Late records make one more record of the interval.
+        """
+        aggregates = {}  # (timestamp, label) -> Aggregate
+        current = None
+        with ExitStack() as stack:
+            out_stream = stack.enter_context(open_report(output_file, "wb"))
+            readers = [cls._read_aggregates(stack.enter_context(open_report(part, "rb")), out_stream)
+                       for part in parts]
+            for aggregate in heapq.merge(*readers, key=lambda agg: agg.timestamp):
+                if current is None or aggregate.timestamp > current:
+                    cls._write_merged(aggregates, out_stream, aggregate.timestamp)
+                    current = aggregate.timestamp
+
+                key = (aggregate.timestamp, aggregate.label)
+                if key in aggregates:
+                    aggregates[key].merge(aggregate)
+                else:
+                    aggregates[key] = aggregate
+
+            cls._write_merged(aggregates, out_stream, float("inf"))
+
+    @staticmethod
+    def _read_aggregates(in_stream, out_stream):
+        """ Yields aggregates of part, other records are copied as is """
+        for line in in_stream:
+            data = json.loads(line.decode('utf-8'))
+            if data.get("type") == "aggregate":
+                yield Aggregate.from_dict(data)
+            else:
+                out_stream.write(line)
+
+    @staticmethod
+    def _write_merged(aggregates, out_stream, till):
+        for key in sorted(aggregates, key=get_order):
+            if key[0] < till:
+                out_stream.write(to_json_line(aggregates.pop(key).to_dict()))
+
+    def _write_header(self):
+        pass
+
+    def _write_single_sample(self, sample):
+        """
+        :type sample: Sample
+        """
+        timestamp = math.floor(sample.start_time / self.interval) * self.interval
+        key = (timestamp, sample.test_case)
+        aggregate = self.aggregates.get(key)
+        if aggregate is None:
+            aggregate = self.aggregates[key] = Aggregate(timestamp, sample.test_case)
+
+        success = sample.status == "PASSED"
+        message = None if success else self._get_message(sample)
+        aggregate.add(sample.duration, success, sample.extras.get("responseCode"), message)
+        if self.keep_failures and not success:
+            data = sample.to_dict()
+            data["type"] = "sample"
+            self._buffer.write(to_json_line(data))
+
+    def _write_aggregates(self, till):
+        for key in sorted(self.aggregates, key=get_order):
+            if key[0] + self.interval <= till:
+                aggregate = self.aggregates.pop(key)
+                self._buffer.write(to_json_line(aggregate.to_dict()))
+
+    def _writer(self):
+        super(AggregatingSampleWriter, self)._writer()
+        self._write_aggregates(float("inf"))
+        super(AggregatingSampleWriter, self)._flush()
+
+    def _flush(self):
+        self._write_aggregates(time.time() - self.DELAY)
+        super(AggregatingSampleWriter, self)._flush()
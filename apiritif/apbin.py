@@ -0,0 +1,204 @@
+"""
+Compact binary format of results (.apbin)
+
+File starts with magic bytes, then records follow, each of them starts with type byte:
+  - string record defines id of label or message: type, id, length of UTF-8 bytes, bytes
+  - sample record has fixed width: type, start time, elapsed, label id, status, response code,
+    bytes, message id, concurrency
+Strings are defined before the first sample which refers to them, so file can be read sequentially
+while it's being written. Number of defined strings is limited, strings beyond the limit are written
+before every sample which refers to them, with reserved ids of inline label and message.
+
+Copyright 2019 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import mmap
+import os
+import struct
+import sys
+from collections import namedtuple
+
+import unicodecsv as csv
+
+from apiritif.loadgen import JTLSampleWriter, get_writer_class
+from apiritif.samples import Sample
+from apiritif.utils import to_json_line
+
+MAGIC = b"APBIN\x02"
+STRING_TYPE = 1
+SAMPLE_TYPE = 2
+STRING_RECORD = struct.Struct("<BIH")
+SAMPLE_RECORD = struct.Struct("<BdfIBHQIH")
+STATUSES = ("PASSED", "FAILED", "BROKEN", "SKIPPED")
+MAX_STRING = 0xFFFF
+MAX_CONCURRENCY = 0xFFFF
+INLINE_LABEL_ID = 0xFFFFFFFF
+INLINE_MESSAGE_ID = 0xFFFFFFFE
+
+APBinRecord = namedtuple("APBinRecord", "start_time elapsed label status response_code bytes message concurrency")
+
+
+class APBinEncoder(object):
+    """ Writes records into binary stream, every string is written once until the table of strings is full """
+    MAX_STRINGS = int(os.environ.get("APIRITIF_APBIN_MAX_STRINGS", "10000"))  # e.g. URLs with unique query strings
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.strings = {}
+
+    def write_header(self):
+        self.stream.write(MAGIC)
+
+    def write_record(self, record):
+        """ :type record: APBinRecord """
+        label_id = self._get_string_id(record.label, INLINE_LABEL_ID)
+        message_id = self._get_string_id(record.message, INLINE_MESSAGE_ID)
+        self.stream.write(SAMPLE_RECORD.pack(
+            SAMPLE_TYPE, record.start_time, record.elapsed, label_id, STATUSES.index(record.status),
+            record.response_code or 0, record.bytes, message_id, min(record.concurrency, MAX_CONCURRENCY)))
+
+    def _get_string_id(self, value, inline_id):
+        if value is None:
+            return 0
+
+        string_id = self.strings.get(value)
+        if string_id is None:
+            if len(self.strings) < self.MAX_STRINGS:
+                string_id = len(self.strings) + 1
+                self.strings[value] = string_id
+            else:
+                string_id = inline_id  # redefined for every sample
+            data = value.encode("utf-8")[:MAX_STRING]
+            self.stream.write(STRING_RECORD.pack(STRING_TYPE, string_id, len(data)))
+            self.stream.write(data)
+
+        return string_id
+
+
+class APBinReader(object):
+    """ Reads records of memory-mapped file, incomplete record at the end (being written now) is ignored """
+
+    def __init__(self, path):
+        self.path = path
+
+    def __iter__(self):
+        with open(self.path, "rb") as fds:
+            size = os.fstat(fds.fileno()).st_size
+            if size < len(MAGIC):
+                return
+
+            with mmap.mmap(fds.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data[:len(MAGIC)] != MAGIC:
+                    raise ValueError("Unsupported format of results file: %s" % self.path)
+
+                strings = {0: None}
+                offset = len(MAGIC)
+                while offset < size:
+                    if data[offset] == STRING_TYPE:
+                        if offset + STRING_RECORD.size > size:
+                            break
+                        _, string_id, length = STRING_RECORD.unpack_from(data, offset)
+                        if offset + STRING_RECORD.size + length > size:
+                            break
+                        offset += STRING_RECORD.size
+                        strings[string_id] = data[offset:offset + length].decode("utf-8", errors="replace")
+                        offset += length
+                    elif data[offset] == SAMPLE_TYPE:
+                        if offset + SAMPLE_RECORD.size > size:
+                            break
+                        fields = SAMPLE_RECORD.unpack_from(data, offset)
+                        offset += SAMPLE_RECORD.size
+                        _, start_time, elapsed, label_id, status, code, size_, message_id, concurrency = fields
+                        yield APBinRecord(start_time, elapsed, strings[label_id], STATUSES[status], code or None,
+                                          size_, strings[message_id], concurrency)
+                    else:
+                        raise ValueError("Wrong record type at %s of %s" % (offset, self.path))
+
+
+class APBinSampleWriter(JTLSampleWriter):
+    """ Writes the same request samples as JTL writer does, but as compact binary records """
+
+    def __init__(self, output_file, flush_interval=None, flush_size=None):
+        super(APBinSampleWriter, self).__init__(output_file, flush_interval, flush_size)
+        self.encoder = APBinEncoder(self._buffer)
+
+    @classmethod
+    def merge(cls, parts, output_file):
+        with open(output_file, "wb") as out_stream:
+            encoder = APBinEncoder(out_stream)  # ids of strings are different in every part
+            encoder.write_header()
+            for part in parts:
+                for record in APBinReader(part):
+                    encoder.write_record(record)
+
+    def _write_header(self):
+        self.encoder.write_header()
+
+    def _write_single_sample(self, sample):
+        """
+        :type sample: Sample
+        """
+        code = sample.extras.get("responseCode")
+        self.encoder.write_record(APBinRecord(
+            start_time=sample.start_time,
+            elapsed=sample.duration,
+            label=sample.test_case,
+            status=sample.status,
+            response_code=int(code) if str(code).isdigit() else None,
+            bytes=self._get_bytes(sample),
+            message=self._get_message(sample),
+            concurrency=self.concurrency))
+
+
+def convert(apbin_file, output_file):
+    """ Converts binary results into LDJSON or JTL (CSV), format is chosen by extension of output file """
+    writer_class = get_writer_class(output_file)
+    if writer_class is APBinSampleWriter:
+        raise ValueError("Output file must be LDJSON or CSV: %s" % output_file)
+
+    with open(output_file, "wb") as fds:
+        if writer_class is JTLSampleWriter:
+            writer = csv.DictWriter(fds, fieldnames=JTLSampleWriter.FIELDNAMES, dialect=csv.excel,
+                                    lineterminator='\n', encoding='utf-8')
+            writer.writeheader()
+
+        for record in APBinReader(apbin_file):
+            if writer_class is JTLSampleWriter:
+                writer.writerow({
+                    "timeStamp": int(1000 * record.start_time),
+                    "elapsed": int(1000 * record.elapsed),
+                    "Latency": 0,
+                    "label": record.label,
+                    "bytes": record.bytes,
+                    "responseCode": record.response_code,
+                    "responseMessage": record.message,
+                    "allThreads": record.concurrency,
+                    "success": "true" if record.status == "PASSED" else "false"})
+            else:
+                sample = Sample(test_case=record.label, status=record.status, start_time=record.start_time,
+                                duration=record.elapsed, error_msg=None if record.status == "PASSED" else record.message)
+                sample.extras.update(responseCode=record.response_code, responseMessage=record.message,
+                                     bytes=record.bytes, allThreads=record.concurrency)
+                fds.write(to_json_line(sample.to_dict()))
+
+
+def main():
+    if len(sys.argv) != 3:
+        sys.stderr.write("Usage: python -m apiritif.apbin <results.apbin> <results.ldjson|results.csv>\n")
+        sys.exit(1)
+    convert(sys.argv[1], sys.argv[2])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,260 @@
+"""
+HTTP/1.1 client for asyncio based virtual users
+
+Copyright 2019 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import asyncio
+import ssl
+import time
+import zlib
+from datetime import timedelta
+from http.client import HTTPMessage
+from urllib.parse import urlsplit, urljoin
+
+import requests
+from requests.cookies import extract_cookies_to_jar, merge_cookies
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers, requote_uri
+
+DEFAULT_PORTS = {"http": 80, "https": 443}
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class _OriginalResponse(object):
+    """ Mimics urllib3 response enough for cookie extraction of requests """
+
+    def __init__(self, msg):
+        self.msg = msg
+        self._original_response = self
+
+
+class AsyncSession(requests.Session):
+    """
+    Sends requests over asyncio streams instead of urllib3, keeps idle connections for reuse.
+    Preparation of requests, cookies and redirect rules are inherited from requests.Session,
+    proxies and custom adapters aren't supported.
+    """
+
+    def __init__(self):
+        super(AsyncSession, self).__init__()
+        self._idle = {}  # (scheme, host, port) -> [(reader, writer)]
+        self._ssl_context = None
+
+    async def send_async(self, request, allow_redirects=True, timeout=30):
+        """
+        :type request: requests.PreparedRequest
+        :rtype: requests.Response
+        """
+        history = []
+        while True:
+            response = await self._send_once(request, timeout)
+            extract_cookies_to_jar(self.cookies, request, response.raw)
+            if not (allow_redirects and response.is_redirect):
+                break
+
+            if len(history) >= self.max_redirects:
+                raise requests.TooManyRedirects("Exceeded %s redirects." % self.max_redirects, response=response)
+            history.append(response)
+            request = self._get_redirect_request(request, response)
+
+        response.history = history
+        return response
+
+    async def close_async(self):
+        self.close()
+
+    def close(self):
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+        super(AsyncSession, self).close()
+
+    def _get_redirect_request(self, request, response):
+        redirect = request.copy()
+        redirect.url = requote_uri(urljoin(request.url, self.get_redirect_target(response)))
+        self.rebuild_method(redirect, response)
+        if response.status_code not in (307, 308):  # body is only kept for these codes
+            for header in ("Content-Length", "Content-Type", "Transfer-Encoding"):
+                redirect.headers.pop(header, None)
+            redirect.body = None
+
+        redirect.headers.pop("Cookie", None)
+        extract_cookies_to_jar(redirect._cookies, request, response.raw)
+        merge_cookies(redirect._cookies, self.cookies)
+        redirect.prepare_cookies(redirect._cookies)
+        self.rebuild_auth(redirect, response)  # Authorization isn't sent to other host or over plain HTTP
+        return redirect
+
+    async def _send_once(self, request, timeout):
+        url = urlsplit(request.url)
+        if url.scheme not in DEFAULT_PORTS:
+            raise requests.exceptions.InvalidSchema("No connection adapters were found for %r" % request.url)
+        key = (url.scheme, url.hostname, url.port or DEFAULT_PORTS[url.scheme])
+        data = self._serialize(request, url)
+
+        start = time.time()
+        while True:
+            reader, writer, reused = await self._get_connection(key, timeout)
+            try:
+                writer.write(data)
+                await asyncio.wait_for(writer.drain(), timeout)
+                version, status, reason, msg = await asyncio.wait_for(self._read_head(reader), timeout)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError) as exc:
+                writer.close()
+                if not reused:  # idle connection might be closed by server, only such case is retried
+                    raise requests.exceptions.ConnectionError(exc, request=request)
+            except asyncio.TimeoutError as exc:
+                writer.close()
+                raise requests.exceptions.ReadTimeout(exc, request=request)
+        elapsed = time.time() - start
+
+        headers = CaseInsensitiveDict()
+        for name, value in msg.items():
+            headers[name] = "%s, %s" % (headers[name], value) if name in headers else value
+
+        try:
+            body, complete = await asyncio.wait_for(self._read_body(reader, request.method, status, headers), timeout)
+        except asyncio.TimeoutError as exc:
+            writer.close()
+            raise requests.exceptions.ReadTimeout(exc, request=request)
+        except (ConnectionError, asyncio.IncompleteReadError) as exc:
+            writer.close()
+            raise requests.exceptions.ChunkedEncodingError(exc, request=request)
+
+        keep_alive = complete and version == "HTTP/1.1" and headers.get("Connection", "").lower() != "close"
+        if keep_alive:
+            self._idle.setdefault(key, []).append((reader, writer))
+        else:
+            writer.close()
+
+        response = requests.Response()
+        response.status_code = status
+        response.reason = reason
+        response.headers = headers
+        response._content = self._decode(body, headers.get("Content-Encoding", ""))
+        response.encoding = get_encoding_from_headers(headers)
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=elapsed)
+        response.raw = _OriginalResponse(msg)
+        extract_cookies_to_jar(response.cookies, request, response.raw)
+        return response
+
+    async def _get_connection(self, key, timeout):
+        idle = self._idle.get(key)
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer, True
+            writer.close()
+
+        scheme, host, port = key
+        ssl_context = None
+        if scheme == "https":
+            if self._ssl_context is None:  # certificates aren't verified, as in http.request()
+                self._ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+                self._ssl_context.check_hostname = False
+                self._ssl_context.verify_mode = ssl.CERT_NONE
+            ssl_context = self._ssl_context
+
+        try:
+            connection = asyncio.open_connection(host, port, ssl=ssl_context)
+            reader, writer = await asyncio.wait_for(connection, timeout)
+        except asyncio.TimeoutError as exc:
+            raise requests.exceptions.ConnectTimeout(exc)
+        except OSError as exc:
+            raise requests.exceptions.ConnectionError(exc)
+
+        return reader, writer, False
+
+    @staticmethod
+    def _serialize(request, url):
+        host = url.hostname if ":" not in url.hostname else "[%s]" % url.hostname
+        if url.port and url.port != DEFAULT_PORTS[url.scheme]:
+            host += ":%s" % url.port
+
+        body = request.body or b""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        elif not isinstance(body, bytes):
+            raise ValueError("Streamed request bodies aren't supported by async client")
+
+        lines = ["%s %s HTTP/1.1" % (request.method, request.path_url)]
+        if "Host" not in request.headers:
+            lines.append("Host: %s" % host)
+        lines.extend("%s: %s" % (name, value) for name, value in request.headers.items())
+        head = "\r\n".join(lines) + "\r\n\r\n"
+        return head.encode("latin-1") + body
+
+    @staticmethod
+    async def _read_head(reader):
+        while True:
+            status_line = await reader.readline()
+            if not status_line:
+                raise ConnectionError("Connection closed by server")
+
+            version, status, reason = (status_line.decode("latin-1").rstrip("\r\n").split(" ", 2) + ["", ""])[:3]
+            if not version.startswith("HTTP/") or not status.isdigit():
+                raise ConnectionError("Malformed status line: %r" % status_line)
+            msg = HTTPMessage()
+            while True:
+                line = await reader.readline()
+                if line in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = line.decode("latin-1").partition(":")
+                msg[name.strip()] = value.strip()
+
+            if int(status) != 100:  # skip interim responses
+                return version, int(status), reason, msg
+
+    @staticmethod
+    async def _read_body(reader, method, status, headers):
+        """ :return: body and whether connection can be reused """
+        if method == "HEAD" or status in (204, 304) or 100 <= status < 200:
+            return b"", True
+
+        if "chunked" in headers.get("Transfer-Encoding", "").lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b";")[0].strip(), 16)
+                if not size:
+                    break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                pass  # trailers
+            return b"".join(chunks), True
+
+        if "Content-Length" in headers:
+            return await reader.readexactly(int(headers["Content-Length"])), True
+
+        return await reader.read(), False  # body lasts until connection is closed
+
+    @staticmethod
+    def _decode(body, encoding):
+        encoding = encoding.lower()
+        if not body or encoding not in ("gzip", "deflate"):
+            return body
+
+        if encoding == "gzip":
+            return zlib.decompress(body, 16 + zlib.MAX_WBITS)
+
+        try:
+            return zlib.decompress(body)
+        except zlib.error:
+            return zlib.decompress(body, -zlib.MAX_WBITS)  # raw deflate stream
@@ -16,7 +16,6 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import re
-import threading
 
 import csv
 from io import open
@@ -26,7 +25,7 @@ from chardet.universaldetector import UniversalDetector
 import apiritif.thread as thread
 from apiritif.utils import NormalShutdown
 
-thread_data = threading.local()
+thread_data = thread.ContextLocal()
 
 
 class Reader(object):
@@ -50,11 +49,8 @@ class CSVReaderPerThread(Reader):  # processes multi-thread specific
         self.encoding = encoding
 
     def _get_csv_reader(self, create=False):
-        csv_readers = getattr(thread_data, "csv_readers", None)
-        if not csv_readers:
-            thread_data.csv_readers = {}
-
-        csv_reader = thread_data.csv_readers.get(id(self))
+        csv_readers = getattr(thread_data, "csv_readers", {})
+        csv_reader = csv_readers.get(id(self))
         if not csv_reader and create:
             csv_reader = CSVReader(
                 filename=self.filename,
@@ -66,7 +62,9 @@ class CSVReaderPerThread(Reader):  # processes multi-thread specific
                 quoted=self.quoted,
                 encoding=self.encoding)
 
-            thread_data.csv_readers[id(self)] = csv_reader
+            csv_readers = dict(csv_readers)  # registry can be shared with other coroutine VUs, it's never changed
+            csv_readers[id(self)] = csv_reader
+            thread_data.csv_readers = csv_readers
 
         return csv_reader
 
@@ -76,7 +74,9 @@ class CSVReaderPerThread(Reader):  # processes multi-thread specific
     def close(self):
         csv_reader = self._get_csv_reader()
         if csv_reader:
-            del thread_data.csv_readers[id(self)]
+            csv_readers = dict(thread_data.csv_readers)
+            del csv_readers[id(self)]
+            thread_data.csv_readers = csv_readers
             csv_reader.close()
 
     def get_vars(self):
@@ -0,0 +1,303 @@
+"""
+Distributed mode of apiritif-loadgen: controller slices VUs between agents running on several hosts.
+
+Copyright 2019 BlazeMeter Inc.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import copy
+import hmac
+import json
+import multiprocessing
+import os
+import shutil
+import socket
+import socketserver
+import tempfile
+import time
+import zlib
+from threading import Thread
+
+import apiritif.thread as thread
+from apiritif.loadgen import Supervisor, Params, LoadProfile, spawn_worker
+from apiritif.utils import log, VERSION
+
+DEFAULT_PORT = 8089
+CONNECT_TIMEOUT = 30
+START_DELAY = 2.0  # agents need time to prepare workers before common start
+STREAM_INTERVAL = 1.0
+
+
+def send_message(stream, message, payload=b""):
+    """ Messages are JSON lines, optional payload of message["size"] bytes follows the line """
+    stream.write(json.dumps(message).encode("utf-8") + b"\n")
+    if payload:
+        stream.write(payload)
+    stream.flush()
+
+
+def read_message(stream):
+    line = stream.readline()
+    if not line:
+        return None
+    return json.loads(line.decode("utf-8"))
+
+
+def params_to_dict(params):
+    data = copy.copy(params.__dict__)
+    data.pop("token", None)  # agent has its own
+    if params.load_profile:
+        data["load_profile"] = params.load_profile.stages
+    return data
+
+
+def params_from_dict(data):
+    params = Params()
+    params.__dict__.update(data)
+    if params.load_profile:
+        params.load_profile = LoadProfile(params.load_profile)
+    return params
+
+
+def parse_address(address, default_host="127.0.0.1"):
+    host, _, port = address.rpartition(":")
+    return host or default_host, int(port or DEFAULT_PORT)
+
+
+class Controller(Supervisor):
+    """
+    Supervisor which runs slices of VUs on remote agents instead of local worker processes.
+    Every agent gets as many slices as it has workers, results of each slice are streamed back
+    into worker report and merged in the same way as local ones.
+    :type params: Params
+    """
+
+    def __init__(self, params):
+        super(Controller, self).__init__(params)
+        self.agents = [parse_address(address) for address in params.agents]
+
+    def _start_workers(self):
+        connections = [AgentConnection(host, port, self.params.token) for host, port in self.agents]
+        try:
+            for connection in connections:
+                connection.open()
+
+            self.params.worker_count = min(sum(conn.workers for conn in connections), self.params.concurrency)
+            log.info("Total agents: %s, workers: %s", len(connections), self.params.worker_count)
+            args = list(self._concurrency_slicer())
+
+            start_at = time.time() + START_DELAY
+            tests = {}
+            for test in self.params.tests:
+                with open(test) as fds:
+                    tests[os.path.basename(test)] = fds.read()
+
+            first = 0
+            for connection in connections:
+                if first < len(args):  # agents without slices aren't needed for low concurrency
+                    connection.send_job(args[first:first + connection.workers], tests, self.params.concurrency, start_at)
+                first += connection.workers
+
+            for connection in connections:
+                if connection.is_alive():
+                    connection.join()
+        finally:
+            for connection in connections:
+                connection.close()
+
+        errors = ["%s: %s" % (conn.address, conn.error) for conn in connections if conn.error]
+        if errors:
+            raise RuntimeError("Agents failed: %s" % "; ".join(errors))
+
+        self._finish_reports(args)
+
+
+class AgentConnection(Thread):
+    """ Controller side of agent connection, receives results into worker reports """
+
+    def __init__(self, host, port, token):
+        super(AgentConnection, self).__init__(target=self._receive)
+        self.daemon = True
+        self.address = "%s:%s" % (host, port)
+        self.host = host
+        self.port = port
+        self.token = token
+        self.workers = 0
+        self.clock_offset = 0  # agent clock minus controller clock
+        self.error = None
+        self.reports = {}
+        self._socket = None
+        self._stream = None
+
+    def open(self):
+        self._socket = socket.create_connection((self.host, self.port), timeout=CONNECT_TIMEOUT)
+        self._socket.settimeout(None)  # test can be quiet for a long time
+        self._stream = self._socket.makefile("rwb")
+
+        sent = time.time()
+        send_message(self._stream, {"type": "hello", "time": sent, "version": VERSION, "token": self.token})
+        hello = read_message(self._stream)
+        received = time.time()
+        if hello and hello.get("type") == "error":
+            raise RuntimeError("Agent %s refused connection: %s" % (self.address, hello.get("error")))
+        elif not hello or hello.get("type") != "hello":
+            raise RuntimeError("Wrong response of agent %s: %r" % (self.address, hello))
+
+        self.workers = hello["workers"]
+        self.clock_offset = hello["time"] - (sent + received) / 2.0
+        log.info("Agent %s: workers=%s, clock offset=%.3fs", self.address, self.workers, self.clock_offset)
+
+    def send_job(self, args, tests, total_concurrency, start_at):
+        self.reports = {params.worker_index: params.report for params in args}
+        job = {
+            "type": "job",
+            "params": [params_to_dict(params) for params in args],
+            "tests": tests,
+            "total_concurrency": total_concurrency,
+            "start_at": start_at + self.clock_offset}
+        send_message(self._stream, job)
+        self.start()
+
+    def close(self):
+        if self._socket is not None:
+            self._stream.close()
+            self._socket.close()
+
+    def _receive(self):
+        files = {}
+        try:
+            for worker_index, report in self.reports.items():
+                files[worker_index] = open(report, "wb")
+
+            while True:
+                message = read_message(self._stream)
+                if message is None:
+                    raise RuntimeError("Connection to agent is lost")
+                elif message["type"] == "results":
+                    payload = self._stream.read(message["size"])
+                    files[message["worker_index"]].write(zlib.decompress(payload))
+                elif message["type"] == "done":
+                    self.error = message.get("error")
+                    break
+        except BaseException as exc:
+            self.error = str(exc)
+        finally:
+            for fds in files.values():
+                fds.close()
+
+
+class Agent(socketserver.TCPServer):
+    """
+    Serves controller connections one by one, runs received slices of VUs with local worker processes
+    and streams compressed chunks of their reports back while test is running.
+    Agent runs any code it receives, so only controllers which know shared token are served.
+    """
+    allow_reuse_address = True
+
+    def __init__(self, address, workers, token):
+        if not token:
+            raise ValueError("Agent requires shared token of controllers")
+        super(Agent, self).__init__(address, AgentHandler)
+        self.workers = workers
+        self.token = token
+
+
+class AgentHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        hello = read_message(self.rfile)
+        if not hello or hello.get("type") != "hello":
+            log.warning("Wrong greeting from %s: %r", self.client_address, hello)
+            return
+
+        token = hello.get("token")
+        if not isinstance(token, str) or not hmac.compare_digest(token.encode(), self.server.token.encode()):
+            log.warning("Wrong token from %s", self.client_address)
+            send_message(self.wfile, {"type": "error", "error": "wrong token"})
+            return
+
+        send_message(self.wfile, {"type": "hello", "time": time.time(), "workers": self.server.workers})
+        job = read_message(self.rfile)
+        if not job:
+            return
+
+        log.info("Job from %s: %s slices of load", self.client_address, len(job["params"]))
+        work_dir = tempfile.mkdtemp(prefix="apiritif-agent-")
+        try:
+            self._run_job(job, work_dir)
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _run_job(self, job, work_dir):
+        tests = []
+        for file_name, content in job["tests"].items():
+            tests.append(os.path.join(work_dir, file_name))
+            with open(tests[-1], "w") as fds:
+                fds.write(content)
+
+        args = []
+        for data in job["params"]:
+            params = params_from_dict(data)
+            params.tests = tests
+            params.start_at = job["start_at"]
+            file_name = os.path.basename(params.report)  # keeps full extension, e.g. '.ldjson.gz'
+            params.report = os.path.join(work_dir, "worker%s-%s" % (params.worker_index, file_name))
+            args.append(params)
+
+        runner = JobRunner(args, job["total_concurrency"])
+        runner.start()
+        offsets = {params.worker_index: 0 for params in args}
+        while runner.is_alive():
+            runner.join(STREAM_INTERVAL)
+            self._stream_results(args, offsets, final=not runner.is_alive())
+
+        send_message(self.wfile, {"type": "done", "error": runner.error})
+
+    def _stream_results(self, args, offsets, final):
+        for params in args:
+            if not os.path.exists(params.report):
+                continue
+
+            with open(params.report, "rb") as fds:
+                fds.seek(offsets[params.worker_index])
+                chunk = fds.read()
+
+            if not final:  # send complete lines only, the rest is being written
+                chunk = chunk[:chunk.rfind(b"\n") + 1]
+            if chunk:
+                offsets[params.worker_index] += len(chunk)
+                payload = zlib.compress(chunk)
+                message = {"type": "results", "worker_index": params.worker_index, "size": len(payload)}
+                send_message(self.wfile, message, payload)
+
+
+class JobRunner(Thread):
+    """ Runs slices of VUs with pool of local worker processes """
+
+    def __init__(self, args, total_concurrency):
+        super(JobRunner, self).__init__(target=self._run)
+        self.daemon = True
+        self.args = args
+        self.total_concurrency = total_concurrency
+        self.error = None
+
+    def _run(self):
+        thread.set_total(self.total_concurrency)
+        workers = multiprocessing.Pool(processes=len(self.args))
+        try:
+            workers.map(spawn_worker, self.args)
+        except BaseException as exc:
+            log.error("Job failed: %s", exc)
+            self.error = "%s: %s" % (exc.__class__.__name__, exc)
+        finally:
+            workers.close()
+            workers.join()
@@ -15,25 +15,37 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import collections
 import copy
+import hashlib
 import os
-import threading
+import ssl
 import time
+from datetime import timedelta
 from functools import wraps
 from io import BytesIO
 
 import requests
 from jsonpath_ng.ext import parse as jsonpath_parse
 from lxml import etree, html
+from lxml.cssselect import CSSSelector
 from requests.structures import CaseInsensitiveDict
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
 
 import apiritif
-from apiritif.ssl_adapter import SSLAdapter
-from apiritif.thread import get_from_thread_store, put_into_thread_store
+from apiritif.async_client import AsyncSession
+from apiritif.ssl_adapter import SSLAdapter, CertificateReader
+from apiritif.thread import get_from_thread_store, put_into_thread_store, get_iteration, ContextLocal
 from apiritif.utilities import *
 from apiritif.utils import headers_as_text, assert_regexp, assert_not_regexp, log, get_trace, NormalShutdown, graceful
+from apiritif.utils import expressions, compile_regex
 
 BODY_LIMIT = int(os.environ.get("APIRITIF_TRACE_BODY_EXCLIMIT", "1024"))
+STREAM_CHUNK_SIZE = 64 * 1024
+POOL_SIZE = int(os.environ.get("APIRITIF_HTTP_POOL_SIZE", "10"))  # hosts and connections per host kept by one VU
+KEEP_ALIVE = bool(int(os.environ.get("APIRITIF_HTTP_KEEP_ALIVE", "1")))  # reuse connections of calls without session
+TLS_RESUMPTION = bool(int(os.environ.get("APIRITIF_TLS_RESUMPTION", "0")))  # resume TLS sessions in new connections
 
 
 class TimeoutError(Exception):
@@ -44,21 +56,140 @@ class ConnectionError(Exception):
     pass
 
 
+class TimedHTTPConnection(HTTPConnection):
+    sent_requests = 0  # since connection was opened
+    connect_time = None  # seconds of TCP connect
+    tls_handshake_time = None
+    tls_resumed = None
+
+    def _new_conn(self):
+        started = time.time()
+        sock = super(TimedHTTPConnection, self)._new_conn()
+        self.connect_time = time.time() - started
+        self.sent_requests = 0
+        return sock
+
+
+class TimedHTTPSConnection(TimedHTTPConnection, HTTPSConnection):
+    def connect(self):
+        started = time.time()
+        super(TimedHTTPSConnection, self).connect()
+        self.tls_handshake_time = time.time() - started - (self.connect_time or 0)
+        self.tls_resumed = getattr(self.sock, "session_reused", None)  # pyOpenSSL sockets don't tell it
+
+    def save_tls_session(self):
+        context = getattr(self.sock, "context", None)
+        if isinstance(context, ResumingSSLContext):
+            context.save_session(self.sock)
+
+    def close(self):
+        self.save_tls_session()  # response without keep-alive closes connection before adapter sees it
+        super(TimedHTTPSConnection, self).close()
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """ Client context which resumes TLS session of previous connection to the same server """
+
+    def __new__(cls):
+        return super(ResumingSSLContext, cls).__new__(cls, ssl.PROTOCOL_TLS_CLIENT)
+
+    def __init__(self):
+        super(ResumingSSLContext, self).__init__()
+        self.check_hostname = False  # urllib3 sets verification mode of context for every connection
+        self.minimum_version = ssl.TLSVersion.TLSv1_2
+        self.options |= ssl.OP_NO_COMPRESSION
+        self.sessions = {}  # (host, port) -> ssl.SSLSession
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        if kwargs.get("session") is None:
+            kwargs["session"] = self.sessions.get((kwargs.get("server_hostname"), sock.getpeername()[1]))
+        return super(ResumingSSLContext, self).wrap_socket(sock, *args, **kwargs)
+
+    def save_session(self, sock):
+        if sock.session is not None:  # it's known when tickets of TLS 1.3 are received after handshake
+            try:
+                self.sessions[(sock.server_hostname, sock.getpeername()[1])] = sock.session
+            except OSError:  # connection is already broken
+                pass
+
+
+class PoolingAdapter(requests.adapters.HTTPAdapter):
+    """
+    Counts requests sent over every connection and times new connections, so samples show if connection
+    was reused, how long TCP connect and TLS handshake took. New connections can resume TLS sessions.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, tls_resumption=TLS_RESUMPTION):
+        self.tls_resumption = tls_resumption
+        super(PoolingAdapter, self).__init__(pool_connections=pool_size, pool_maxsize=pool_size)
+
+    def init_poolmanager(self, *args, **kwargs):
+        if self.tls_resumption:
+            kwargs.setdefault("ssl_context", http.get_tls_context())  # client certificate adapter has its own
+        super(PoolingAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+    def send(self, request, **kwargs):
+        response = super(PoolingAdapter, self).send(request, **kwargs)
+        conn = getattr(response.raw, "connection", None)  # it's released when body is read
+        if isinstance(conn, TimedHTTPConnection):
+            conn.sent_requests += 1
+            response.connection_requests = conn.sent_requests
+            new = conn.sent_requests == 1
+            response.connect_time = conn.connect_time if new else 0.0
+            if conn.tls_handshake_time is not None:
+                response.tls_handshake_time = conn.tls_handshake_time if new else 0.0
+                response.tls_resumed = conn.tls_resumed if new else None
+                if new and conn.sock is not None:
+                    conn.save_tls_session()
+        return response
+
+
+class PoolingSSLAdapter(SSLAdapter, PoolingAdapter):
+    pass
+
+
+def create_session(adapter=None):
+    adapter = adapter or PoolingAdapter()
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
 class http(object):
     log = log.getChild('http')
+    local = ContextLocal()  # connection pool of VU
 
     @staticmethod
     def target(*args, **kwargs):
         return HTTPTarget(*args, **kwargs)
 
+    @staticmethod
+    def async_target(*args, **kwargs):
+        return AsyncHTTPTarget(*args, **kwargs)
+
     @staticmethod
     def request(method, address, session=None,
                 params=None, headers=None, cookies=None, data=None, json=None, files=None,
-                encrypted_cert=None, allow_redirects=True, timeout=30):
+                encrypted_cert=None, allow_redirects=True, timeout=30,
+                stream=False, hash_algorithm=None, chunk_callback=None):
         """
+        With stream=True response body isn't kept: it's read by chunks, only its size and hash are saved.
 
         :param method: str
         :param address: str
+        :param stream: bool
+        :param hash_algorithm: str, name of hashlib algorithm to calculate hash of streamed body
+        :param chunk_callback: callable to check (or save) every chunk of streamed body
         :return: response
         :rtype: HTTPResponse
         """
@@ -71,20 +202,167 @@ class http(object):
         if "User-Agent" not in headers:
             headers["User-Agent"] = "Apiritif"
 
-        if session is None:
-            session = requests.Session()
+        if session is None:  # cookies aren't kept between such calls, connections are
+            session = create_session(http.get_shared_adapter() if KEEP_ALIVE else None)
 
         if encrypted_cert is not None:
-            certificate_file_path, passphrase = encrypted_cert
-            adapter = SSLAdapter(certificate_file_path=certificate_file_path, passphrase=passphrase)
-            session.mount('https://', adapter)
+            adapter = http.get_ssl_adapter(*encrypted_cert)
+            if session.adapters.get('https://') is not adapter:  # mounting drops connections of previous adapter
+                session.mount('https://', adapter)
 
         request = requests.Request(method, address,
                                    params=params, headers=headers, cookies=cookies, json=json, data=data, files=files)
         prepared = session.prepare_request(request)
-        settings = session.merge_environment_settings(prepared.url, {}, False, False, None)
+        settings = session.merge_environment_settings(prepared.url, {}, stream, False, None)
+        digest = hashlib.new(hash_algorithm) if hash_algorithm else None
         try:
             response = session.send(prepared, allow_redirects=allow_redirects, timeout=timeout, **settings)
+            if stream:
+                body_size = http._read_stream(response, digest, chunk_callback)
+        except requests.exceptions.Timeout as exc:
+            recorder.record_http_request_failure(method, address, prepared, exc, session)
+            raise TimeoutError("Connection to %s timed out" % address)
+        except requests.exceptions.ConnectionError as exc:
+            recorder.record_http_request_failure(method, address, prepared, exc, session)
+            raise ConnectionError("Connection to %s failed" % address)
+        except BaseException as exc:
+            recorder.record_http_request_failure(method, address, prepared, exc, session)
+            raise
+        http.log.info("Response: %s %s", response.status_code, response.reason)
+        http.log.debug("Response headers: %r", response.headers)
+        http.log.debug("Response cookies: %r", {x: response.cookies.get(x) for x in response.cookies})
+        if stream:
+            wrapped_response = HTTPResponse(response, body_size, digest.hexdigest() if digest else None)
+        else:
+            http.log.debug('Response content: \n%s', response.content)
+            wrapped_response = HTTPResponse(response)
+        recorder.record_http_request(method, address, prepared, wrapped_response, session)
+        return wrapped_response
+
+    @staticmethod
+    def get_shared_adapter():
+        """ Adapter with connection pool of current VU, it's used by requests made without session """
+        adapter = getattr(http.local, "adapter", None)
+        if adapter is None:
+            adapter = http.local.adapter = PoolingAdapter()
+        return adapter
+
+    @staticmethod
+    def get_ssl_adapter(certificate_file_path, passphrase):
+        """ Adapter of current VU for client certificate, decrypted certificate is shared by all VUs """
+        certificate = CertificateReader.get_certificate(certificate_file_path, passphrase)
+        key = (certificate_file_path, passphrase)
+        adapters = getattr(http.local, "ssl_adapters", {})
+        adapter_certificate, adapter = adapters.get(key, (None, None))
+        if adapter_certificate is not certificate:  # certificate file is changed
+            if adapter is not None:
+                adapter.close()
+            adapter = PoolingSSLAdapter(ssl_context=CertificateReader.create_ssl_context(certificate))
+            adapters = dict(adapters)
+            adapters[key] = (certificate, adapter)
+            http.local.ssl_adapters = adapters
+        return adapter
+
+    @staticmethod
+    def get_tls_context():
+        """ Context of current VU, TLS sessions are resumed by all its connections that use this context """
+        context = getattr(http.local, "tls_context", None)
+        if context is None:
+            context = http.local.tls_context = ResumingSSLContext()
+        return context
+
+    @staticmethod
+    def close_shared_adapters():
+        adapters = [adapter for _, adapter in getattr(http.local, "ssl_adapters", {}).values()]
+        adapters.append(getattr(http.local, "adapter", None))
+        for adapter in adapters:
+            if adapter is not None:
+                adapter.close()
+        http.local.adapter = None
+        http.local.ssl_adapters = {}
+        http.local.tls_context = None  # next VU is a new user
+
+    @staticmethod
+    def get_shared_session(key, create_session, iterations=0):
+        """
+        Session of current VU for the key, it's kept across iterations to reuse connections.
+        Cookies are cleared when session is taken in new iteration, session is renewed every N iterations if set.
+        """
+        iteration = get_iteration()
+        sessions = getattr(http.local, "sessions", {})
+        entry = sessions.get(key)
+        if entry is not None:
+            session, first_iteration, last_iteration = entry
+            if iteration == last_iteration:
+                return session
+            if iterations and not first_iteration <= iteration < first_iteration + iterations:
+                session.close()
+                entry = None
+            else:
+                session.cookies.clear()
+
+        if entry is None:
+            session, first_iteration = create_session(), iteration
+
+        sessions = dict(sessions)  # values of context local are replaced, not changed in place
+        sessions[key] = (session, first_iteration, iteration)
+        http.local.sessions = sessions
+        return session
+
+    @staticmethod
+    def close_shared_sessions():
+        for session, _, _ in getattr(http.local, "sessions", {}).values():
+            session.close()
+        http.local.sessions = {}
+
+    @staticmethod
+    def _read_stream(response, digest, chunk_callback):
+        """ Reads body by chunks and drops it, elapsed time of response includes reading then """
+        started = time.time() - response.elapsed.total_seconds()
+        body_size = 0
+        for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+            body_size += len(chunk)
+            if digest is not None:
+                digest.update(chunk)
+            if chunk_callback is not None:
+                chunk_callback(chunk)
+
+        response._content = b""
+        response.latency = response.elapsed
+        response.elapsed = timedelta(seconds=time.time() - started)
+        return body_size
+
+    @staticmethod
+    async def async_request(method, address, session=None,
+                            params=None, headers=None, cookies=None, data=None, json=None, files=None,
+                            allow_redirects=True, timeout=30):
+        """
+        Coroutine version of request(), it sends request with AsyncSession without blocking of event loop
+
+        :param method: str
+        :param address: str
+        :type session: AsyncSession
+        :return: response
+        :rtype: HTTPResponse
+        """
+        http.log.info("Request: %s %s", method, address)
+        msg = "Request: params=%r, headers=%r, cookies=%r, data=%r, json=%r, files=%r, allow_redirects=%r, timeout=%r"
+        http.log.debug(msg, params, headers, cookies, data, json, files, allow_redirects, timeout)
+
+        if headers is None:
+            headers = {}
+        if "User-Agent" not in headers:
+            headers["User-Agent"] = "Apiritif"
+
+        own_session = session is None
+        if own_session:
+            session = AsyncSession()
+
+        request = requests.Request(method, address,
+                                   params=params, headers=headers, cookies=cookies, json=json, data=data, files=files)
+        prepared = session.prepare_request(request)
+        try:
+            response = await session.send_async(prepared, allow_redirects=allow_redirects, timeout=timeout)
         except requests.exceptions.Timeout as exc:
             recorder.record_http_request_failure(method, address, prepared, exc, session)
             raise TimeoutError("Connection to %s timed out" % address)
@@ -94,6 +372,9 @@ class http(object):
         except BaseException as exc:
             recorder.record_http_request_failure(method, address, prepared, exc, session)
             raise
+        finally:
+            if own_session:
+                await session.close_async()
         http.log.info("Response: %s %s", response.status_code, response.reason)
         http.log.debug("Response headers: %r", response.headers)
         http.log.debug("Response cookies: %r", {x: response.cookies.get(x) for x in response.cookies})
@@ -156,6 +437,12 @@ class transaction(object):
             self.fail("%s: %s" % (exc_type.__name__, str(exc_value)))
         self.finish()
 
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        return self.__exit__(exc_type, exc_value, traceback)
+
     def start(self, start_time=None):
         if self._start_ts is None:
             self._start_ts = start_time or time.time()
@@ -271,6 +558,8 @@ class smart_transaction(transaction_logged):
 
 
 class Event(object):
+    __slots__ = ("timestamp", "response")  # events of all requests are kept until recording is popped
+
     def __init__(self, response=None):
         self.timestamp = time.time()
         self.response = response
@@ -280,6 +569,8 @@ class Event(object):
 
 
 class Request(Event):
+    __slots__ = ("method", "address", "request", "session")
+
     def __init__(self, method, address, request, response, session):
         """
         :type method: str
@@ -299,6 +590,8 @@ class Request(Event):
 
 
 class RequestFailure(Request):
+    __slots__ = ("exception",)
+
     def __init__(self, method, address, request, exc, session):
         """
 
@@ -308,23 +601,63 @@ class RequestFailure(Request):
         :type exc: BaseException
         :type session: requests.Session
         """
+        super(RequestFailure, self).__init__(method, address, request, self.get_response(request), session)
+        self.method = method
+        self.address = address
+        self.request = request
+        self.exception = exc
+        self.session = session
+
+    @staticmethod
+    def get_response(request):
+        """ Fake response of failed request """
         response = requests.Response()
         response.request = request
         response.status_code = 999
         response._content = ""
+        return HTTPResponse(response)
+
+    def __repr__(self):
+        return "RequestFailure(method=%r, address=%r)" % (self.method, self.address)
 
-        super(RequestFailure, self).__init__(method, address, request, HTTPResponse(response), session)
+
+class RequestTiming(Event):
+    """ Lightweight record of request for 'timings' recording level, request and response objects aren't kept """
+    __slots__ = ("method", "address", "response_id", "status_code", "reason", "elapsed", "latency", "headers_size",
+                 "body_size", "body_hash", "connection_requests", "connect_time", "tls_handshake_time", "tls_resumed",
+                 "error")
+
+    def __init__(self, method, address, response, error=None):
+        """
+        :type method: str
+        :type address: str
+        :type response: HTTPResponse
+        :type error: BaseException
+        """
+        super(RequestTiming, self).__init__()
         self.method = method
         self.address = address
-        self.request = request
-        self.exception = exc
-        self.session = session
+        self.response_id = id(response)  # assertion failures are matched by it
+        self.status_code = response.status_code
+        self.reason = response.reason
+        self.elapsed = response.elapsed.total_seconds()
+        self.latency = response.latency.total_seconds()
+        self.headers_size = len(headers_as_text(response._response.headers))
+        self.body_size = response.body_size
+        self.body_hash = response.body_hash
+        self.connection_requests = response.connection_requests
+        self.connect_time = response.connect_time
+        self.tls_handshake_time = response.tls_handshake_time
+        self.tls_resumed = response.tls_resumed
+        self.error = error
 
     def __repr__(self):
-        return "RequestFailure(method=%r, address=%r)" % (self.method, self.address)
+        return "RequestTiming(method=%r, address=%r)" % (self.method, self.address)
 
 
 class TransactionStarted(Event):
+    __slots__ = ("transaction", "transaction_name")
+
     def __init__(self, transaction):
         super(TransactionStarted, self).__init__(None)
         self.transaction = transaction
@@ -335,6 +668,8 @@ class TransactionStarted(Event):
 
 
 class TransactionEnded(Event):
+    __slots__ = ("transaction", "transaction_name")
+
     def __init__(self, transaction):
         super(TransactionEnded, self).__init__()
         self.transaction = transaction
@@ -345,6 +680,8 @@ class TransactionEnded(Event):
 
 
 class Assertion(Event):
+    __slots__ = ("name", "extras")
+
     def __init__(self, name, response, extras):
         super(Assertion, self).__init__(response)
         self.name = name
@@ -355,6 +692,8 @@ class Assertion(Event):
 
 
 class AssertionFailure(Event):
+    __slots__ = ("name", "failure_message")
+
     def __init__(self, assertion_name, response, failure_message):
         super(AssertionFailure, self).__init__(response)
         self.name = assertion_name
@@ -364,36 +703,85 @@ class AssertionFailure(Event):
         return "Assertion(name=%r, failure_message=%r)" % (self.name, self.failure_message)
 
 
+class _Recording(object):
+    """
+    Events of one VU in order of recording (timestamps grow). Window is popped from the head, events older
+    than the window are put aside, so popping costs as many steps as many events are returned.
+    """
+    __slots__ = ("events", "stale", "dropped")
+
+    def __init__(self):
+        self.events = collections.deque()
+        self.stale = collections.deque()  # events skipped by windows, they're popped by earlier windows only
+        self.dropped = 0
+
+
 class _EventRecorder(object):
-    local = threading.local()
+    """
+    Recording levels:
+      - full: requests with request and response objects, every assertion call
+      - timings: label, time, status and size of requests, only failures of assertions
+      - off: requests and assertions aren't recorded, only transactions are
+    """
+    LEVELS = ("full", "timings", "off")
+    local = ContextLocal()
+    MAX_EVENTS = int(os.environ.get("APIRITIF_RECORDER_MAX_EVENTS", "100000"))  # oldest events are dropped then
 
     def __init__(self):
         self.log = log.getChild('recorder')
         self.log.debug("Creating recorder")
+        self.level = None
+        self.set_level(os.environ.get("APIRITIF_RECORDING_LEVEL", "full"))
+
+    def set_level(self, level):
+        if level not in self.LEVELS:
+            raise ValueError("Unknown recording level: %r, one of %s expected" % (level, ", ".join(self.LEVELS)))
+        self.level = level
 
     def get_recording(self):
         rec = getattr(self.local, 'recording', None)
         if rec is None:
-            self.local.recording = []
-        return self.local.recording
+            rec = self.local.recording = _Recording()
+        return rec
+
+    def get_dropped_count(self):
+        return self.get_recording().dropped
 
     def pop_events(self, from_ts, to_ts):
         recording = self.get_recording()
         collected = []
-        new_recording = []
-        for event in recording:
-            if from_ts <= event.timestamp <= to_ts:
+        stale = recording.stale
+        if stale and from_ts <= stale[-1].timestamp and stale[0].timestamp <= to_ts:
+            kept = collections.deque()
+            for event in stale:
+                if from_ts <= event.timestamp <= to_ts:
+                    collected.append(event)
+                else:
+                    kept.append(event)
+            recording.stale = kept
+
+        events = recording.events
+        while events and events[0].timestamp <= to_ts:
+            event = events.popleft()
+            if from_ts <= event.timestamp:
                 collected.append(event)
             else:
-                new_recording.append(event)
-        del recording[:]
-        recording.extend(new_recording)
+                recording.stale.append(event)
+
         return collected
 
     def record_event(self, event):
         self.log.debug("Recording event %r", event)
         recording = self.get_recording()
-        recording.append(event)
+        recording.events.append(event)
+        if len(recording.events) + len(recording.stale) > self.MAX_EVENTS:
+            if recording.stale:
+                recording.stale.popleft()
+            else:
+                recording.events.popleft()
+            if not recording.dropped:
+                self.log.warning("Too many events aren't popped from recording, the oldest ones are dropped")
+            recording.dropped += 1
 
     def record_transaction_start(self, tran):
         self.record_event(TransactionStarted(tran))
@@ -406,11 +794,16 @@ class _EventRecorder(object):
             self.log.info(u"Transaction ended:: duration=%.3f,name=%s", tran.duration(), tran.name)
 
     def record_http_request(self, method, address, request, response, session):
-        self.record_event(Request(method, address, request, response, session))
+        if self.level == "full":
+            self.record_event(Request(method, address, request, response, session))
+        elif self.level == "timings":
+            self.record_event(RequestTiming(method, address, response))
 
     def record_http_request_failure(self, method, address, request, exception, session):
-        failure = RequestFailure(method, address, request, exception, session)
-        self.record_event(failure)
+        if self.level == "full":
+            self.record_event(RequestFailure(method, address, request, exception, session))
+        elif self.level == "timings":
+            self.record_event(RequestTiming(method, address, RequestFailure.get_response(request), exception))
 
     def record_assertion(self, assertion_name, target_response, extras):
         self.record_event(Assertion(assertion_name, target_response, extras))
@@ -422,9 +815,13 @@ class _EventRecorder(object):
     def assertion_decorator(assertion_method):
         @wraps(assertion_method)
         def _impl(self, *method_args, **method_kwargs):
+            if recorder.level == "off":
+                return assertion_method(self, *method_args, **method_kwargs)
+
             assertion_name = getattr(assertion_method, '__name__', 'assertion')
-            extras = {"args": list(method_args), "kwargs": method_kwargs}
-            recorder.record_assertion(assertion_name, self, extras)
+            if recorder.level == "full":
+                extras = {"args": list(method_args), "kwargs": method_kwargs}
+                recorder.record_assertion(assertion_name, self, extras)
             try:
                 return assertion_method(self, *method_args, **method_kwargs)
             except BaseException as exc:
@@ -449,7 +846,10 @@ class HTTPTarget(object):
                  allow_redirects=True,
                  session=None,
                  cert=None,
-                 encrypted_cert=None):
+                 encrypted_cert=None,
+                 share_session=False,
+                 session_iterations=0,
+                 tls_resumption=TLS_RESUMPTION):
         self.address = address
         # config flags
         self._base_path = base_path
@@ -459,8 +859,12 @@ class HTTPTarget(object):
         self._auto_assert_ok = auto_assert_ok
         self._timeout = timeout
         self._allow_redirects = allow_redirects
+        self._share_session = share_session  # take session from VU registry, it outlives target
+        self._session_iterations = session_iterations  # renew shared session every N iterations (0 - never)
+        self._tls_resumption = tls_resumption  # new connections resume TLS session of previous ones
         # internal vars
         self.__session = session
+        self.__session_key = (type(self).__name__, address, repr(cert), repr(encrypted_cert), tls_resumption)
 
     def use_cookies(self, use=True):
         self._use_cookies = use
@@ -490,6 +894,26 @@ class HTTPTarget(object):
         self._allow_redirects = value
         return self
 
+    def share_session(self, share=True, iterations=0):
+        self._share_session = share
+        self._session_iterations = iterations
+        return self
+
+    def _get_session(self):
+        if self._keep_alive and self._share_session:
+            self.__session = http.get_shared_session(self.__session_key, self._create_session,
+                                                     self._session_iterations)
+        elif self._keep_alive and self.__session is None:
+            self.__session = self._create_session()
+
+        if self.__session is not None and not self._use_cookies:
+            self.__session.cookies.clear()
+
+        return self.__session
+
+    def _create_session(self):
+        return create_session(PoolingAdapter(tls_resumption=self._tls_resumption))
+
     def _bake_address(self, path):
         addr = self.address
         if self._base_path is not None:
@@ -499,9 +923,10 @@ class HTTPTarget(object):
 
     def request(self, method, path,
                 params=None, headers=None, cookies=None, data=None, json=None, files=None,
-                allow_redirects=None, timeout=None):
+                allow_redirects=None, timeout=None, stream=False, hash_algorithm=None, chunk_callback=None):
         """
         Prepares and sends an HTTP request. Returns the HTTPResponse object.
+        See http.request() for streaming options.
 
         :param method: str
         :param path: str
@@ -512,19 +937,15 @@ class HTTPTarget(object):
         timeout = timeout if timeout is not None else self._timeout
         allow_redirects = allow_redirects if allow_redirects is not None else self._allow_redirects
 
-        if self._keep_alive and self.__session is None:
-            self.__session = requests.Session()
-
-        if self.__session is not None and not self._use_cookies:
-            self.__session.cookies.clear()
-
         address = self._bake_address(path)
         req_headers = copy.deepcopy(self._additional_headers)
         req_headers.update(headers)
 
-        response = http.request(method, address, session=self.__session,
+        session = self._get_session() or create_session()  # new connection for every request without keep-alive
+        response = http.request(method, address, session=session,
                                 params=params, headers=req_headers, cookies=cookies, data=data, json=json, files=files,
-                                allow_redirects=allow_redirects, timeout=timeout)
+                                allow_redirects=allow_redirects, timeout=timeout,
+                                stream=stream, hash_algorithm=hash_algorithm, chunk_callback=chunk_callback)
         if self._auto_assert_ok:
             response.assert_ok()
         return response
@@ -555,10 +976,69 @@ class HTTPTarget(object):
         return self.request("CONNECT", path, **kwargs)
 
 
+class AsyncHTTPTarget(HTTPTarget):
+    """ HTTPTarget for coroutine tests, its request methods must be awaited """
+
+    @staticmethod
+    def _create_session():
+        return AsyncSession()
+
+    async def request(self, method, path,
+                      params=None, headers=None, cookies=None, data=None, json=None, files=None,
+                      allow_redirects=None, timeout=None):
+        """
+        Prepares and sends an HTTP request. Returns the HTTPResponse object.
+
+        :param method: str
+        :param path: str
+        :return: response
+        :rtype: HTTPResponse
+        """
+        headers = headers or {}
+        timeout = timeout if timeout is not None else self._timeout
+        allow_redirects = allow_redirects if allow_redirects is not None else self._allow_redirects
+
+        address = self._bake_address(path)
+        req_headers = copy.deepcopy(self._additional_headers)
+        req_headers.update(headers)
+
+        response = await http.async_request(method, address, session=self._get_session(),
+                                            params=params, headers=req_headers, cookies=cookies, data=data,
+                                            json=json, files=files, allow_redirects=allow_redirects,
+                                            timeout=timeout)
+        if self._auto_assert_ok:
+            response.assert_ok()
+        return response
+
+
+class cached_attribute(object):
+    """
+    Like functools.cached_property but without lock (it's common for all instances in python < 3.12):
+    value is computed on first access and saved as instance attribute, which hides the descriptor then
+    """
+
+    def __init__(self, func):
+        self.func = func
+        self.name = func.__name__
+        self.__doc__ = func.__doc__
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        value = instance.__dict__[self.name] = self.func(instance)
+        return value
+
+
+def get_css_selector(query):
+    """ Translation of selector into XPath is shared by threads, compiled evaluator isn't """
+    xpath = expressions.get("css_xpath", query, lambda expr: CSSSelector(expr, translator="html").path)
+    return etree.XPath(xpath)  # the same translator as HtmlElement.cssselect() uses
+
+
 class HTTPResponse(object):
-    def __init__(self, py_response):
+    def __init__(self, py_response, body_size=None, body_hash=None):
         """
-        Construct HTTPResponse from requests.Response object
+        Construct HTTPResponse from requests.Response object, body size and hash are given for streamed response
 
         :type py_response: requests.Response
         """
@@ -567,20 +1047,59 @@ class HTTPResponse(object):
         self.status_code = int(py_response.status_code)
         self.reason = py_response.reason
 
-        self.headers = CaseInsensitiveDict(py_response.headers)
-        self.cookies = {x: py_response.cookies.get(x) for x in py_response.cookies}
-
-        self.text = py_response.text
-        self.content = py_response.content
+        self.content = py_response.content  # headers, cookies and text are made on first access
+        self.streamed = body_size is not None
+        self.body_size = body_size if self.streamed else len(self.content or "")
+        self.body_hash = body_hash
 
         self.elapsed = py_response.elapsed
+        self.latency = getattr(py_response, "latency", py_response.elapsed)  # time to first byte
+        self.connection_requests = getattr(py_response, "connection_requests", None)  # 1 for new connection
+        self.connect_time = getattr(py_response, "connect_time", None)  # seconds, 0 for reused connection
+        self.tls_handshake_time = getattr(py_response, "tls_handshake_time", None)
+        self.tls_resumed = getattr(py_response, "tls_resumed", None)
 
         self._response = py_response
         self._request = py_response.request
+        self._parsed = {}  # parser options -> parsed body
+
+    @cached_attribute
+    def headers(self):
+        return CaseInsensitiveDict(self._response.headers)
+
+    @cached_attribute
+    def cookies(self):
+        return {x: self._response.cookies.get(x) for x in self._response.cookies}
+
+    @cached_attribute
+    def text(self):
+        return self._response.text  # decoding of big body (with charset detection) might be slow
 
     def json(self):
         return self._response.json()
 
+    def _get_parsed(self, key, parse):
+        """ Body is parsed once for all assertions and extractors which use the same parser """
+        if key not in self._parsed:
+            self._parsed[key] = parse()
+        return self._parsed[key]
+
+    def _get_json(self):
+        return self._get_parsed(("json",), self.json)
+
+    def _get_tree(self, parser_type, validate):
+        def parse():
+            parser = etree.HTMLParser() if parser_type == 'html' else etree.XMLParser(dtd_validation=validate)
+            return etree.parse(BytesIO(self.content), parser)
+
+        return self._get_parsed(("tree", parser_type, validate), parse)
+
+    def _get_html(self):
+        return self._get_parsed(("html",), lambda: html.fromstring(self.text))
+
+    def _get_headers_text(self):
+        return self._get_parsed(("headers",), lambda: headers_as_text(self.headers))
+
     def __eq__(self, other):
         """
         :type other: HTTPResponse
@@ -596,7 +1115,7 @@ class HTTPResponse(object):
                and self.content == other.content
 
     def __hash__(self):
-        return hash((self.url, self.method, self.status_code, self.reason, self.text, self.content))
+        return hash((self.url, self.method, self.status_code, self.reason, self.content))
 
     def __repr__(self):
         params = (self.method, self.url, self.status_code, self.reason)
@@ -671,6 +1190,24 @@ class HTTPResponse(object):
             raise AssertionError(msg)
         return self
 
+    @recorder.assertion_decorator
+    def assert_body_size(self, size, msg=None):
+        if self.body_size != size:
+            msg = msg or "Size of response body (%s) isn't equal to expected %s" % (self.body_size, size)
+            raise AssertionError(msg)
+        return self
+
+    @recorder.assertion_decorator
+    def assert_body_hash(self, expected_hash, msg=None):
+        if self.body_hash is None:
+            if self.streamed:
+                raise ValueError("Hash of streamed body is calculated with 'hash_algorithm' option of request only")
+            self.body_hash = hashlib.sha256(self.content).hexdigest()
+        if self.body_hash != expected_hash.lower():
+            msg = msg or "Hash of response body (%s) isn't equal to expected %s" % (self.body_hash, expected_hash)
+            raise AssertionError(msg)
+        return self
+
     @recorder.assertion_decorator
     def assert_in_body(self, member, msg=None):
         if member not in self.text:
@@ -715,7 +1252,7 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_in_headers(self, member, msg=None):
-        headers_text = headers_as_text(self.headers)
+        headers_text = self._get_headers_text()
         if member not in headers_text:
             msg = msg or "Header %s wasn't found in response headers text: %r" % (member, headers_text)
             raise AssertionError(msg)
@@ -723,25 +1260,25 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_not_in_headers(self, member, msg=None):
-        if member in headers_as_text(self.headers):
+        if member in self._get_headers_text():
             msg = msg or "Header %s was found in response headers text" % member
             raise AssertionError(msg)
         return self
 
     @recorder.assertion_decorator
     def assert_regex_in_headers(self, member, msg=None):
-        assert_regexp(member, headers_as_text(self.headers), msg=msg)
+        assert_regexp(member, self._get_headers_text(), msg=msg)
         return self
 
     @recorder.assertion_decorator
     def assert_regex_not_in_headers(self, member, msg=None):
-        assert_not_regexp(member, headers_as_text(self.headers), msg=msg)
+        assert_not_regexp(member, self._get_headers_text(), msg=msg)
         return self
 
     @recorder.assertion_decorator
     def assert_jsonpath(self, jsonpath_query, expected_value=None, msg=None):
-        jsonpath_expr = jsonpath_parse(jsonpath_query)
-        body = self.json()
+        jsonpath_expr = expressions.get("jsonpath", jsonpath_query, jsonpath_parse)
+        body = self._get_json()
         matches = jsonpath_expr.find(body)
         if not matches:
             msg = msg or "JSONPath query %r didn't match response: %s" % (jsonpath_query, self.text[:BODY_LIMIT])
@@ -755,8 +1292,8 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_not_jsonpath(self, jsonpath_query, msg=None):
-        jsonpath_expr = jsonpath_parse(jsonpath_query)
-        body = self.json()
+        jsonpath_expr = expressions.get("jsonpath", jsonpath_query, jsonpath_parse)
+        body = self._get_json()
         matches = jsonpath_expr.find(body)
         if matches:
             msg = msg or "JSONPath query %r did match response: %s" % (jsonpath_query, self.text[:BODY_LIMIT])
@@ -765,9 +1302,8 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_xpath(self, xpath_query, parser_type='html', validate=False, msg=None):
-        parser = etree.HTMLParser() if parser_type == 'html' else etree.XMLParser(dtd_validation=validate)
-        tree = etree.parse(BytesIO(self.content), parser)
-        matches = tree.xpath(xpath_query)
+        tree = self._get_tree(parser_type, validate)
+        matches = expressions.get_local("xpath", xpath_query, etree.XPath)(tree)
         if not matches:
             msg = msg or "XPath query %r didn't match response content: %s" % (xpath_query, self.text[:BODY_LIMIT])
             raise AssertionError(msg)
@@ -775,9 +1311,8 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_not_xpath(self, xpath_query, parser_type='html', validate=False, msg=None):
-        parser = etree.HTMLParser() if parser_type == 'html' else etree.XMLParser(dtd_validation=validate)
-        tree = etree.parse(BytesIO(self.content), parser)
-        matches = tree.xpath(xpath_query)
+        tree = self._get_tree(parser_type, validate)
+        matches = expressions.get_local("xpath", xpath_query, etree.XPath)(tree)
         if matches:
             msg = msg or "XPath query %r did match response content: %s" % (xpath_query, self.text[:BODY_LIMIT])
             raise AssertionError(msg)
@@ -785,8 +1320,8 @@ class HTTPResponse(object):
 
     @recorder.assertion_decorator
     def assert_cssselect(self, query, expected_value=None, attribute=None, msg=None):
-        tree = html.fromstring(self.text)
-        q = tree.cssselect(query)
+        tree = self._get_html()
+        q = expressions.get_local("css", query, get_css_selector)(tree)
         vals = [(x.text if attribute is None else x.attrib[attribute]) for x in q]
 
         matches = expected_value in vals if expected_value is not None else vals
@@ -805,26 +1340,48 @@ class HTTPResponse(object):
         msg = msg or "CSSSelect query %r did match response content: %s" % (query, self.text[:BODY_LIMIT])
         raise AssertionError(msg)
 
+    def assert_all(self, checks, msg=None):
+        """
+        Evaluates all checks of AssertionSet (or list of tuples to make it) and records them as one assertion,
+        AssertionError lists all failed checks
+        """
+        if not isinstance(checks, AssertionSet):
+            checks = AssertionSet(checks)
+
+        if recorder.level == "full":
+            recorder.record_assertion("assert_all", self, {"args": checks.to_list(), "kwargs": {}})
+        try:
+            failures = checks.evaluate(self)
+            if failures:
+                raise AssertionError(msg or "%s of %s checks failed: %s" % (
+                    len(failures), len(checks.checks), "; ".join(failures)))
+        except BaseException as exc:
+            if recorder.level != "off":
+                recorder.record_assertion_failure("assert_all", self, str(exc))
+            raise
+        return self
+
     # TODO: assertTiming? to assert response time / connection time
 
     def extract_regex(self, regex, default=None):
         extracted_value = default
-        for item in re.finditer(regex, self.text):
+        for item in compile_regex(regex).finditer(self.text):
             extracted_value = item
             break
         return extracted_value
 
     def extract_jsonpath(self, jsonpath_query, default=None):
-        jsonpath_expr = jsonpath_parse(jsonpath_query)
-        body = self.json()
+        jsonpath_expr = expressions.get("jsonpath", jsonpath_query, jsonpath_parse)
+        body = self._get_json()
         matches = jsonpath_expr.find(body)
         if not matches:
             return default
-        return matches[0].value
+        value = matches[0].value
+        return copy.deepcopy(value) if isinstance(value, (list, dict)) else value  # parsed body is shared
 
     def extract_cssselect(self, selector, attribute=None, default=None):
-        tree = html.fromstring(self.text)
-        q = tree.cssselect(selector)
+        tree = self._get_html()
+        q = expressions.get_local("css", selector, get_css_selector)(tree)
         matches = [(x.text if attribute is None else x.attrib[attribute]) for x in q]
 
         if not matches:
@@ -832,10 +1389,121 @@ class HTTPResponse(object):
         return matches[0]
 
     def extract_xpath(self, xpath_query, default=None, parser_type='html', validate=False):
-        parser = etree.HTMLParser() if parser_type == 'html' else etree.XMLParser(dtd_validation=validate)
-        tree = etree.parse(BytesIO(self.content), parser)
-        matches = tree.xpath(xpath_query)
+        tree = self._get_tree(parser_type, validate)
+        matches = expressions.get_local("xpath", xpath_query, etree.XPath)(tree)
         if not matches:
             return default
         match = matches[0]
         return match.text
+
+
+class AssertionSet(object):
+    """
+    Checks for HTTPResponse.assert_all(): expressions are compiled when check is added, so the set can be built
+    once and used for many responses. Body is decoded and parsed, headers text is made once for all checks.
+    """
+    KINDS = ("status_code", "in_body", "not_in_body", "regex_in_body", "regex_not_in_body",
+             "has_header", "header_value", "in_headers", "not_in_headers", "regex_in_headers",
+             "regex_not_in_headers", "jsonpath", "not_jsonpath")
+
+    def __init__(self, checks=()):
+        self.checks = []  # (kind, args, check function)
+        for check in checks:
+            self.add(*check)
+
+    def add(self, kind, *args):
+        if kind not in self.KINDS:
+            raise ValueError("Unknown check %r, supported ones are: %s" % (kind, ", ".join(self.KINDS)))
+
+        if kind.startswith("regex_"):
+            compiled = compile_regex(args[0])
+        elif kind.endswith("jsonpath"):
+            compiled = expressions.get("jsonpath", args[0], jsonpath_parse)
+        else:
+            compiled = None
+        check = getattr(self, "_check_" + kind)
+        self.checks.append((kind, args, lambda response: check(response, compiled, *args)))
+        return self
+
+    def to_list(self):
+        return [[kind] + list(args) for kind, args, _ in self.checks]
+
+    def evaluate(self, response):
+        """ Returns messages of failed checks """
+        failures = []
+        for _, _, check in self.checks:
+            message = check(response)
+            if message:
+                failures.append(message)
+        return failures
+
+    @staticmethod
+    def _check_status_code(response, _, code):
+        if str(response.status_code) != str(code):
+            return "Actual status code (%s) didn't match expected (%s)" % (response.status_code, code)
+
+    @staticmethod
+    def _check_in_body(response, _, member):
+        if member not in response.text:
+            return "%r wasn't found in response body" % member
+
+    @staticmethod
+    def _check_not_in_body(response, _, member):
+        if member in response.text:
+            return "%r was found in response body" % member
+
+    @staticmethod
+    def _check_regex_in_body(response, regex, pattern):
+        if regex.search(response.text) is None:
+            return "Regex %r didn't find anything in response body" % pattern
+
+    @staticmethod
+    def _check_regex_not_in_body(response, regex, pattern):
+        if regex.search(response.text) is not None:
+            return "Regex %r unexpectedly found something in response body" % pattern
+
+    @staticmethod
+    def _check_has_header(response, _, header):
+        if header not in response.headers:
+            return "Header %s wasn't found in response headers" % header
+
+    @staticmethod
+    def _check_header_value(response, _, header, value):
+        actual = response.headers.get(header)
+        if actual != value:
+            return "Actual value of header %s (%r) isn't equal to expected (%r)" % (header, actual, value)
+
+    @staticmethod
+    def _check_in_headers(response, _, member):
+        if member not in response._get_headers_text():
+            return "Header %s wasn't found in response headers text" % member
+
+    @staticmethod
+    def _check_not_in_headers(response, _, member):
+        if member in response._get_headers_text():
+            return "Header %s was found in response headers text" % member
+
+    @staticmethod
+    def _check_regex_in_headers(response, regex, pattern):
+        if regex.search(response._get_headers_text()) is None:
+            return "Regex %r didn't find anything in response headers" % pattern
+
+    @staticmethod
+    def _check_regex_not_in_headers(response, regex, pattern):
+        if regex.search(response._get_headers_text()) is not None:
+            return "Regex %r unexpectedly found something in response headers" % pattern
+
+    @staticmethod
+    def _check_jsonpath(response, jsonpath_expr, query, expected_value=None):
+        matches = jsonpath_expr.find(response._get_json())
+        if not matches:
+            return "JSONPath query %r didn't match response" % query
+        actual_value = matches[0].value
+        if expected_value is not None and actual_value != expected_value:
+            return "Actual value at JSONPath query %r (%r) isn't equal to expected (%r)" % (
+                query, actual_value, expected_value)
+
+    @staticmethod
+    def _check_not_jsonpath(response, jsonpath_expr, query):
+        if jsonpath_expr.find(response._get_json()):
+            return "JSONPath query %r did match response" % query
@@ -14,32 +14,45 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import asyncio
+import contextvars
 import copy
+import gzip
+import importlib
+import inspect
 import unicodecsv as csv
 import json
 import logging
 import multiprocessing
+import math
 import os
+import queue
+import shutil
 import sys
 import time
 import traceback
+import types
+import unittest
+from io import BytesIO
+from unittest.suite import _ErrorHolder
+from unittest.util import strclass
 from multiprocessing.pool import ThreadPool
 from optparse import OptionParser
-from threading import Thread
+from threading import Thread, Semaphore, Event, Lock
 
 from nose2.main import PluggableTestProgram
 from nose2.events import Plugin
+from nose2.plugins.loader.functions import FunctionTestCase
+from nose2.util import transplant_class, num_expected_args
 
 import apiritif
 import apiritif.thread as thread
 import apiritif.store as store
 from apiritif.action_plugins import ActionHandlerFactory, import_plugins
-from apiritif.utils import NormalShutdown, log, get_trace, VERSION, graceful
+from apiritif.utils import NormalShutdown, log, get_trace, VERSION, graceful, to_json_line
 
 
-# TODO how to implement hits/s control/shape?
 # TODO: VU ID for script
-# TODO: disable assertions for load mode
 
 
 def spawn_worker(params):
@@ -51,7 +64,7 @@ def spawn_worker(params):
     setup_logging(params)
     log.info("Adding worker: idx=%s\tconcurrency=%s\tresults=%s", params.worker_index, params.concurrency,
              params.report)
-    worker = Worker(params)
+    worker = AsyncWorker(params) if params.engine == "asyncio" else Worker(params)
     worker.start()
     worker.join()
 
@@ -72,7 +85,21 @@ class Params(object):
         self.steps = 0
         self.hold_for = 0
 
+        self.arrival_rate = 0  # iterations per second, zero means closed workload model
+        self.load_profile = None  # stages of concurrency (or arrival rate) changing
+
         self.verbose = False
+        self.runner = "nose2"  # 'nose2' prepares tests every iteration, 'persistent' does it once per VU,
+        # 'native' runs tests without nose2
+        self.fixtures_scope = "iteration"  # 'vu' runs class and module fixtures once per VU (native runner only)
+        self.engine = "threads"  # 'threads' runs every VU in own thread, 'asyncio' runs VUs as tasks of event loop
+        self.start_at = 0  # timestamp of synchronized start (distributed mode), zero means 'right now'
+        self.agents = []  # addresses of agents to run the test on (distributed mode)
+        self.listen = None  # address to serve controller connections on (agent mode)
+        self.token = None  # shared secret of controller and agents (distributed mode)
+        self.aggregate = 0  # interval of aggregated results (seconds), zero means writing of all samples
+        self.keep_failures = False  # write failed samples along with aggregates
+        self.recording = "full"  # 'timings' records requests without bodies and failed assertions only, 'off' - none
 
         self.tests = None
 
@@ -112,8 +139,13 @@ class Supervisor(Thread):
             params.worker_index = idx
             params.thread_index = total_concurrency  # for subprocess it's index of its first thread
             params.concurrency = conc
-            params.report = self.params.report % idx
+            params.report = self._get_worker_report(idx)
             params.worker_count = self.params.worker_count
+            if self.params.arrival_rate:  # rate and iterations limit are shared by workers proportionally
+                params.arrival_rate = self.params.arrival_rate * conc / self.params.concurrency
+                params.iterations = self._get_iterations_slice(total_concurrency, total_concurrency + conc)
+            if self.params.load_profile:
+                params.load_profile = self.params.load_profile.scaled(conc / float(self.params.concurrency))
 
             total_concurrency += conc
 
@@ -121,6 +153,28 @@ class Supervisor(Thread):
 
         assert total_concurrency == self.params.concurrency
 
+    def _get_iterations_slice(self, first_thread, last_thread):
+        iterations, concurrency = self.params.iterations, self.params.concurrency
+        if iterations >= sys.maxsize:
+            return iterations
+        return iterations * last_thread // concurrency - iterations * first_thread // concurrency
+
+    def _get_worker_report(self, idx):
+        if "%s" in self.params.report:
+            return self.params.report % idx
+        elif self.params.worker_count == 1:
+            return self.params.report
+        else:  # several workers write parts of common report, it'll be merged after all
+            dir_name, file_name = os.path.split(self.params.report)
+            return os.path.join(dir_name, "worker%s-%s" % (idx, file_name))
+
+    def _merge_reports(self, parts):
+        log.info("Merging %s worker reports into %s", len(parts), self.params.report)
+        writer_class = get_writer_class(self.params.report, self.params.aggregate)
+        writer_class.merge(parts, self.params.report)
+        for part in parts:
+            os.remove(part)
+
     def _start_workers(self):
         log.info("Total workers: %s", self.params.worker_count)
 
@@ -133,6 +187,13 @@ class Supervisor(Thread):
         finally:
             self.workers.close()
             self.workers.join()
+
+        self._finish_reports(args)
+
+    def _finish_reports(self, args):
+        reports = [params.report for params in args]
+        if self.params.report not in reports and "%s" not in self.params.report:
+            self._merge_reports([report for report in reports if os.path.exists(report)])
         # TODO: watch the total test duration, if set, 'cause iteration might last very long
 
 
@@ -146,32 +207,122 @@ class ApiritifSession(PluggableTestProgram.sessionClass):
             self.stop_reason = msg
 
 
-class Worker(ThreadPool):
+class VUSession(object):
+    """ Lightweight replacement of ApiritifSession for runners which don't use nose2 """
+
+    def __init__(self):
+        self.stop_reason = ""
+
+    def set_stop_reason(self, msg):
+        if not self.stop_reason:
+            self.stop_reason = msg
+
+
+class VUMixin(object):
+    """
+    VU logic which is shared by thread and asyncio workers
+    :type params: Params
+    :type start_time: float
+    """
+
+    def _get_end_time(self):
+        end_time = self.params.ramp_up + self.params.hold_for
+        if self.params.load_profile:
+            end_time = self.params.load_profile.duration
+        return end_time + self.start_time if end_time else 0
+
+    def _get_activation_delay(self, params):
+        """
+        :return: time to wait while concurrency of load profile is lower than VU index, None if VU is finished
+        """
+        vu_index = params.thread_index - self.params.thread_index
+        offset = time.time() - self.start_time
+        activation = self.params.load_profile.get_activation_offset(vu_index, offset)
+        if activation is None:
+            return None
+
+        return max(activation - offset, 0)
+
+    @staticmethod
+    def _is_finished(params, session, iteration, end_time, check_iterations=True):
+        if session.stop_reason:
+            if "Nothing to test." in session.stop_reason:
+                raise RuntimeError("Nothing to test.")
+            elif session.stop_reason.startswith(NormalShutdown.__name__):
+                log.info(session.stop_reason)
+            else:
+                raise RuntimeError(f"Unknown stop_reason: {session.stop_reason}")
+        elif 0 < params.iterations <= iteration and check_iterations:
+            log.debug("[%s] iteration limit reached: %s", params.worker_index, params.iterations)
+        elif 0 < end_time <= time.time():
+            log.debug("[%s] duration limit reached: %s", params.worker_index, params.hold_for)
+        else:
+            return False  # continue if no one is faced
+
+        return True
+
+    @staticmethod
+    def _close_connections():
+        """ Connection pools and sessions of VU live in its context, they must be closed when VU is finished """
+        apiritif.http.close_shared_adapters()
+        apiritif.http.close_shared_sessions()
+
+    def _wait_for_start(self):
+        delay = self.params.start_at - time.time()
+        if delay > 0:
+            log.info("Waiting %.3fs for synchronized start", delay)
+            time.sleep(delay)
+
+    def _get_thread_params(self):
+        if not self.params.steps or self.params.steps < 0:
+            self.params.steps = sys.maxsize
+
+        step_granularity = self.params.ramp_up / self.params.steps
+        ramp_up_per_thread = self.params.ramp_up / self.params.concurrency
+        for thr_idx in range(self.params.concurrency):
+            offset = self.params.worker_index * ramp_up_per_thread / float(self.params.worker_count)
+            delay = offset + thr_idx * float(self.params.ramp_up) / self.params.concurrency
+            delay -= delay % step_granularity if step_granularity else 0
+            if self.params.arrival_rate or self.params.load_profile:
+                delay = 0  # all VUs are idle from the start, load is controlled by rate or profile
+            params = copy.deepcopy(self.params)
+            params.thread_index = self.params.thread_index + thr_idx
+            params.delay = delay
+            yield params
+
+
+class Worker(ThreadPool, VUMixin):
     def __init__(self, params):
         """
         :type params: Params
         """
         super(Worker, self).__init__(params.concurrency)
         self.params = params
-        if self.params.report.lower().endswith(".ldjson"):
-            store.writer = LDJSONSampleWriter(self.params.report)
-        else:
-            store.writer = JTLSampleWriter(self.params.report)
+        self.scheduler = None
+        self.start_time = time.time()
+        store.writer = create_writer(self.params)
+        apiritif.recorder.set_level(self.params.recording)
 
     def start(self):
         import_plugins()
         params = list(self._get_thread_params())
+        self._wait_for_start()
+        self.start_time = time.time()
+        self.scheduler = None
+        if self.params.arrival_rate:
+            self.scheduler = ArrivalScheduler(self.params)
+            self.scheduler.start()
+
         with store.writer:  # writer must be closed finally
             try:
                 self.map(self.run_nose, params)
             finally:
+                if self.scheduler:
+                    self.scheduler.stop()
                 self.close()
 
     def close(self):
-        log.info("Workers finished, awaiting result writer")
-        while not store.writer.is_queue_empty() and store.writer.is_alive():
-            time.sleep(0.1)
-        log.info("Results written, shutting down")
+        log.info("Workers finished, awaiting result writer")  # it's closed by the end of 'with' block
         super(Worker, self).close()
 
     def run_nose(self, params):
@@ -186,14 +337,14 @@ class Worker(ThreadPool):
         assert isinstance(params.tests, list)
         # argv.extend(['--with-apiritif', '--nocapture', '--exe', '--nologcapture'])
 
-        end_time = self.params.ramp_up + self.params.hold_for
-        end_time += time.time() if end_time else 0
+        end_time = self._get_end_time()
         time.sleep(params.delay)
         store.writer.concurrency += 1
 
-        config = {"tests": params.tests}
+        config = {"tests": params.tests, "runner": params.runner, "fixtures_scope": params.fixtures_scope}
         if params.verbose:
             config["verbosity"] = 3
+        program = None
 
         iteration = 0
         handlers = ActionHandlerFactory.create_all()
@@ -203,56 +354,359 @@ class Worker(ThreadPool):
             handler.startup()
         try:
             while not graceful():
+                if self.scheduler and not self.scheduler.next_iteration():
+                    log.debug("[%s] no more iterations planned", params.worker_index)
+                    break
+                elif self.params.load_profile and not self.scheduler and not self._wait_for_activation(params):
+                    log.debug("[%s] load profile is finished", params.worker_index)
+                    break
+
                 log.debug("Starting iteration:: index=%d,start_time=%.3f", iteration, time.time())
                 thread.set_iteration(iteration)
 
-                session = ApiritifSession()
-                config["session"] = session
-                ApiritifTestProgram(config=config)
+                if config["runner"] == "native":
+                    if program is None:
+                        config["session"] = VUSession()
+                        program = NativeTestProgram(config=config)
+                    program.runTests()
+                elif program and config["runner"] == "persistent":
+                    program.runTests()
+                else:
+                    config["session"] = ApiritifSession()
+                    program = ApiritifTestProgram(config=config)
 
                 log.debug("Finishing iteration:: index=%d,end_time=%.3f", iteration, time.time())
                 iteration += 1
 
-                # reasons to stop
-                if session.stop_reason:
-                    if "Nothing to test." in session.stop_reason:
-                        raise RuntimeError("Nothing to test.")
-                    elif session.stop_reason.startswith(NormalShutdown.__name__):
-                        log.info(session.stop_reason)
-                    else:
-                        raise RuntimeError(f"Unknown stop_reason: {session.stop_reason}")
-                elif 0 < params.iterations <= iteration:
-                    log.debug("[%s] iteration limit reached: %s", params.worker_index, params.iterations)
-                elif 0 < end_time <= time.time():
-                    log.debug("[%s] duration limit reached: %s", params.worker_index, params.hold_for)
-                else:
-                    continue  # continue if no one is faced
-
-                break
+                if self._is_finished(params, program.session, iteration, end_time, not self.scheduler):
+                    break
 
         finally:
+            if isinstance(program, NativeTestProgram):
+                program.finalize()
+
+            self._close_connections()
             store.writer.concurrency -= 1
+            if self.scheduler:
+                self.scheduler.remove_vu()
 
             for handler in handlers:
                 handler.finalize()
 
+    def _wait_for_activation(self, params):
+        """
+        Parks VU while concurrency of load profile is lower than its index
+
+        :return: False if VU won't be active anymore
+        """
+        while not graceful():
+            delay = self._get_activation_delay(params)
+            if delay is None:
+                return False
+            elif not delay:
+                return True
+
+            time.sleep(min(delay, 1.0))  # don't miss graceful shutdown
+
+        return False
+
     def __reduce__(self):
         raise NotImplementedError()
 
-    def _get_thread_params(self):
-        if not self.params.steps or self.params.steps < 0:
-            self.params.steps = sys.maxsize
 
-        step_granularity = self.params.ramp_up / self.params.steps
-        ramp_up_per_thread = self.params.ramp_up / self.params.concurrency
-        for thr_idx in range(self.params.concurrency):
-            offset = self.params.worker_index * ramp_up_per_thread / float(self.params.worker_count)
-            delay = offset + thr_idx * float(self.params.ramp_up) / self.params.concurrency
-            delay -= delay % step_granularity if step_granularity else 0
-            params = copy.deepcopy(self.params)
-            params.thread_index = self.params.thread_index + thr_idx
-            params.delay = delay
-            yield params
+class AsyncWorker(VUMixin):
+    """
+    Runs VUs as asyncio tasks of single event loop instead of threads, so thousands of mostly idle VUs
+    fit into one process. Coroutine tests are awaited, regular ones block the loop while they're running.
+    """
+
+    def __init__(self, params):
+        """
+        :type params: Params
+        """
+        self.params = params
+        self.start_time = time.time()
+        store.writer = create_writer(self.params)
+        apiritif.recorder.set_level(self.params.recording)
+
+    def start(self):
+        import_plugins()
+        params = list(self._get_thread_params())
+        self._wait_for_start()
+        self.start_time = time.time()
+        with store.writer:  # writer must be closed finally
+            asyncio.run(self._run_vus(params))
+
+    def join(self):
+        pass  # start() returns when all VUs are finished
+
+    async def _run_vus(self, params):
+        # every VU gets empty context, so thread store, recorder and csv readers aren't shared between tasks
+        tasks = [contextvars.Context().run(asyncio.ensure_future, self.run_vu(vu_params)) for vu_params in params]
+        await asyncio.gather(*tasks)
+
+    async def run_vu(self, params):
+        """
+        :type params: Params
+        """
+        if not params.tests:
+            raise RuntimeError("Nothing to test.")
+
+        thread.set_index(params.thread_index)
+        log.debug("[%s] Starting asyncio iterations: %s", params.worker_index, params)
+
+        end_time = self._get_end_time()
+        await asyncio.sleep(params.delay)
+        store.writer.concurrency += 1
+
+        config = {"tests": params.tests, "fixtures_scope": params.fixtures_scope, "session": VUSession()}
+        program = None
+
+        iteration = 0
+        handlers = ActionHandlerFactory.create_all()
+        thread.put_into_thread_store(action_handlers=handlers)
+        for handler in handlers:
+            handler.startup()
+        try:
+            while not graceful():
+                if self.params.load_profile and not await self._wait_for_activation(params):
+                    log.debug("[%s] load profile is finished", params.worker_index)
+                    break
+
+                log.debug("Starting iteration:: index=%d,start_time=%.3f", iteration, time.time())
+                thread.set_iteration(iteration)
+
+                if program is None:
+                    program = AsyncTestProgram(config=config)
+                await program.runTests()
+
+                log.debug("Finishing iteration:: index=%d,end_time=%.3f", iteration, time.time())
+                iteration += 1
+
+                if self._is_finished(params, program.session, iteration, end_time):
+                    break
+
+        finally:
+            if program is not None:
+                program.finalize()
+
+            self._close_connections()
+            store.writer.concurrency -= 1
+
+            for handler in handlers:
+                handler.finalize()
+
+    async def _wait_for_activation(self, params):
+        """
+        Parks VU while concurrency of load profile is lower than its index
+
+        :return: False if VU won't be active anymore
+        """
+        while not graceful():
+            delay = self._get_activation_delay(params)
+            if delay is None:
+                return False
+            elif not delay:
+                return True
+
+            await asyncio.sleep(min(delay, 1.0))  # don't miss graceful shutdown
+
+        return False
+
+
+class LoadProfile(object):
+    """
+    Sequence of stages, target value (concurrency or arrival rate) changes linearly
+    from the target of previous stage during stage duration. Profile starts from zero.
+    """
+    UNITS = {"s": 1, "m": 60, "h": 3600}
+
+    def __init__(self, stages):
+        """
+        :type stages: list[(float, float)]
+        """
+        super(LoadProfile, self).__init__()
+        self.stages = [(float(duration), float(target)) for duration, target in stages]
+        if not self.stages:
+            raise ValueError("Load profile must contain at least one stage")
+        for duration, target in self.stages:
+            if duration < 0 or target < 0:
+                raise ValueError("Wrong load profile stage: duration=%s, target=%s" % (duration, target))
+
+        self.duration = sum(duration for duration, _ in self.stages)
+        self.max_target = max(target for _, target in self.stages)
+
+    @classmethod
+    def parse(cls, spec):
+        """
+        Reads profile from JSON file ([{"duration": 60, "target": 10}, ...])
+        or from string of 'duration:target' pairs, e.g. '1m:10,5m:10,10s:50,30s:0'
+        """
+        if os.path.isfile(spec):
+            with open(spec) as fds:
+                stages = [(cls._parse_duration(stage["duration"]), stage["target"]) for stage in json.load(fds)]
+        else:
+            stages = []
+            for stage in spec.split(","):
+                duration, target = stage.strip().split(":")
+                stages.append((cls._parse_duration(duration), target))
+        return cls(stages)
+
+    @classmethod
+    def from_ramp_up(cls, target, ramp_up, hold_for):
+        if not ramp_up + hold_for:
+            hold_for = float("inf")
+        return cls([(ramp_up, target), (hold_for, target)])
+
+    @classmethod
+    def _parse_duration(cls, duration):
+        duration = str(duration).strip()
+        if duration and duration[-1] in cls.UNITS:
+            return float(duration[:-1]) * cls.UNITS[duration[-1]]
+        return float(duration)
+
+    def scaled(self, factor):
+        return LoadProfile([(duration, target * factor) for duration, target in self.stages])
+
+    def _segments(self):
+        start, prev_target = 0.0, 0.0
+        for duration, target in self.stages:
+            yield start, duration, prev_target, target
+            start += duration
+            prev_target = target
+
+    def get_activation_offset(self, index, offset):
+        """
+        Earliest time offset (not earlier than given one) when target is greater than index
+
+        :return: time offset or None if target won't be greater than index anymore
+        """
+        for start, duration, prev_target, target in self._segments():
+            if start + duration < offset:
+                continue
+
+            if duration:
+                start_from = max(start, offset)
+                value = prev_target + (target - prev_target) * (start_from - start) / duration
+            else:
+                start_from, value = start, target
+
+            if value > index:
+                return start_from
+            elif target > index:
+                return start + duration * (index - prev_target) / (target - prev_target)
+
+        return None
+
+    def get_offset(self, number):
+        """
+        Time offset of iteration with given number if target is treated as rate of iterations
+
+        :return: time offset or None if profile is finished before
+        """
+        for start, duration, prev_target, target in self._segments():
+            count = duration * (prev_target + target) / 2.0 if (prev_target or target) else 0
+            if number >= count:
+                number -= count
+                continue
+
+            if prev_target == target:
+                return start + number / target
+
+            # number = prev_target * t + (target - prev_target) * t^2 / (2 * duration)
+            acceleration = (target - prev_target) / (2.0 * duration)
+            root = math.sqrt(prev_target ** 2 + 4 * acceleration * number)
+            return start + (root - prev_target) / (2 * acceleration)
+
+        return None
+
+
+class ArrivalScheduler(Thread):
+    """
+    Starts iterations with given rate regardless of response times (open workload model).
+    Every iteration is given to an idle VU, if there is no idle VU at the planned moment the iteration is dropped.
+
+    :type params: Params
+    """
+
+    def __init__(self, params):
+        super(ArrivalScheduler, self).__init__(target=self._schedule)
+        self.daemon = True
+        self.name = self.__class__.__name__
+
+        self.profile = params.load_profile
+        if not self.profile:
+            self.profile = LoadProfile.from_ramp_up(params.arrival_rate, params.ramp_up, params.hold_for)
+        self.iterations = params.iterations
+        self.started = 0
+        self.dropped = 0
+
+        self._expected_vus = params.concurrency
+        self._joined_vus = 0
+        self._lock = Lock()
+        self._ready = Event()  # don't plan anything until all VUs are ready to take iterations
+        self._check_ready()
+
+        self._idle_vus = Semaphore(0)
+        self._planned = queue.Queue()
+        self._stopped = False
+
+    def next_iteration(self):
+        """
+        Blocks VU until the next iteration is planned.
+
+        :return: planned start time of the iteration or None if test is finished
+        """
+        if not self._ready.is_set():
+            with self._lock:
+                self._joined_vus += 1
+                self._check_ready()
+
+        self._idle_vus.release()
+        planned = self._planned.get()
+        if planned is None:
+            self._planned.put(None)  # wake up the rest of VUs
+        else:
+            log.debug("Iteration started with delay %.3f", time.time() - planned)
+        return planned
+
+    def remove_vu(self):
+        with self._lock:
+            self._expected_vus -= 1
+            self._check_ready()
+
+    def stop(self):
+        self._stopped = True
+        self._ready.set()
+        self._planned.put(None)
+
+    def _check_ready(self):
+        if self._joined_vus >= self._expected_vus:
+            self._ready.set()
+
+    def _schedule(self):
+        self._ready.wait()
+        start_time = time.time()
+        number = 0
+        try:
+            while not self._stopped and not graceful() and number < self.iterations:
+                offset = self.profile.get_offset(number)
+                if offset is None:
+                    break
+
+                delay = start_time + offset - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+
+                if self._idle_vus.acquire(blocking=False):
+                    self._planned.put(start_time + offset)
+                    self.started += 1
+                else:
+                    self.dropped += 1
+                number += 1
+        finally:
+            self._planned.put(None)
+            log.info("Iterations started: %s, dropped because of lack of VUs: %s", self.started, self.dropped)
 
 
 class ApiritifTestProgram(PluggableTestProgram):
@@ -279,28 +733,246 @@ class ApiritifTestProgram(PluggableTestProgram):
         self.defaultPlugins.append("apiritif.loadgen")
         self.loadPlugins()
         self.createTests()
+        if self.config.get("runner") == "persistent":
+            keep_tests(self.test)
+
+
+class NativeTestProgram(object):
+    """
+    Runs unittest.TestCase methods and test functions of the module directly with ApiritifTestResult.
+    Tests are collected once (in the same way as nose2 does), every runTests() call executes them again.
+    """
+
+    def __init__(self, config):
+        self.config = config
+        self.session = self.config["session"]
+        self.result = ApiritifTestResult(self.session)
+        self.test = self.load_tests(self.config["tests"][-1])
+
+        self.vu_fixtures = self.config.get("fixtures_scope") == "vu"
+        self.tests = list(self._iter_tests(self.test))
+        self.set_up_modules = {}  # module name -> whether setup succeeded
+        self.set_up_classes = {}  # class -> whether setup succeeded
+
+    def runTests(self):
+        self.result.startTestRun()
+        if self.vu_fixtures:
+            for test in self.tests:
+                if self._set_up_fixtures(test):
+                    test(self.result)
+        else:
+            self.result._previousTestClass = None  # class and module fixtures are executed every run
+            self.test.run(self.result)
+        self.result.stopTestRun()
+
+    def finalize(self):
+        """ Tears down fixtures of VU scope """
+        for cls, succeeded in reversed(list(self.set_up_classes.items())):
+            if succeeded:
+                self._call_fixture(cls, "tearDownClass", "tearDownClass (%s)" % strclass(cls))
+                self._call_fixture(cls, "doClassCleanups", "class cleanup (%s)" % strclass(cls))
+        self.set_up_classes.clear()
+
+        for module_name, succeeded in reversed(list(self.set_up_modules.items())):
+            if succeeded:
+                module = sys.modules.get(module_name)
+                self._call_fixture(module, "tearDownModule", "tearDownModule (%s)" % module_name)
+                self._call_fixture(unittest.case, "doModuleCleanups", "module cleanup (%s)" % module_name)
+        self.set_up_modules.clear()
+
+    def _set_up_fixtures(self, test):
+        cls = test.__class__
+        if cls.__module__ not in self.set_up_modules:
+            module = sys.modules.get(cls.__module__)
+            setup_name = "setUpModule (%s)" % cls.__module__
+            self.set_up_modules[cls.__module__] = self._call_fixture(module, "setUpModule", setup_name)
+
+        if not self.set_up_modules[cls.__module__]:
+            return False
+
+        if getattr(cls, "__unittest_skip__", False):
+            return True  # tests will be skipped by themselves, class isn't set up
+
+        if cls not in self.set_up_classes:
+            self.set_up_classes[cls] = self._call_fixture(cls, "setUpClass", "setUpClass (%s)" % strclass(cls))
+
+        return self.set_up_classes[cls]
+
+    def _call_fixture(self, obj, name, description):
+        fixture = getattr(obj, name, None)
+        if fixture is None:
+            return True
+
+        try:
+            fixture()
+        except Exception:  # unittest doesn't catch BaseException in fixtures as well
+            self.result.addError(_ErrorHolder(description), sys.exc_info())
+            return False
+
+        return True
+
+    def _iter_tests(self, suite):
+        if isinstance(suite, unittest.TestSuite):
+            for test in suite:
+                for case in self._iter_tests(test):
+                    yield case
+        else:
+            yield suite
+
+    @staticmethod
+    def load_tests(test_file):
+        dir_name, file_name = os.path.split(os.path.abspath(test_file))
+        if dir_name not in sys.path:
+            sys.path.insert(0, dir_name)
+        module = importlib.import_module(os.path.splitext(file_name)[0])
+
+        loader = unittest.TestLoader()
+        suite = unittest.TestSuite()
+        attrs = [getattr(module, name) for name in dir(module)]
+
+        # functions go first, as nose2 loader plugins are ordered by name
+        func_case = transplant_class(FunctionTestCase, module.__name__)
+        for obj in attrs:
+            is_test_func = isinstance(obj, types.FunctionType) and obj.__name__.startswith(loader.testMethodPrefix)
+            if is_test_func and not num_expected_args(obj) and not inspect.isgeneratorfunction(obj):
+                set_up = getattr(obj, "setUp", getattr(obj, "setup", getattr(obj, "setUpFunc", None)))
+                tear_down = getattr(obj, "tearDown", getattr(obj, "teardown", getattr(obj, "tearDownFunc", None)))
+                suite.addTest(func_case(obj, setUp=set_up, tearDown=tear_down))
+
+        seen = set()
+        for obj in attrs:
+            if isinstance(obj, type) and issubclass(obj, unittest.TestCase) and id(obj) not in seen:
+                seen.add(id(obj))
+                suite.addTest(loader.loadTestsFromTestCase(obj))
+
+        keep_tests(suite)
+        return suite
+
+
+class AsyncTestProgram(NativeTestProgram):
+    """
+    Native runner for asyncio worker: coroutine tests are awaited, so other VUs are running while test waits for I/O.
+    Fixtures and setUp/tearDown are regular functions, they're called synchronously.
+    """
+
+    async def runTests(self):
+        self.result.startTestRun()
+        for test in self.tests:
+            if self._set_up_fixtures(test):
+                await self._run_test(test)
+
+        if not self.vu_fixtures:
+            self.finalize()  # class and module fixtures are executed every run
+        self.result.stopTestRun()
+
+    async def _run_test(self, test):
+        if isinstance(test, unittest.FunctionTestCase):
+            method = test._testFunc
+        else:
+            method = getattr(test, test._testMethodName)
+
+        self.result.startTest(test)
+        try:
+            if getattr(test.__class__, "__unittest_skip__", False) or getattr(method, "__unittest_skip__", False):
+                raise unittest.SkipTest(getattr(method, "__unittest_skip_why__", ""))
+
+            test.setUp()
+            try:
+                outcome = method()
+                if inspect.isawaitable(outcome):
+                    await outcome
+            finally:
+                test.tearDown()
+        except (KeyboardInterrupt, asyncio.CancelledError):
+            raise
+        except unittest.SkipTest as exc:
+            self.result.addSkip(test, str(exc))
+        except test.failureException:
+            self.result.addFailure(test, sys.exc_info())
+        except BaseException:
+            self.result.addError(test, sys.exc_info())
+        else:
+            self.result.addSuccess(test)
+        finally:
+            test.doCleanups()
+            self.result.stopTest(test)
+
+
+def keep_tests(suite):
+    """ unittest suite drops tests after run by default, keep them to run suite again in next iteration """
+    if isinstance(suite, unittest.TestSuite):
+        suite._cleanup = False
+        for test in suite:
+            keep_tests(test)
+
+
+COMPRESSED_EXTENSION = ".gz"
+COMPRESS_LEVEL = int(os.environ.get("APIRITIF_WRITER_COMPRESS_LEVEL", "6"))
+
+
+def create_writer(params):
+    """ :type params: Params """
+    writer_class = get_writer_class(params.report, params.aggregate)
+    if params.aggregate:
+        return writer_class(params.report, params.aggregate, params.keep_failures)
+    return writer_class(params.report)
+
+
+def get_writer_class(report, aggregate=0):
+    if aggregate:
+        from apiritif.aggregates import AggregatingSampleWriter
+        return AggregatingSampleWriter
+
+    report = report.lower()
+    if report.endswith(COMPRESSED_EXTENSION):
+        report = report[:-len(COMPRESSED_EXTENSION)]
+        if report.endswith(".apbin"):
+            raise ValueError("Compression of binary results isn't supported")
+
+    if report.endswith(".ldjson"):
+        return LDJSONSampleWriter
+    elif report.endswith(".apbin"):
+        from apiritif.apbin import APBinSampleWriter  # binary format is built on top of regular writers
+        return APBinSampleWriter
+    else:
+        return JTLSampleWriter
+
+
+def open_report(report, mode):
+    """ Reports with .gz extension are compressed, flush() makes written data readable by decompressor """
+    if report.lower().endswith(COMPRESSED_EXTENSION):
+        return gzip.open(report, mode, compresslevel=COMPRESS_LEVEL)
+    return open(report, mode)
 
 
 class LDJSONSampleWriter(object):
     """
+    Writes samples in background thread: samples are serialized into memory buffer
+    which is written into the file when it's big enough or flush interval is over.
     :type out_stream: file
     """
+    FLUSH_INTERVAL = float(os.environ.get("APIRITIF_WRITER_FLUSH_INTERVAL", "0.1"))  # seconds
+    FLUSH_SIZE = int(os.environ.get("APIRITIF_WRITER_FLUSH_SIZE", str(1024 * 1024)))  # bytes
 
-    def __init__(self, output_file):
+    def __init__(self, output_file, flush_interval=None, flush_size=None):
         super(LDJSONSampleWriter, self).__init__()
         self.concurrency = 0
         self.output_file = output_file
         self.out_stream = None
-        self._samples_queue = multiprocessing.Queue()
+        self.flush_interval = self.FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.flush_size = self.FLUSH_SIZE if flush_size is None else flush_size
+        self.samples_count = 0
+        self.busy_time = 0.0  # time spent on serialization and writing
+        self._samples_queue = queue.Queue()  # producers are VU threads of the same process
+        self._buffer = BytesIO()
 
-        self._writing = False
         self._writer_thread = Thread(target=self._writer)
         self._writer_thread.daemon = True
         self._writer_thread.name = self.__class__.__name__
 
     def __enter__(self):
-        self.out_stream = open(self.output_file, "wb")
-        self._writing = True
+        self.out_stream = open_report(self.output_file, "wb")  # compression happens in writer thread
+        self._write_header()  # header is written with the first flush
         self._writer_thread.start()
         return self
 
@@ -308,53 +980,97 @@ class LDJSONSampleWriter(object):
         return self._writer_thread.is_alive()
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        self._writing = False
+        self._samples_queue.put(None)  # writer stops when all samples before it are written
         self._writer_thread.join()
         self.out_stream.close()
+        log.info("Results written: %s samples, writer capacity is %.0f samples/s", self.samples_count, self.capacity)
+
+    @property
+    def capacity(self):
+        """ How many samples per second writer is able to process """
+        return self.samples_count / self.busy_time if self.busy_time else 0.0
 
     def add(self, sample, test_count, success_count):
-        self._samples_queue.put_nowait((sample, test_count, success_count))
+        self._samples_queue.put((sample, test_count, success_count))
 
     def is_queue_empty(self):
         return self._samples_queue.empty()
 
     def _writer(self):
-        while self._writing:
-            if self._samples_queue.empty():
-                time.sleep(0.1)
+        flush_time = None  # buffered samples must be written by this time
+        while True:
+            timeout = None if flush_time is None else max(flush_time - time.time(), 0)
+            try:
+                item = self._samples_queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            else:
+                if item is None:
+                    break
 
-            while not self._samples_queue.empty():
-                item = self._samples_queue.get(block=True)
+            if item:
+                started = time.perf_counter()
                 try:
                     sample, test_count, success_count = item
                     self._write_sample(sample, test_count, success_count)
+                    self.samples_count += 1
                 except BaseException as exc:
                     log.debug("Processing sample failed: %s\n%s", str(exc), traceback.format_exc())
                     log.warning("Couldn't process sample, skipping")
-                    continue
+                self.busy_time += time.perf_counter() - started
+                if flush_time is None:
+                    flush_time = time.time() + self.flush_interval
 
-    def _write_sample(self, sample, test_count, success_count):
-        line = json.dumps(sample.to_dict()) + "\n"
-        self.out_stream.write(line.encode('utf-8'))
+            if self._buffer.tell() >= self.flush_size or (flush_time is not None and time.time() >= flush_time):
+                self._flush()
+                flush_time = None
+
+        self._flush()
+
+    def _flush(self):
+        started = time.perf_counter()
+        self.out_stream.write(self._buffer.getvalue())
         self.out_stream.flush()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        self.busy_time += time.perf_counter() - started
+
+    @classmethod
+    def merge(cls, parts, output_file):
+        with open(output_file, "wb") as out_stream:
+            for part in parts:  # concatenation of gzip files is valid multi-member gzip file
+                with open(part, "rb") as in_stream:
+                    shutil.copyfileobj(in_stream, out_stream)
+
+    def _write_header(self):
+        pass
+
+    def _write_sample(self, sample, test_count, success_count):
+        self._buffer.write(to_json_line(sample.to_dict()))
 
 
 class JTLSampleWriter(LDJSONSampleWriter):
-    def __init__(self, output_file):
-        super(JTLSampleWriter, self).__init__(output_file)
+    FIELDNAMES = ["timeStamp", "elapsed", "Latency", "label", "responseCode", "responseMessage", "success",
+                  "allThreads", "bytes"]
 
-    def __enter__(self):
-        obj = super(JTLSampleWriter, self).__enter__()
+    def __init__(self, output_file, flush_interval=None, flush_size=None):
+        super(JTLSampleWriter, self).__init__(output_file, flush_interval, flush_size)
 
-        fieldnames = ["timeStamp", "elapsed", "Latency", "label", "responseCode", "responseMessage", "success",
-                      "allThreads", "bytes"]
-        endline = '\n'  # \r will be preprended automatically because out_stream is opened in text mode
-        self.writer = csv.DictWriter(self.out_stream, fieldnames=fieldnames, dialect=csv.excel, lineterminator=endline,
-                                     encoding='utf-8')
+        endline = '\n'
+        self.writer = csv.DictWriter(self._buffer, fieldnames=self.FIELDNAMES, dialect=csv.excel,
+                                     lineterminator=endline, encoding='utf-8')
+
+    def _write_header(self):
         self.writer.writeheader()
-        self.out_stream.flush()
 
-        return obj
+    @classmethod
+    def merge(cls, parts, output_file):
+        with open_report(output_file, "wb") as out_stream:
+            for idx, part in enumerate(parts):
+                with open_report(part, "rb") as in_stream:
+                    if idx:  # header of the first part is enough
+                        in_stream.readline()
+                    shutil.copyfileobj(in_stream, out_stream)
 
     def _write_sample(self, sample, test_count, success_count):
         """
@@ -380,12 +1096,12 @@ class JTLSampleWriter(LDJSONSampleWriter):
         else:
             self._write_single_sample(sample)
 
-    def _write_single_sample(self, sample):
-        """
-        :type sample: Sample
-        """
-        bytes = sample.extras.get("responseHeadersSize", 0) + 2 + sample.extras.get("responseBodySize", 0)
+    @staticmethod
+    def _get_bytes(sample):
+        return sample.extras.get("responseHeadersSize", 0) + 2 + sample.extras.get("responseBodySize", 0)
 
+    @staticmethod
+    def _get_message(sample):
         message = sample.error_msg
         if not message:
             message = sample.extras.get("responseMessage")
@@ -397,6 +1113,14 @@ class JTLSampleWriter(LDJSONSampleWriter):
                 elif sample.extras.get("responseMessage"):
                     message = sample.extras.get("responseMessage")
                     break
+        return message
+
+    def _write_single_sample(self, sample):
+        """
+        :type sample: Sample
+        """
+        bytes = self._get_bytes(sample)
+        message = self._get_message(sample)
         self.writer.writerow({
             "timeStamp": int(1000 * sample.start_time),
             "elapsed": int(1000 * sample.duration),
@@ -410,28 +1134,25 @@ class JTLSampleWriter(LDJSONSampleWriter):
             "allThreads": self.concurrency,  # TODO: there will be a problem aggregating concurrency for rare samples
             "success": "true" if sample.status == "PASSED" else "false",
         })
-        self.out_stream.flush()
 
 
 # noinspection PyPep8Naming
-class ApiritifPlugin(Plugin):
+class ApiritifTestResult(unittest.TestResult):
     """
-    Saves test results in a format suitable for Taurus.
-    :type sample_writer: LDJSONSampleWriter
+    Passes test events to SampleController.
+    Collects nothing by itself, so it can be used for many runs of test suite.
     """
 
-    configSection = 'apiritif-plugin'
-    alwaysOn = True
-
-    def __init__(self):
+    def __init__(self, session):
+        super(ApiritifTestResult, self).__init__()
+        self.session = session
         self.controller = store.SampleController(log=log, session=self.session)
         apiritif.put_into_thread_store(controller=self.controller)
 
-    def startTest(self, event):
+    def startTest(self, test):
         """
         before test run
         """
-        test = event.test
         thread.clean_transaction_handlers()
         test_fqn = test.id()  # [package].module.class.method
         suite_name, case_name = test_fqn.split('.')[-2:]
@@ -447,19 +1168,17 @@ class ApiritifPlugin(Plugin):
             "class_method": class_method}
         self.controller.startTest()
 
-    def stopTest(self, event):
+    def stopTest(self, test):
         #if not 'NormalShutdown' in self.session.stop_reason
         self.controller.stopTest()
 
-    def reportError(self, event):
+    def addError(self, test, error):
         """
         when a test raises an uncaught exception
         :param test:
         :param error:
         :return:
         """
-        error = event.testEvent.exc_info
-
         # test_dict will be None if startTest wasn't called (i.e. exception in setUp/setUpClass)
         # status=BROKEN
         assertion_name = error[0].__name__
@@ -474,7 +1193,7 @@ class ApiritifPlugin(Plugin):
             else:  # error in test infrastructure (e.g. module setup())
                 log.error("\n".join((assertion_name, error_msg, error_trace)))
 
-    def reportFailure(self, event):
+    def addFailure(self, test, error):
         """
         when a test fails
         :param test:
@@ -483,9 +1202,9 @@ class ApiritifPlugin(Plugin):
         :return:
         """
         # status=FAILED
-        self.controller.addFailure(event.testEvent.exc_info)
+        self.controller.addFailure(error)
 
-    def reportSuccess(self, event):
+    def addSuccess(self, test):
         """
         when a test passes
         :param test:
@@ -493,7 +1212,33 @@ class ApiritifPlugin(Plugin):
         """
         self.controller.addSuccess()
 
-    def afterTestRun(self, event):
+    def addSubTest(self, test, subtest, error):
+        if error is None:
+            return
+        elif issubclass(error[0], test.failureException):
+            self.addFailure(subtest, error)
+        else:
+            self.addError(subtest, error)
+
+    def addSkip(self, test, reason):
+        pass  # sample stays SKIPPED
+
+    def addExpectedFailure(self, test, err):
+        pass
+
+    def addUnexpectedSuccess(self, test):
+        pass
+
+    def addDuration(self, test, elapsed):
+        pass  # python 3.12+ collects durations of all runs otherwise
+
+    def startTestRun(self):
+        """
+        Before all tests, controller is reused by persistent runners so smart transactions mode mustn't leak
+        """
+        self.controller.tran_mode = False
+
+    def stopTestRun(self):
         """
         After all tests
         """
@@ -501,6 +1246,42 @@ class ApiritifPlugin(Plugin):
             self.session.set_stop_reason("Nothing to test.")
 
 
+# noinspection PyPep8Naming
+class ApiritifPlugin(Plugin):
+    """
+    Saves test results in a format suitable for Taurus.
+    :type sample_writer: LDJSONSampleWriter
+    """
+
+    configSection = 'apiritif-plugin'
+    alwaysOn = True
+
+    def __init__(self):
+        self.result = ApiritifTestResult(self.session)
+        self.controller = self.result.controller
+
+    def startTest(self, event):
+        self.result.startTest(event.test)
+
+    def startTestRun(self, event):
+        self.result.startTestRun()
+
+    def stopTest(self, event):
+        self.result.stopTest(event.test)
+
+    def reportError(self, event):
+        self.result.addError(event.testEvent.test, event.testEvent.exc_info)
+
+    def reportFailure(self, event):
+        self.result.addFailure(event.testEvent.test, event.testEvent.exc_info)
+
+    def reportSuccess(self, event):
+        self.result.addSuccess(event.testEvent.test)
+
+    def afterTestRun(self, event):
+        self.result.stopTestRun()
+
+
 def cmdline_to_params():
     parser = OptionParser()
     parser.add_option('', '--concurrency', action='store', type="int", default=1)
@@ -508,7 +1289,39 @@ def cmdline_to_params():
     parser.add_option('', '--ramp-up', action='store', type="float", default=0)
     parser.add_option('', '--steps', action='store', type="int", default=sys.maxsize)
     parser.add_option('', '--hold-for', action='store', type="float", default=0)
+    parser.add_option('', '--arrival-rate', action='store', type="float", default=0,
+                      help="start iterations with given rate per second (open workload model)")
+    parser.add_option('', '--max-vus', action='store', type="int", default=0,
+                      help="size of VU pool for arrival rate mode, concurrency is used by default")
+    parser.add_option('', '--load-profile', action='store', type="str", default=None,
+                      help="stages of concurrency: JSON file or string like '1m:10,5m:10,10s:50,30s:0'")
+    parser.add_option('', '--rate-profile', action='store', type="str", default=None,
+                      help="stages of arrival rate, in the same format as load profile")
     parser.add_option('', '--result-file-template', action='store', type="str", default="result-%s.csv")
+    parser.add_option('', '--workers', action='store', type="str", default="1",
+                      help="number of worker processes or 'auto' to use all CPU cores")
+    parser.add_option('', '--runner', action='store', type="choice", choices=["nose2", "persistent", "native"],
+                      default="nose2", help="'persistent' loads tests once per VU instead of every iteration, "
+                                            "'native' runs them without nose2")
+    parser.add_option('', '--fixtures-scope', action='store', type="choice", choices=["iteration", "vu"],
+                      default="iteration", help="'vu' runs setUpClass/setUpModule once per VU (native runner only)")
+    parser.add_option('', '--engine', action='store', type="choice", choices=["threads", "asyncio"],
+                      default="threads", help="'asyncio' runs VUs as tasks of event loop and awaits coroutine tests, "
+                                              "tests are run natively then")
+    parser.add_option('', '--agents', action='store', type="str", default=None,
+                      help="comma-separated host:port list of agents to run the test on (distributed mode)")
+    parser.add_option('', '--listen', action='store', type="str", default=None,
+                      help="[host:]port to accept controller connections on, run as agent of distributed test, "
+                           "host is 127.0.0.1 by default")
+    parser.add_option('', '--token', action='store', type="str", default=os.environ.get("APIRITIF_AGENT_TOKEN"),
+                      help="shared secret of controller and agents, APIRITIF_AGENT_TOKEN is used by default")
+    parser.add_option('', '--aggregate', action='store', type="float", default=0,
+                      help="write per-label aggregates of every N seconds into LDJSON file instead of samples")
+    parser.add_option('', '--keep-failures', action='store_true', default=False,
+                      help="write failed samples along with aggregates")
+    parser.add_option('', '--recording', action='store', type="choice", choices=list(apiritif.recorder.LEVELS),
+                      default="full", help="'timings' records only time, status and size of requests and "
+                                           "failed assertions, 'off' records transactions only")
     parser.add_option('', '--verbose', action='store_true', default=False)
     parser.add_option('', "--version", action='store_true', default=False)
     opts, args = parser.parse_args()
@@ -524,15 +1337,66 @@ def cmdline_to_params():
     params.steps = opts.steps
     params.iterations = opts.iterations
     params.hold_for = opts.hold_for
+    params.arrival_rate = opts.arrival_rate
+    if opts.load_profile and opts.rate_profile:
+        parser.error("--load-profile and --rate-profile can't be used together")
+    elif opts.load_profile:
+        params.load_profile = LoadProfile.parse(opts.load_profile)
+        params.arrival_rate = 0
+        params.concurrency = int(math.ceil(params.load_profile.max_target))
+    elif opts.rate_profile:
+        params.load_profile = LoadProfile.parse(opts.rate_profile)
+        params.arrival_rate = params.load_profile.max_target
+
+    if params.arrival_rate and opts.max_vus:
+        params.concurrency = opts.max_vus
 
     params.report = opts.result_file_template
     params.tests = args
-    params.worker_count = 1  # min(params.concurrency, multiprocessing.cpu_count())
+    params.worker_count = get_worker_count(opts.workers, params.concurrency)
+    params.agents = opts.agents.split(",") if opts.agents else []
+    params.listen = opts.listen
+    if params.listen:
+        params.worker_count = get_worker_count(opts.workers, sys.maxsize)  # agent is ready for any concurrency
+        if params.agents:
+            parser.error("Agent can't control other agents")
+    params.token = opts.token
+    if (params.listen or params.agents) and not params.token:
+        parser.error("Distributed mode requires shared token: use --token or APIRITIF_AGENT_TOKEN")
     params.verbose = opts.verbose
+    params.runner = opts.runner
+    params.fixtures_scope = opts.fixtures_scope
+    params.engine = opts.engine
+    if params.fixtures_scope == "vu" and params.runner != "native" and params.engine != "asyncio":
+        parser.error("Fixtures of VU scope are supported by native runner only")
+    if params.engine == "asyncio" and params.arrival_rate:
+        parser.error("Arrival rate isn't supported by asyncio engine")
+    params.aggregate = opts.aggregate
+    params.keep_failures = opts.keep_failures
+    params.recording = opts.recording
+    if params.aggregate and get_writer_class(params.report) is not LDJSONSampleWriter:
+        parser.error("Aggregates can be written into LDJSON file only")
+    if params.keep_failures and not params.aggregate:
+        parser.error("Failures can be kept in aggregate mode only")
 
     return params
 
 
+def get_worker_count(workers, concurrency):
+    if workers == "auto":
+        worker_count = multiprocessing.cpu_count()
+    else:
+        try:
+            worker_count = int(workers)
+        except ValueError:
+            raise ValueError("Wrong workers count: %r, positive number or 'auto' expected" % workers)
+
+        if worker_count < 1:
+            raise ValueError("Wrong workers count: %r, positive number or 'auto' expected" % workers)
+
+    return min(worker_count, concurrency)  # each worker must have at least one thread
+
+
 def setup_logging(params):
     logformat = "%(asctime)s:%(levelname)s:%(process)s:%(thread)s:%(name)s:%(message)s"
     apiritif.http.log.setLevel(logging.WARNING)
@@ -546,7 +1410,18 @@ def setup_logging(params):
 def main():
     cmd_params = cmdline_to_params()
     setup_logging(cmd_params)
-    supervisor = Supervisor(cmd_params)
+    if cmd_params.listen:
+        from apiritif.distributed import Agent, parse_address
+        agent = Agent(parse_address(cmd_params.listen), cmd_params.worker_count, cmd_params.token)
+        log.info("Agent is listening on %s:%s", *agent.server_address)
+        agent.serve_forever()
+        return
+
+    if cmd_params.agents:
+        from apiritif.distributed import Controller
+        supervisor = Controller(cmd_params)
+    else:
+        supervisor = Supervisor(cmd_params)
     supervisor.start()
     supervisor.join()
 
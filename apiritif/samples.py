@@ -24,6 +24,8 @@ from apiritif.http import RequestFailure
 
 
 class Assertion(object):
+    __slots__ = ("name", "failed", "error_message", "error_trace", "extras")
+
     def __init__(self, name, extras):
         self.name = name
         self.failed = False
@@ -46,6 +48,8 @@ class Assertion(object):
 
 
 class PathComponent(object):
+    __slots__ = ("type", "value")
+
     def __init__(self, type, value):
         self.type = type
         self.value = value
@@ -58,6 +62,9 @@ class PathComponent(object):
 
 
 class Sample(object):
+    __slots__ = ("test_suite", "test_case", "status", "start_time", "duration", "error_msg", "error_trace", "extras",
+                 "subsamples", "assertions", "path", "parent_sample")  # samples of all requests are kept in memory
+
     def __init__(self, test_suite=None, test_case=None, status=None, start_time=None, duration=None,
                  error_msg=None, error_trace=None):
         self.test_suite = test_suite  # test label (test method name)
@@ -100,9 +107,8 @@ class Sample(object):
 
     def to_dict(self):
         # type: () -> dict
-        extras = copy.deepcopy(self.extras)
-        if "assertions" not in extras:
-            extras["assertions"] = []
+        extras = dict(self.extras)  # values are shared, don't copy big bodies and headers for every sample
+        extras["assertions"] = list(extras.get("assertions", []))
         for ass in self.assertions:
             extras["assertions"].append({
                 "name": ass.name,
@@ -133,7 +139,7 @@ class Sample(object):
 class ApiritifSampleExtractor(object):
     def __init__(self):
         self.active_transactions = []
-        self.response_map = {}  # response -> sample
+        self.response_map = {}  # id of response -> sample
 
     def parse_recording(self, recording, test_case_sample):
         """
@@ -142,10 +148,13 @@ class ApiritifSampleExtractor(object):
         :type test_case_sample: Sample
         :rtype: list[Sample]
         """
+        self.response_map = {}  # responses of previous tests aren't needed, extractor is kept by persistent runners
         self.active_transactions.append(test_case_sample)
         for item in recording:
             if isinstance(item, apiritif.Request):
                 self._parse_request(item)
+            elif isinstance(item, apiritif.RequestTiming):
+                self._parse_request_timing(item)
             elif isinstance(item, apiritif.TransactionStarted):
                 self._parse_transaction_started(item)
             elif isinstance(item, apiritif.TransactionEnded):
@@ -185,7 +194,45 @@ class ApiritifSampleExtractor(object):
         extras = self._extract_extras(item)
         if extras:
             sample.extras.update(extras)
-        self.response_map[item.response] = sample
+        self.response_map[id(item.response)] = sample
+        self.active_transactions[-1].add_subsample(sample)
+
+    def _parse_request_timing(self, item):
+        """
+        :type item: apiritif.RequestTiming
+        """
+        current_tran = self.active_transactions[-1]
+        sample = Sample(
+            test_suite=current_tran.test_case,
+            test_case=item.address,
+            status="FAILED" if item.error else "PASSED",
+            start_time=item.timestamp,
+            duration=item.elapsed,
+        )
+        if item.error:
+            sample.error_msg = str(item.error).split('\n')[0]
+
+        sample.path = current_tran.path + [PathComponent("request", item.address)]
+        record = {  # same keys as in full mode except of bodies, headers and cookies, which aren't kept
+            'responseCode': item.status_code,
+            'responseMessage': item.reason,
+            'responseTime': int(item.elapsed * 1000),
+            'connectTime': 0,
+            'latency': int(item.latency * 1000),
+            'responseSize': item.body_size,
+            'requestSize': 0,
+            'requestMethod': item.method,
+            'requestURI': item.address,
+            'assertions': [],
+            'responseBodySize': item.body_size,
+            'requestBodySize': None,
+            'requestCookiesSize': None,
+            'requestHeadersSize': None,
+            'responseHeadersSize': item.headers_size,
+        }
+        self._add_connection_extras(record, item)
+        sample.extras.update(record)
+        self.response_map[item.response_id] = sample
         self.active_transactions[-1].add_subsample(sample)
 
     def _parse_transaction_started(self, item):
@@ -225,22 +272,24 @@ class ApiritifSampleExtractor(object):
         self.active_transactions[-1].add_subsample(tran_sample)
 
     def _parse_assertion(self, item):
-        sample = self.response_map.get(item.response, None)
+        sample = self.response_map.get(id(item.response), None)
         if sample is None:
             raise ValueError("Found assertion for unknown response: %r", item.response)
         sample.add_assertion(item.name, item.extras)
 
     def _parse_assertion_failure(self, item):
-        sample = self.response_map.get(item.response, None)
+        sample = self.response_map.get(id(item.response), None)
         if sample is None:
             raise ValueError("Found assertion failure for unknown response")
+        if not any(ass.name == item.name for ass in sample.assertions):  # only failures are recorded in timings mode
+            sample.add_assertion(item.name, {"args": [], "kwargs": {}})
         sample.set_assertion_failed(item.name, item.failure_message, "")
 
     def _parse_generic_event(self, item):
         """
         :type item: apiritif.Event
         """
-        sample = self.response_map.get(item.response, None)
+        sample = self.response_map.get(id(item.response), None)
         if sample is None:
             raise ValueError("Generic event has to go after a request")
         sample.extras.setdefault("additional_events", []).append(item.to_dict())
@@ -273,7 +322,7 @@ class ApiritifSampleExtractor(object):
             'responseHeaders': response_headers,
         }
         record["requestCookiesRaw"] = self._cookies_from_dict(record["requestCookies"])
-        record["responseBodySize"] = len(record["responseBody"])
+        record["responseBodySize"] = response_size  # bytes rather than decoded characters
         record["requestBodySize"] = len(record["requestBody"])
         record["requestCookiesSize"] = len(record["requestCookiesRaw"])
         record["requestHeadersSize"] = len(self._headers_from_dict(record["requestHeaders"]))
@@ -293,8 +342,28 @@ class ApiritifSampleExtractor(object):
             req_text = req_text[:hard_limit]
             resp_text = resp_text[:hard_limit]
 
-        return self._extras_dict(
+        record = self._extras_dict(
             req.url, req.method, resp.status_code, resp.reason,
-            dict(resp.headers), resp_text, len(resp.content), resp.elapsed.total_seconds(),
+            dict(resp.headers), resp_text, resp.body_size, resp.elapsed.total_seconds(),
             req_text, cookies.get_dict(), dict(resp._request.headers)
         )
+        record["latency"] = int(resp.latency.total_seconds() * 1000)
+        self._add_connection_extras(record, resp)
+        return record
+
+    @staticmethod
+    def _add_connection_extras(record, resp):
+        """
+        :type resp: apiritif.HTTPResponse|apiritif.http.RequestTiming
+        """
+        if resp.body_hash:
+            record["responseBodyHash"] = resp.body_hash
+        if resp.connection_requests:
+            record["connectionReused"] = resp.connection_requests > 1
+            record["connectionRequests"] = resp.connection_requests
+        if resp.connect_time is not None:
+            record["connectTime"] = int(resp.connect_time * 1000)
+        if resp.tls_handshake_time is not None:
+            record["tlsHandshakeTime"] = int(resp.tls_handshake_time * 1000)
+        if resp.tls_resumed is not None:
+            record["tlsResumed"] = resp.tls_resumed
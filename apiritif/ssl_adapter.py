@@ -16,6 +16,7 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 import os
+import threading
 from OpenSSL import crypto
 from datetime import datetime
 from requests.adapters import HTTPAdapter
@@ -31,9 +32,10 @@ class SSLAdapter(HTTPAdapter):
     def __init__(self, *args, **kwargs):
         certificate_file_path = kwargs.pop('certificate_file_path', None)
         passphrase = kwargs.pop('passphrase', None)
+        self.ssl_context = kwargs.pop('ssl_context', None)
 
-        pkcs12_obj = CertificateReader.create_pkcs12_obj(certificate_file_path, passphrase)
-        self.ssl_context = CertificateReader.create_ssl_context(pkcs12_obj)
+        if self.ssl_context is None:
+            self.ssl_context = CertificateReader.get_ssl_context(certificate_file_path, passphrase)
 
         super(SSLAdapter, self).__init__(*args, **kwargs)
 
@@ -49,6 +51,45 @@ class SSLAdapter(HTTPAdapter):
 
 
 class CertificateReader:
+    _certificates = {}  # (path, passphrase, mtime) -> (pkcs12_obj, expiration time)
+    _lock = threading.Lock()
+
+    @staticmethod
+    def get_certificate(certificate_file_path, passphrase):
+        """
+        Decrypted certificate and key are shared by all threads, certificate file is read again when it's changed
+
+        :return: pkcs12_obj
+        :rtype: OpenSSL.crypto.PKCS12
+        """
+        path = os.path.abspath(certificate_file_path)
+        key = (path, passphrase, os.path.getmtime(path))
+        with CertificateReader._lock:
+            entry = CertificateReader._certificates.get(key)
+            if entry is None:
+                pkcs12_obj = CertificateReader.create_pkcs12_obj(path, passphrase)
+                certs = [pkcs12_obj.get_certificate()] + list(pkcs12_obj.get_ca_certificates() or [])
+                expiration = min(CertificateReader._get_expiration(cert) for cert in certs)
+                for old_key in [old_key for old_key in CertificateReader._certificates if old_key[0] == path]:
+                    del CertificateReader._certificates[old_key]
+                entry = CertificateReader._certificates[key] = (pkcs12_obj, expiration)
+
+        pkcs12_obj, expiration = entry
+        if expiration < datetime.utcnow():
+            raise ValueError('SSL certificate expired')
+        return pkcs12_obj
+
+    @staticmethod
+    def get_ssl_context(certificate_file_path, passphrase):
+        """
+        New context of cached certificate, contexts aren't shared between threads:
+        urllib3 changes verification settings of context for every new connection
+
+        :return: context
+        :rtype: urllib3.contrib.pyopenssl.PyOpenSSLContext
+        """
+        return CertificateReader.create_ssl_context(CertificateReader.get_certificate(certificate_file_path, passphrase))
+
     @staticmethod
     def create_pkcs12_obj(certificate_file_path, passphrase):
         """
@@ -93,10 +134,13 @@ class CertificateReader:
 
         return context
 
+    @staticmethod
+    def _get_expiration(cert):
+        return datetime.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ')
+
     @staticmethod
     def _check_cert_not_expired(cert):
-        cert_not_after = datetime.strptime(cert.get_notAfter().decode('ascii'), '%Y%m%d%H%M%SZ')
-        if cert_not_after < datetime.utcnow():
+        if CertificateReader._get_expiration(cert) < datetime.utcnow():
             raise ValueError('SSL certificate expired')
 
     @staticmethod
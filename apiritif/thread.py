@@ -14,12 +14,42 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
-from threading import local
+from contextvars import ContextVar
 
 from apiritif.action_plugins import BaseActionHandler
 
+
+class ContextLocal(object):
+    """
+    Replacement of threading.local which is local for asyncio tasks as well: every task works
+    with the copy of context it was created in. Values are replaced on assignment, never mutated in place,
+    so changes made in one context aren't visible in another one.
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_values", ContextVar("apiritif_local_%s" % id(self), default={}))
+
+    def __getattr__(self, name):
+        try:
+            return self._values.get()[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    def __setattr__(self, name, value):
+        values = dict(self._values.get())
+        values[name] = value
+        self._values.set(values)
+
+    def __delattr__(self, name):
+        values = dict(self._values.get())
+        if name not in values:
+            raise AttributeError(name)
+        del values[name]
+        self._values.set(values)
+
+
 _total = 1
-_thread_local = local()
+_thread_local = ContextLocal()
 
 
 def set_total(total):
@@ -62,7 +92,7 @@ def put_into_thread_store(*args, **kwargs):
     if args:
         _thread_local.args = args
     if kwargs:
-        current_kwargs = getattr(_thread_local, "kwargs", {})
+        current_kwargs = dict(getattr(_thread_local, "kwargs", {}))  # copy, dict can be shared by other contexts
         current_kwargs.update(kwargs)
         _thread_local.kwargs = current_kwargs
 
@@ -90,7 +120,7 @@ def get_transaction_handlers():
 
 def clean_transaction_handlers():
     handlers = {'enter': [], 'exit': []}
-    _thread_local.kwargs["transaction_handlers"] = handlers
+    put_into_thread_store(transaction_handlers=handlers)
 
 
 def set_transaction_handlers(handlers):
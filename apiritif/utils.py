@@ -13,11 +13,19 @@ WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 See the License for the specific language governing permissions and
 limitations under the License.
 """
+import json
 import os
 import sys
 import re
 import logging
+import threading
 import traceback
+from collections import OrderedDict
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 VERSION = "1.1.3"
 
@@ -36,6 +44,94 @@ def get_trace(error):
     return ''.join(lines).rstrip()
 
 
+def to_json_line(obj):
+    """ Serializes object into UTF-8 line, orjson is used if it's installed """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE | orjson.OPT_NON_STR_KEYS)
+        except TypeError:  # types unknown to orjson (e.g. big integers) are left to json module
+            pass
+    return (json.dumps(obj) + "\n").encode('utf-8')
+
+
+class ExpressionCache(object):
+    """
+    Bounded LRU of compiled expressions (regexes, JSONPath, XPath, CSS selectors) shared by all threads,
+    so scripts checking responses with the same queries don't parse them on every call
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._generation = 0  # local items of older generation are dropped by clear()
+
+    def get(self, kind, expression, compile_func):
+        key = (kind, expression)
+        with self._lock:
+            compiled = self._items.get(key)
+            if compiled is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return compiled
+            self.misses += 1
+
+        compiled = compile_func(expression)  # invalid expressions raise here and aren't cached
+        with self._lock:
+            self._items[key] = compiled
+            if len(self._items) > self.size:
+                self._items.popitem(last=False)
+        return compiled
+
+    def get_local(self, kind, expression, compile_func):
+        """
+        The same as get(), but compiled expression is kept for current thread only.
+        lxml evaluators hold a lock while running, so shared ones would make threads wait for each other.
+        """
+        items = getattr(self._local, "items", None)
+        if items is None or self._local.generation != self._generation:
+            items = self._local.items = OrderedDict()
+            self._local.generation = self._generation
+
+        key = (kind, expression)
+        compiled = items.get(key)
+        with self._lock:
+            if compiled is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        if compiled is not None:
+            items.move_to_end(key)
+            return compiled
+
+        compiled = compile_func(expression)
+        items[key] = compiled
+        if len(items) > self.size:
+            items.popitem(last=False)
+        return compiled
+
+    def get_stats(self):
+        with self._lock:
+            return {"size": len(self._items), "hits": self.hits, "misses": self.misses}
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._generation += 1
+            self.hits = 0
+            self.misses = 0
+
+
+expressions = ExpressionCache(int(os.environ.get("APIRITIF_EXPRESSION_CACHE_SIZE", "1000")))
+
+
+def compile_regex(regex):
+    return expressions.get("regex", regex, re.compile)
+
+
 def graceful():
     graceful_file_name = os.environ.get('GRACEFUL')
     graceful_flag = graceful_file_name and os.path.exists(graceful_file_name)
@@ -55,21 +151,21 @@ def shorten(string, upto, end_with="..."):
 
 def assert_regexp(regex, text, match=False, msg=None):
     if match:
-        if re.match(regex, text) is None:
+        if compile_regex(regex).match(text) is None:
             msg = msg or "Regex %r didn't match expected value: %r" % (regex, shorten(text, 100))
             raise AssertionError(msg)
     else:
-        if not re.findall(regex, text):
+        if not compile_regex(regex).findall(text):
             msg = msg or "Regex %r didn't find anything in text %r" % (regex, shorten(text, 100))
             raise AssertionError(msg)
 
 
 def assert_not_regexp(regex, text, match=False, msg=None):
     if match:
-        if re.match(regex, text) is not None:
+        if compile_regex(regex).match(text) is not None:
             msg = msg or "Regex %r unexpectedly matched expected value: %r" % (regex, shorten(text, 100))
             raise AssertionError(msg)
     else:
-        if re.findall(regex, text):
+        if compile_regex(regex).findall(text):
             msg = msg or "Regex %r unexpectedly found something in text %r" % (regex, shorten(text, 100))
             raise AssertionError(msg)
@@ -0,0 +1,64 @@
+"""
+Memory taken by recorded events and samples of requests, measured with tracemalloc.
+Responses are shared dummies, so only apiritif objects are counted.
+"""
+import gc
+import time
+import tracemalloc
+
+from apiritif.http import Request, Assertion, TransactionStarted, TransactionEnded, transaction
+from apiritif.samples import Sample, PathComponent
+
+VUS = 1000
+REQUESTS = 10
+
+
+class DummyResponse(object):
+    pass
+
+
+def record_events(response, tran):
+    events = [TransactionStarted(tran)]
+    for index in range(REQUESTS):
+        events.append(Request("GET", "http://example.com/%s" % index, None, response, None))
+        events.append(Assertion("assert_ok", response, {"args": [], "kwargs": {}}))
+    events.append(TransactionEnded(tran))
+    return events
+
+
+def make_samples():
+    top = Sample(test_case="test", test_suite="Suite", start_time=time.time(), status="PASSED")
+    top.path = [PathComponent("class", "Suite"), PathComponent("method", "test")]
+    tran = Sample(test_case="tran", test_suite="test", start_time=time.time(), status="PASSED")
+    tran.path = top.path + [PathComponent("transaction", "tran")]
+    top.add_subsample(tran)
+    for index in range(REQUESTS):
+        url = "http://example.com/%s" % index
+        sample = Sample(test_suite="tran", test_case=url, status="PASSED", start_time=1.0, duration=0.1)
+        sample.path = tran.path + [PathComponent("request", url)]
+        sample.add_assertion("assert_ok", {"args": [], "kwargs": {}})
+        tran.add_subsample(sample)
+    return top
+
+
+def main():
+    response = DummyResponse()
+    tran = transaction("tran")
+    gc.collect()
+    tracemalloc.start()
+    base = tracemalloc.get_traced_memory()[0]
+    events = [record_events(response, tran) for _ in range(VUS)]
+    events_size = tracemalloc.get_traced_memory()[0] - base
+    samples = [make_samples() for _ in range(VUS)]
+    samples_size = tracemalloc.get_traced_memory()[0] - base - events_size
+    tracemalloc.stop()
+
+    count = VUS * REQUESTS
+    print("%s VUs x %s requests" % (len(events), len(samples[0].subsamples[0].subsamples)))
+    print("events:  %5.0f B/request" % (events_size / count))
+    print("samples: %5.0f B/request" % (samples_size / count))
+    print("total:   %5.0f B/request" % ((events_size + samples_size) / count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+"""
+Time of script with 8 assertions and extractors on one JSON or HTML response: body is parsed once
+and shared by all checks, or parsed for every check (new HTTPResponse for each one, as before)
+"""
+import json
+import timeit
+
+import requests
+
+import apiritif
+from apiritif.http import HTTPResponse
+
+RUNS = 20
+JSON_BODY = json.dumps({"users": [{"id": i, "name": "user%s" % i, "tags": ["a", "b"]} for i in range(2000)],
+                        "total": 2000})
+HTML_BODY = "<html><head><title>T</title></head><body>%s</body></html>" % "".join(
+    '<div class="item" id="i%s"><a href="/p/%s">Item %s</a></div>' % (i, i, i) for i in range(2000))
+
+
+def make_response(body, content_type):
+    py_response = requests.Response()
+    py_response.status_code = 200
+    py_response.reason = "OK"
+    py_response.url = "http://example.com/"
+    py_response.request = requests.Request("GET", py_response.url).prepare()
+    py_response.headers["Content-Type"] = content_type + "; charset=utf-8"
+    py_response._content = body.encode("utf-8")
+    return py_response
+
+
+def json_checks(get_response):
+    get_response().assert_jsonpath("$.total", 2000)
+    get_response().assert_jsonpath("$.users[0].name", "user0")
+    get_response().assert_not_jsonpath("$.missing")
+    get_response().assert_jsonpath("$.users[5].id")
+    get_response().assert_jsonpath("$.users[10].tags[0]", "a")
+    get_response().extract_jsonpath("$.users[1].id")
+    get_response().extract_jsonpath("$.users[2].name")
+    get_response().extract_jsonpath("$.total")
+
+
+def html_checks(get_response):
+    get_response().assert_cssselect("title", "T")
+    get_response().assert_cssselect("#i5 a")
+    get_response().assert_not_cssselect("#missing")
+    get_response().assert_xpath("//div[@id='i7']")
+    get_response().assert_not_xpath("//table")
+    get_response().extract_cssselect("#i9 a", "href")
+    get_response().extract_xpath("//title")
+    get_response().extract_xpath("//div[@id='i3']/a")
+
+
+def run(checks, py_response, shared):
+    response = HTTPResponse(py_response)
+    checks(lambda: response if shared else HTTPResponse(py_response))
+
+
+def main():
+    apiritif.recorder.set_level("off")
+    for name, checks, body, content_type in (("JSON", json_checks, JSON_BODY, "application/json"),
+                                             ("HTML", html_checks, HTML_BODY, "text/html")):
+        py_response = make_response(body, content_type)
+        times = []
+        for shared in (False, True):
+            times.append(timeit.timeit(lambda: run(checks, py_response, shared), number=RUNS) / RUNS * 1000)
+        print("%s, %s KB: parsed for every check %.1f ms, parsed once %.1f ms" % (
+            name, len(body) // 1024, times[0], times[1]))
+
+
+if __name__ == '__main__':
+    main()
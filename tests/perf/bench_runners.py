@@ -0,0 +1,59 @@
+"""
+Iterations per second of one VU running single empty test case with every test runner
+"""
+import contextlib
+import io
+import logging
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from apiritif.loadgen import Worker, Params
+
+ITERATIONS = 2000
+TEST_SCRIPT = """
+from unittest import TestCase
+
+
+class TestEmpty(TestCase):
+    def test_empty(self):
+        pass
+"""
+
+
+def measure(runner, test_file, iterations):
+    outfile = tempfile.NamedTemporaryFile(suffix=".csv")
+    params = Params()
+    params.concurrency = 1
+    params.iterations = iterations
+    params.runner = runner
+    params.report = outfile.name
+    params.tests = [test_file]
+
+    worker = Worker(params)
+    start = time.time()
+    with contextlib.redirect_stderr(io.StringIO()):  # nose2 reports every run
+        worker.start()
+        worker.join()
+    return iterations / (time.time() - start)
+
+
+def main():
+    logging.disable(logging.CRITICAL)
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else ITERATIONS
+    temp_dir = tempfile.mkdtemp()
+    try:
+        test_file = os.path.join(temp_dir, "test_empty.py")
+        with open(test_file, "w") as fds:
+            fds.write(TEST_SCRIPT)
+
+        for runner in ("nose2", "persistent", "native"):
+            print("%-10s %7.0f iterations/s" % (runner, measure(runner, test_file, iterations)))
+    finally:
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
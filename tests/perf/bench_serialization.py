@@ -0,0 +1,56 @@
+"""
+Time of serializing one test sample (3 transactions x 5 requests) into LDJSON line: with deep copy of extras
+(as before), without it, and with to_json_line() which uses orjson when it's installed
+"""
+import copy
+import json
+import time
+import timeit
+
+from apiritif.samples import Sample, PathComponent
+from apiritif.utils import to_json_line, orjson
+
+RUNS = 100
+
+
+def make_sample(body_items):
+    body = '{"items": [%s]}' % ",".join('{"id": %s, "name": "item"}' % i for i in range(body_items))
+    headers = {"Header-%s" % i: "v" * 40 for i in range(15)}
+    top = Sample(test_suite="Suite", test_case="test_flow", status="PASSED", start_time=time.time(), duration=1.0)
+    top.path = [PathComponent("class", "Suite"), PathComponent("method", "test_flow")]
+    for tran_index in range(3):
+        tran = Sample(test_suite="test_flow", test_case="tran %s" % tran_index, status="PASSED",
+                      start_time=time.time(), duration=0.3)
+        tran.path = top.path + [PathComponent("transaction", tran.test_case)]
+        for request_index in range(5):
+            url = "http://example.com/api/%s" % request_index
+            request = Sample(test_suite=tran.test_case, test_case=url, status="PASSED", start_time=time.time(),
+                             duration=0.05)
+            request.path = tran.path + [PathComponent("request", url)]
+            request.extras.update({
+                "requestMethod": "GET", "requestURI": url, "requestHeaders": dict(headers), "requestBody": "",
+                "requestCookies": {"name": "value"}, "requestCookiesRaw": "name=value", "responseCode": 200,
+                "responseMessage": "OK", "responseHeaders": dict(headers), "responseBody": body,
+                "responseBodySize": len(body), "responseHeadersSize": 900, "responseTime": 50, "assertions": []})
+            for assertion_index in range(3):
+                request.add_assertion("assert_%s" % assertion_index, {"args": [1, "x"], "kwargs": {"k": "v"}})
+            tran.add_subsample(request)
+        top.add_subsample(tran)
+    return top
+
+
+def main():
+    methods = [
+        ("deepcopy", lambda sample: (json.dumps(copy.deepcopy(sample.to_dict())) + "\n").encode("utf-8")),
+        ("json", lambda sample: (json.dumps(sample.to_dict()) + "\n").encode("utf-8")),
+        ("orjson" if orjson else "json (orjson isn't installed)", lambda sample: to_json_line(sample.to_dict()))]
+    for body_items in (2000, 40000):
+        sample = make_sample(body_items)
+        size = sample.subsamples[0].subsamples[0].extras["responseBodySize"]
+        for name, serialize in methods:
+            elapsed = timeit.timeit(lambda: serialize(sample), number=RUNS) / RUNS
+            print("%5d KB bodies, %-30s %.2f ms" % (size // 1024, name + ":", elapsed * 1000))
+
+
+if __name__ == '__main__':
+    main()
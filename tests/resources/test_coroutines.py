@@ -0,0 +1,24 @@
+import asyncio
+import unittest
+
+import apiritif
+from apiritif import thread
+
+
+async def test_vu_context():
+    apiritif.put_into_thread_store(vu_index=thread.get_index())
+    await asyncio.sleep(0.01)  # other VUs are running meanwhile
+    assert apiritif.get_from_thread_store("vu_index") == thread.get_index(), "context is shared"
+
+
+class TestCoroutines(unittest.TestCase):
+    async def test_smart_transaction(self):
+        async with apiritif.smart_transaction("async transaction"):
+            await asyncio.sleep(0.01)
+
+    async def test_failed(self):
+        await asyncio.sleep(0)
+        self.fail("coroutine failed")
+
+    def test_regular(self):
+        pass
@@ -0,0 +1,44 @@
+import unittest
+
+import apiritif
+
+
+def count(name):
+    apiritif.put_into_thread_store(**{name: (apiritif.get_from_thread_store(name) or 0) + 1})
+
+
+def setUpModule():
+    count("module_setups")
+
+
+def tearDownModule():
+    count("module_teardowns")
+
+
+def test_function():
+    with apiritif.transaction("function transaction"):
+        pass
+
+
+def test_failed_function():
+    assert False, "function failed"
+
+
+class TestMethods(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        count("class_setups")
+
+    @classmethod
+    def tearDownClass(cls):
+        count("class_teardowns")
+
+    def test_passed(self):
+        pass
+
+    def test_broken(self):
+        raise ValueError("method broken")
+
+    @unittest.skip("not now")
+    def test_skipped(self):
+        pass
@@ -5,7 +5,7 @@ import apiritif
 
 
 def setUpModule():
-    raise BaseException
+    raise BaseException("module setup failed")
 
 
 class TestSimple(TestCase):
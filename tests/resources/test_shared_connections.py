@@ -0,0 +1,11 @@
+import os
+import unittest
+
+from apiritif import http
+
+
+class TestSharedConnections(unittest.TestCase):
+    def test_requests(self):
+        address = os.environ["SHARED_CONNECTIONS_ADDRESS"]
+        http.get(address + "/").assert_ok()
+        http.target(address, share_session=True).get("/")
@@ -0,0 +1,10 @@
+import time
+from unittest import TestCase
+
+import apiritif
+
+
+class TestVUIndex(TestCase):
+    def test_vu(self):
+        with apiritif.transaction("vu %s" % apiritif.thread.get_index()):
+            time.sleep(0.01)
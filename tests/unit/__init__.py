@@ -1,5 +1,9 @@
 import os
+import ssl
+import threading
+from http.server import ThreadingHTTPServer
 
+import requests
 from urllib3 import disable_warnings
 
 from apiritif.loadgen import ApiritifPlugin
@@ -17,3 +21,29 @@ class Recorder(ApiritifPlugin):
         super().__init__()
         self.session.stop_reason = ""
 
+
+def make_response(body, headers=None, status_code=200, url="http://example.com/"):
+    """ requests.Response as it comes from server, to test HTTPResponse without network """
+    py_response = requests.Response()
+    py_response.status_code = status_code
+    py_response.url = url
+    py_response.request = requests.Request("GET", url).prepare()
+    py_response.headers.update(headers or {})
+    py_response._content = body
+    return py_response
+
+
+class LocalServerMixin(object):
+    """ Runs local HTTP(S) server in background thread till the end of test """
+
+    def start_server(self, handler, tls=False):
+        """ :return: address of server """
+        server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        if tls:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(os.path.join(RESOURCES_DIR, "certificates/localhost.pem"))  # self-signed
+            server.socket = context.wrap_socket(server.socket, server_side=True)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)  # cleanups are called in reverse order
+        return "%s://127.0.0.1:%s" % ("https" if tls else "http", server.server_port)
@@ -0,0 +1,130 @@
+import json
+import os
+import random
+import tempfile
+from unittest import TestCase, mock
+
+from apiritif.aggregates import LatencyHistogram, Aggregate, AggregatingSampleWriter
+from apiritif.loadgen import Params, Supervisor, get_writer_class
+from apiritif.samples import Sample
+from tests.unit import RESOURCES_DIR
+
+
+class TestLatencyHistogram(TestCase):
+    def test_percentiles(self):
+        values = [random.expovariate(10) for _ in range(10000)]
+        histogram = LatencyHistogram()
+        for value in values:
+            histogram.add(value)
+
+        values.sort()
+        for percent in (50, 90, 99):
+            expected = values[int(len(values) * percent / 100.0) - 1]
+            self.assertAlmostEqual(expected, histogram.percentile(percent), delta=expected / 50 + 0.000001)
+        self.assertLess(len(histogram.counts), 1000)
+
+    def test_merge(self):
+        first, second = LatencyHistogram(), LatencyHistogram()
+        first.add(0.001)
+        second.add(1.0)
+        second.add(1.0)
+        first.merge(second)
+        self.assertEqual(3, first.total)
+        self.assertAlmostEqual(0.001, first.percentile(10), delta=0.00001)
+        self.assertAlmostEqual(1.0, first.percentile(50), delta=0.01)
+        self.assertIsNone(LatencyHistogram().percentile(50))
+
+
+class TestAggregatingWriter(TestCase):
+    def write(self, report, samples, keep_failures=False):
+        writer = AggregatingSampleWriter(report, interval=1, keep_failures=keep_failures)
+        with writer:
+            for sample in samples:
+                writer.add(sample, 1, 1)
+
+        with open(report) as fds:
+            return [json.loads(line) for line in fds]
+
+    def test_aggregates(self):
+        samples = []
+        for i in range(100):
+            sample = Sample(test_case="label %s" % (i % 2), status="PASSED" if i % 10 else "FAILED",
+                            start_time=1000 + i / 50.0, duration=0.01 * (i % 10 + 1),
+                            error_msg=None if i % 10 else "Bad response")
+            sample.extras["responseCode"] = "200"
+            samples.append(sample)
+
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        records = self.write(outfile.name, samples)
+        self.assertEqual([(1000, "label 0"), (1000, "label 1"), (1001, "label 0"), (1001, "label 1")],
+                         [(record["timestamp"], record["label"]) for record in records])
+        self.assertEqual(25, records[0]["count"])
+        self.assertEqual(5, records[0]["failures"])
+        self.assertEqual({"Bad response": 5}, records[0]["errors"])
+        self.assertEqual({"200": 25}, records[0]["codes"])
+        self.assertAlmostEqual(0.01, records[0]["min"])
+        self.assertAlmostEqual(0.09, records[0]["percentiles"]["90.0"], delta=0.001)
+
+        records = self.write(outfile.name, samples, keep_failures=True)
+        failures = [record for record in records if record["type"] == "sample"]
+        self.assertEqual(10, len(failures))
+        self.assertEqual("Bad response", failures[0]["error_msg"])
+
+    def test_streaming_merge(self):
+        parts = [tempfile.NamedTemporaryFile(suffix=".ldjson") for _ in range(2)]
+        for index, part in enumerate(parts):
+            samples = [Sample(test_case="label %s" % index, status="PASSED", start_time=1000 + i / 10.0, duration=0.1)
+                       for i in range(100)]
+            samples.append(Sample(test_case="failed", status="FAILED", start_time=1001, duration=0.1))
+            late = tempfile.NamedTemporaryFile(suffix=".ldjson")
+            late_record = self.write(late.name, samples[:1])[0]
+            self.write(part.name, samples, keep_failures=True)
+            with open(part.name, "a") as fds:
+                fds.write(json.dumps(late_record) + "\n")  # record of the first interval after the last one
+
+        read, written = [0], []
+        from_dict, to_dict = Aggregate.from_dict, Aggregate.to_dict
+
+        def count_read(data):
+            read[0] += 1
+            return from_dict(data)
+
+        def count_written(aggregate):
+            written.append(read[0])
+            return to_dict(aggregate)
+
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        with mock.patch.object(Aggregate, "from_dict", count_read), mock.patch.object(Aggregate, "to_dict",
+                                                                                      count_written):
+            AggregatingSampleWriter.merge([part.name for part in parts], outfile.name)
+        self.assertLess(written[0], read[0] / 2)  # first interval is written before parts are read till the end
+
+        with open(outfile.name) as fds:
+            records = [json.loads(line) for line in fds]
+        aggregates = [(record["timestamp"], record["label"], record["count"])
+                      for record in records if record["type"] == "aggregate"]
+        expected = [(1000, "label 0", 10), (1000, "label 1", 10), (1001, "failed", 2)]
+        expected += [(timestamp, "label %s" % index, 10) for timestamp in range(1001, 1009) for index in range(2)]
+        expected += [(1000, "label 0", 1), (1000, "label 1", 1)]  # late records
+        expected += [(1009, "label 0", 10), (1009, "label 1", 10)]
+        self.assertEqual(expected, aggregates)
+        self.assertEqual(2, len([record for record in records if record["type"] == "sample"]))
+
+    def test_merged_by_supervisor(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+        params.report = outfile.name
+        params.aggregate = 60
+        params.concurrency = 3
+        params.worker_count = 2
+        params.iterations = 2
+        sup = Supervisor(params)
+        sup.start()
+        sup.join()
+
+        self.assertIs(AggregatingSampleWriter, get_writer_class(params.report, params.aggregate))
+        with open(outfile.name) as fds:
+            records = [json.loads(line) for line in fds]
+        self.assertEqual(12, sum(record["count"] for record in records))
+        self.assertEqual(len(records), len(set((record["timestamp"], record["label"]) for record in records)))
@@ -0,0 +1,122 @@
+import json
+import os
+import tempfile
+from unittest import TestCase, mock
+
+from apiritif.apbin import APBinSampleWriter, APBinReader, APBinEncoder, convert
+from apiritif.loadgen import get_writer_class
+from apiritif.samples import Sample
+
+
+def get_samples(count):
+    samples = []
+    for i in range(count):
+        sample = Sample(test_case="label %s" % (i % 3), status="PASSED" if i % 2 else "FAILED",
+                        start_time=1500000000 + i, duration=0.5, error_msg=None if i % 2 else "error %s" % i)
+        sample.extras.update(responseCode="200", responseHeadersSize=10, responseBodySize=100)
+        samples.append(sample)
+    return samples
+
+
+class TestAPBin(TestCase):
+    def setUp(self):
+        self.files = []
+
+    def tearDown(self):
+        for name in self.files:
+            if os.path.exists(name):
+                os.remove(name)
+
+    def get_file(self, suffix):
+        fds, name = tempfile.mkstemp(suffix=suffix)
+        os.close(fds)
+        self.files.append(name)
+        return name
+
+    def write(self, report, samples):
+        writer = get_writer_class(report)(report)
+        with writer:
+            for sample in samples:
+                writer.add(sample, 1, 1)
+        return writer
+
+    def test_round_trip(self):
+        report = self.get_file(".apbin")
+        self.assertIsInstance(self.write(report, get_samples(10)), APBinSampleWriter)
+
+        records = list(APBinReader(report))
+        self.assertEqual(10, len(records))
+        self.assertEqual("label 1", records[1].label)
+        self.assertEqual("PASSED", records[1].status)
+        self.assertEqual(200, records[1].response_code)
+        self.assertEqual(112, records[1].bytes)
+        self.assertEqual(1500000001, records[1].start_time)
+        self.assertEqual(0.5, records[1].elapsed)
+        self.assertEqual("error 2", records[2].message)
+
+    def test_big_values(self):
+        samples = get_samples(6)
+        for sample in samples:
+            sample.test_case += "?query=%s" % sample.start_time  # every label is unique
+        samples[0].extras["responseBodySize"] = 5 * 1024 ** 3
+
+        report = self.get_file(".apbin")
+        merged = self.get_file(".apbin")
+        with mock.patch.object(APBinEncoder, "MAX_STRINGS", 2):
+            writer = self.write(report, samples)
+            APBinSampleWriter.merge([report, report], merged)
+
+        self.assertEqual(2, len(writer.encoder.strings))
+        for name in (report, merged):
+            records = list(APBinReader(name))
+            self.assertEqual([sample.test_case for sample in samples] * (len(records) // 6),
+                             [record.label for record in records])
+            self.assertEqual(["error 0", None, "error 2", None, "error 4", None] * (len(records) // 6),
+                             [record.message for record in records])
+            self.assertGreater(records[0].bytes, 5 * 1024 ** 3)  # more than 32-bit field holds
+
+    def test_partial_and_wrong_files(self):
+        report = self.get_file(".apbin")
+        self.assertEqual([], list(APBinReader(report)))
+
+        self.write(report, get_samples(5))
+        with open(report, "rb+") as fds:
+            fds.truncate(os.path.getsize(report) - 1)  # last record is being written now
+        self.assertEqual(4, len(list(APBinReader(report))))
+
+        ldjson = self.get_file(".ldjson")
+        self.write(ldjson, get_samples(1))
+        self.assertRaises(ValueError, list, APBinReader(ldjson))
+
+    def test_merge_and_convert(self):
+        parts = [self.get_file(".apbin") for _ in range(2)]
+        self.write(parts[0], get_samples(4))
+        self.write(parts[1], get_samples(6)[::-1])  # labels appear in different order
+        report = self.get_file(".apbin")
+        APBinSampleWriter.merge(parts, report)
+
+        records = list(APBinReader(report))
+        self.assertEqual(10, len(records))
+        self.assertEqual("label 2", records[4].label)
+
+        jtl = self.get_file(".csv")
+        convert(report, jtl)
+        with open(jtl) as fds:
+            lines = fds.readlines()
+        self.assertEqual(11, len(lines))
+        self.assertTrue(lines[0].startswith("timeStamp,elapsed"))
+
+        ldjson = self.get_file(".ldjson")
+        convert(report, ldjson)
+        with open(ldjson) as fds:
+            samples = [json.loads(line) for line in fds]
+        self.assertEqual("label 0", samples[0]["test_case"])
+        self.assertEqual("error 0", samples[0]["error_msg"])
+
+    def test_size(self):
+        samples = get_samples(1000)
+        report = self.get_file(".apbin")
+        ldjson = self.get_file(".ldjson")
+        self.write(report, samples)
+        self.write(ldjson, samples)
+        self.assertLess(os.path.getsize(report) * 5, os.path.getsize(ldjson))
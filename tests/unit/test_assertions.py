@@ -1,6 +1,12 @@
+import sys
+import threading
 import unittest
 
-from apiritif import http
+import apiritif
+from apiritif import http, AssertionSet
+from apiritif.http import HTTPResponse
+from apiritif.utils import ExpressionCache, expressions
+from tests.unit import make_response
 
 
 class TestRequests(unittest.TestCase):
@@ -103,3 +109,110 @@ class TestRequests(unittest.TestCase):
     def test_assert_regex_not_in_headers(self):
         response = http.get('http://blazedemo.com/')
         response.assert_regex_not_in_headers(r"Content-Type: application/.+")
+
+    def test_lazy_attributes(self):
+        headers = {"Content-Type": "text/plain; charset=utf-8", "Set-Cookie": "name=value"}
+        response = HTTPResponse(make_response(u"тело".encode("utf-8"), headers))
+        for name in ("text", "headers", "cookies"):
+            self.assertNotIn(name, response.__dict__)
+
+        response.assert_in_body(u"тело")
+        response.assert_header_value("content-type", "text/plain; charset=utf-8")
+        self.assertIs(response.text, response.text)
+        self.assertIn("text", response.__dict__)
+        self.assertEqual(8, len(response.content))
+
+    def test_parsed_body_cache(self):
+        body = b'<html><head><title>T</title></head><body><a href="/next">next</a></body></html>'
+        response = HTTPResponse(make_response(body, {"Content-Type": "text/html; charset=utf-8"}))
+        response.assert_cssselect("title", "T")
+        response.assert_not_cssselect("table")
+        self.assertEqual("/next", response.extract_cssselect("a", "href"))
+        response.assert_xpath("//title", parser_type="html")
+        self.assertEqual("T", response.extract_xpath("//title", parser_type="html"))
+        self.assertEqual(2, len(response._parsed))  # cssselect tree and html xpath tree
+
+        response.assert_not_xpath("//table", parser_type="xml", validate=False)
+        self.assertEqual(3, len(response._parsed))
+
+        body = b'{"items": [1, 2], "name": "x"}'
+        response = HTTPResponse(make_response(body, {"Content-Type": "application/json"}))
+        response.assert_jsonpath("$.name", "x")
+        response.assert_not_jsonpath("$.missing")
+        self.assertEqual(1, response.extract_jsonpath("$.items[0]"))
+        self.assertEqual(1, len(response._parsed))
+        self.assertIsNot(response.json(), response.json())  # public json() returns a fresh copy
+
+        items = response.extract_jsonpath("$.items")
+        items.append(3)
+        response.assert_not_jsonpath("$.items[2]")  # changes of extracted value don't affect parsed body
+        self.assertEqual([1, 2], response.extract_jsonpath("$.items"))
+
+    def test_expression_cache(self):
+        cache = ExpressionCache(2)
+        compiled = []
+        for expr in ("a", "b", "a", "c", "b"):
+            compiled.append(cache.get("regex", expr, lambda x: [x]))
+        self.assertIs(compiled[0], compiled[2])
+        self.assertIsNot(compiled[1], compiled[4])  # 'b' was evicted by 'c'
+        self.assertEqual({"size": 2, "hits": 1, "misses": 4}, cache.get_stats())
+        self.assertRaises(ValueError, cache.get, "regex", "d", int)
+        self.assertEqual(2, cache.get_stats()["size"])
+
+        py_response = make_response(b'{"name": "x"}')
+        expressions.clear()
+        for _ in range(3):
+            response = HTTPResponse(py_response)
+            response.assert_jsonpath("$.name", "x")
+            response.assert_regex_in_body('"name"')
+            self.assertEqual("x", response.extract_regex('"(x)"').group(1))
+        self.assertEqual({"size": 3, "hits": 6, "misses": 3}, expressions.get_stats())
+
+    def test_xpath_evaluators_per_thread(self):
+        body = b'<html><head><title>T</title></head><body><a href="/next">next</a></body></html>'
+        py_response = make_response(body, {"Content-Type": "text/html; charset=utf-8"})
+        evaluators, errors = [], []
+
+        def extract():
+            try:
+                for _ in range(50):
+                    response = HTTPResponse(py_response)
+                    self.assertEqual("/next", response.extract_cssselect("a", "href"))
+                    self.assertEqual("T", response.extract_xpath("//title", parser_type="html"))
+                evaluators.append(expressions.get_local("css", "a", None))
+                evaluators.append(expressions.get_local("xpath", "//title", None))
+            except BaseException as exc:
+                errors.append(exc)
+
+        expressions.clear()
+        threads = [threading.Thread(target=extract) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(8, len(set(map(id, evaluators))))  # every thread has its own compiled evaluators
+        self.assertEqual(1, expressions.get_stats()["size"])  # translated CSS selector is shared
+
+    def test_assert_all(self):
+        py_response = make_response(b'{"name": "x", "items": [1, 2]}', {"Content-Type": "application/json"})
+
+        checks = AssertionSet([("status_code", 200), ("in_body", '"name"'), ("regex_in_body", r"\d+")])
+        checks.add("jsonpath", "$.name", "x").add("not_jsonpath", "$.error").add("header_value", "content-type",
+                                                                               "application/json")
+        self.assertRaises(ValueError, checks.add, "unknown", "x")
+
+        apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        response = HTTPResponse(py_response)
+        self.assertIs(response, response.assert_all(checks))
+        failing = [("status_code", 404), ("in_body", "name"), ("not_in_body", "items"), ("jsonpath", "$.items[0]", 2)]
+        with self.assertRaises(AssertionError) as context:
+            HTTPResponse(py_response).assert_all(failing)
+        self.assertIn("3 of 4 checks failed", str(context.exception))
+        self.assertIn("'items' was found in response body", str(context.exception))
+
+        events = apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        self.assertEqual(["Assertion", "Assertion", "AssertionFailure"], [type(event).__name__ for event in events])
+        self.assertEqual(["assert_all"] * 3, [event.name for event in events])
+        self.assertEqual([["status_code", 200], ["in_body", '"name"']], events[0].extras["args"][:2])
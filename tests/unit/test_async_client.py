@@ -0,0 +1,138 @@
+import asyncio
+import contextvars
+import gzip
+import json
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+import requests
+
+import apiritif
+from apiritif import http
+from apiritif.http import ConnectionError
+from tests.unit import LocalServerMixin
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if "Transfer-Encoding" not in (headers or {}):
+            self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/redirect":
+            self._respond(302, headers={"Location": "/cookies", "Set-Cookie": "name=value"})
+        elif self.path == "/cookies":
+            body = gzip.compress(self.headers.get("Cookie", "").encode())
+            self._respond(200, body, {"Content-Encoding": "gzip"})
+        elif self.path == "/cross-host":
+            self._respond(302, headers={"Location": "http://localhost:%s/headers" % self.server.server_port,
+                                        "Set-Cookie": "name=value"})
+        elif self.path == "/headers":
+            headers = {name: self.headers.get(name) for name in ("Authorization", "Cookie")}
+            self._respond(200, json.dumps(headers).encode())
+        elif self.path == "/malformed":
+            self.wfile.write(b"garbage\r\n\r\n")
+            self.close_connection = True
+        elif self.path == "/chunked":
+            self._respond(200, b"5\r\nchunk\r\n0\r\n\r\n", {"Transfer-Encoding": "chunked"})
+        else:
+            self._respond(404, b"not found")
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        self._respond(201, body, {"Content-Type": "application/json"})
+
+
+class TestAsyncClient(LocalServerMixin, TestCase):
+    def setUp(self):
+        self.address = self.start_server(Handler)
+
+    def run_async(self, coroutine):
+        return contextvars.Context().run(asyncio.run, coroutine)  # recorder must be clean for each test
+
+    def test_target(self):
+        async def scenario():
+            target = http.async_target(self.address, auto_assert_ok=False)
+            redirected = await target.get("/redirect")
+            chunked = await target.get("/chunked")
+            posted = await target.post("/echo", json={"key": "value"})
+            missing = await target.get("/missing")
+            return target, redirected, chunked, posted, missing
+
+        target, redirected, chunked, posted, missing = self.run_async(scenario())
+        self.assertEqual("name=value", redirected.text)
+        self.assertEqual(302, redirected._response.history[0].status_code)
+        self.assertEqual("chunk", chunked.text)
+        self.assertEqual({"key": "value"}, posted.json())
+        self.assertEqual(201, posted.status_code)
+        self.assertEqual(404, missing.status_code)
+        self.assertEqual({"name": "value"}, target._get_session().cookies.get_dict())
+
+        idle = target._get_session()._idle[("http", "127.0.0.1", int(self.address.rsplit(":", 1)[1]))]
+        self.assertEqual(1, len(idle))  # all requests were sent over single connection
+
+    def test_recording(self):
+        async def scenario():
+            async with apiritif.transaction("async"):
+                response = await http.async_request("GET", self.address + "/chunked")
+                response.assert_ok()
+            try:
+                await http.async_request("GET", "http://127.0.0.1:1/")
+            except ConnectionError:
+                pass
+            return apiritif.recorder.pop_events(from_ts=-1, to_ts=float("inf"))
+
+        events = self.run_async(scenario())
+        names = [event.__class__.__name__ for event in events]
+        expected = ["TransactionStarted", "Request", "Assertion", "TransactionEnded", "RequestFailure"]
+        self.assertEqual(expected, names)
+
+    def test_tasks_are_isolated(self):
+        async def vu(index):
+            apiritif.put_into_thread_store(index=index)
+            await asyncio.sleep(0.01)
+            apiritif.recorder.record_event(apiritif.Event(response=index))
+            await asyncio.sleep(0.01)
+            events = apiritif.recorder.pop_events(from_ts=-1, to_ts=float("inf"))
+            return apiritif.get_from_thread_store("index"), [event.response for event in events]
+
+        async def scenario():
+            return await asyncio.gather(*[vu(index) for index in range(10)])
+
+        self.assertEqual([(index, [index]) for index in range(10)], self.run_async(scenario()))
+
+    def test_cross_host_redirect(self):
+        async def scenario():
+            return await http.async_request("GET", self.address + "/cross-host", headers={"Authorization": "secret"})
+
+        response = self.run_async(scenario())
+        self.assertEqual({"Authorization": None, "Cookie": None}, response.json())  # 127.0.0.1 -> localhost
+        self.assertEqual({"Authorization": None, "Cookie": None}, http.get(self.address + "/cross-host",
+                                                                           headers={"Authorization": "secret"}).json())
+
+    def test_malformed_status_line(self):
+        async def scenario():
+            try:
+                await http.async_request("GET", self.address + "/malformed")
+            except ConnectionError:
+                return apiritif.recorder.pop_events(from_ts=-1, to_ts=float("inf"))
+
+        events = self.run_async(scenario())
+        self.assertEqual(["RequestFailure"], [event.__class__.__name__ for event in events])
+        self.assertIsInstance(events[0].exception, requests.exceptions.ConnectionError)
+        self.assertIn("Malformed status line: b'garbage", str(events[0].exception))
+
+    def test_unverified_https(self):
+        address = self.start_server(Handler, tls=True) + "/chunked"  # self-signed certificate
+        self.assertEqual("chunk", http.get(address).text)
+        self.assertEqual("chunk", self.run_async(http.async_request("GET", address)).text)
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import tempfile
 
@@ -106,6 +107,28 @@ class TestCSV(TestCase):
 
         self.fail()
 
+    def test_coroutine_vus(self):
+        reader = CSVReaderPerThread(os.path.join(RESOURCES_DIR, "data/source0.csv"))
+        other = CSVReaderPerThread(os.path.join(RESOURCES_DIR, "data/source1.csv"))
+        other.read_vars()  # registry of readers is inherited by VUs
+        thread.set_total(2)
+
+        async def vu(index):
+            thread.set_index(index)
+            reader.read_vars()
+            await asyncio.sleep(0.01)  # other VU reads meanwhile
+            reader.read_vars()
+            name = reader.get_vars()["name"]
+            reader.close()
+            return name
+
+        async def scenario():
+            return await asyncio.gather(vu(0), vu(1))
+
+        self.assertEqual(["user2", "user3"], asyncio.run(scenario()))  # every VU reads its own rows
+        self.assertEqual([id(other)], list(thread_data.csv_readers))
+        other.close()
+
     def test_shared_csv(self):
         concurrency = 2
         script = os.path.join(RESOURCES_DIR, "test_csv_records.py")
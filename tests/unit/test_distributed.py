@@ -0,0 +1,85 @@
+import os
+import tempfile
+import time
+from threading import Thread
+from unittest import TestCase
+
+from apiritif.distributed import Agent, AgentConnection, Controller, params_to_dict, params_from_dict
+from apiritif.loadgen import Params, LoadProfile
+from tests.unit import RESOURCES_DIR
+
+dummy_tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
+TOKEN = "secret"
+
+
+class TestDistributed(TestCase):
+    def setUp(self):
+        self.agents = [Agent(("127.0.0.1", 0), workers, TOKEN) for workers in (1, 2)]
+        for agent in self.agents:
+            Thread(target=agent.serve_forever, daemon=True).start()
+
+    def tearDown(self):
+        for agent in self.agents:
+            agent.shutdown()
+            agent.server_close()
+
+    def run_controller(self, report, concurrency=3, iterations=2):
+        params = Params()
+        params.tests = dummy_tests
+        params.report = report
+        params.concurrency = concurrency
+        params.iterations = iterations
+        params.agents = ["%s:%s" % agent.server_address for agent in self.agents]
+        params.token = TOKEN
+
+        controller = Controller(params)
+        controller.start()
+        controller.join()
+        return params
+
+    def test_merged_results(self):
+        for ext, lines_count in ((".csv", 1 + 12), (".ldjson", 12)):  # csv has header
+            outfile = tempfile.NamedTemporaryFile(suffix=ext)
+            params = self.run_controller(outfile.name)
+            self.assertEqual(3, params.worker_count)
+
+            with open(outfile.name) as fds:
+                result = fds.readlines()
+            self.assertEqual(lines_count, len(result))
+
+            dir_name = os.path.dirname(outfile.name)
+            parts = [name for name in os.listdir(dir_name) if name.endswith(os.path.basename(outfile.name))]
+            self.assertEqual([os.path.basename(outfile.name)], parts)
+
+    def test_low_concurrency(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        start = time.time()
+        params = self.run_controller(outfile.name, concurrency=1, iterations=3)
+        self.assertEqual(1, params.worker_count)
+        self.assertGreater(time.time() - start, 1)  # workers waited for synchronized start
+
+        with open(outfile.name) as fds:
+            self.assertEqual(2 * 3, len(fds.readlines()))
+
+    def test_token(self):
+        host, port = self.agents[0].server_address
+        for token in ("wrong", None):
+            connection = AgentConnection(host, port, token)
+            try:
+                with self.assertRaises(RuntimeError) as context:
+                    connection.open()
+                self.assertIn("refused connection: wrong token", str(context.exception))
+            finally:
+                connection.close()
+
+        self.assertRaises(ValueError, Agent, ("127.0.0.1", 0), 1, "")
+
+    def test_params_serialization(self):
+        params = Params()
+        params.concurrency = 5
+        params.token = TOKEN
+        params.load_profile = LoadProfile.parse("1m:10,30:0")
+        restored = params_from_dict(params_to_dict(params))
+        self.assertIsNone(restored.token)  # isn't sent to agents
+        self.assertEqual(5, restored.concurrency)
+        self.assertEqual(params.load_profile.stages, restored.load_profile.stages)
@@ -1,17 +1,25 @@
 import copy
+import gzip
+import json
 import logging
+import multiprocessing
 import os
+import sys
 import tempfile
 import time
 import threading
-from unittest import TestCase
+import zlib
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase, mock
 from multiprocessing.pool import CLOSE
 
 import apiritif
-from apiritif import store, thread
+from apiritif import store, thread, http
 from apiritif.samples import Sample
-from apiritif.loadgen import Worker, Params, Supervisor, JTLSampleWriter
-from tests.unit import RESOURCES_DIR
+from apiritif.loadgen import Worker, Params, Supervisor, JTLSampleWriter, get_worker_count, ArrivalScheduler
+from apiritif.loadgen import AsyncWorker, LDJSONSampleWriter, get_writer_class, open_report
+from apiritif.loadgen import LoadProfile, ApiritifTestResult, VUSession
+from tests.unit import RESOURCES_DIR, LocalServerMixin
 
 dummy_tests = [os.path.join(RESOURCES_DIR, "test_dummy.py")]
 logging.basicConfig(level=logging.DEBUG)
@@ -24,7 +32,19 @@ class DummyWriter(JTLSampleWriter):
             log.write("%s\n" % os.getpid())
 
 
-class TestLoadGen(TestCase):
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+class TestLoadGen(LocalServerMixin, TestCase):
     def test_thread(self):
         outfile = tempfile.NamedTemporaryFile()
         params = Params()
@@ -115,6 +135,35 @@ class TestLoadGen(TestCase):
         while sup.is_alive():
             time.sleep(1)
 
+    def test_supervisor_merges_reports(self):
+        cases = ((".csv", 1 + 12), (".ldjson", 12), (".csv.gz", 1 + 12), (".ldjson.gz", 12))  # csv has header
+        for ext, lines_count in cases:
+            outfile = tempfile.NamedTemporaryFile(suffix=ext)
+            params = Params()
+            params.tests = dummy_tests
+            params.report = outfile.name
+            params.concurrency = 3
+            params.worker_count = 2
+            params.iterations = 2
+            sup = Supervisor(params)
+            sup.start()
+            sup.join()
+
+            with open_report(outfile.name, "rb") as fds:
+                result = fds.readlines()
+            self.assertEqual(lines_count, len(result))
+
+            dir_name = os.path.dirname(outfile.name)
+            parts = [name for name in os.listdir(dir_name) if name.endswith(os.path.basename(outfile.name))]
+            self.assertEqual([os.path.basename(outfile.name)], parts)
+
+    def test_worker_count(self):
+        self.assertEqual(1, get_worker_count("1", 10))
+        self.assertEqual(3, get_worker_count("8", 3))
+        self.assertEqual(min(multiprocessing.cpu_count(), 100), get_worker_count("auto", 100))
+        self.assertRaises(ValueError, get_worker_count, "0", 10)
+        self.assertRaises(ValueError, get_worker_count, "many", 10)
+
     def test_empty_supervisor(self):
         outfile = tempfile.NamedTemporaryFile()
         params = Params()
@@ -233,6 +282,218 @@ class TestLoadGen(TestCase):
         res1 = [x.delay for x in worker1._get_thread_params()]
         self.assertEquals(params1.concurrency, len(res1))
 
+    def test_arrival_rate(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 5
+        params.arrival_rate = 10
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        started = time.time()
+        worker.start()
+        worker.join()
+
+        self.assertGreaterEqual(time.time() - started, 0.4)  # 5 iterations with 0.1s interval
+        self.assertEqual(5, worker.scheduler.started)
+        with open(outfile.name) as fds:
+            result = fds.readlines()
+        self.assertEqual(5 * 2, len(result))
+
+    def test_arrival_rate_slicing(self):
+        params = Params()
+        params.report = "result-%s.csv"
+        params.concurrency = 10
+        params.worker_count = 3
+        params.iterations = 100
+        params.arrival_rate = 50
+        sliced = list(Supervisor(params)._concurrency_slicer())
+        self.assertEqual(100, sum(x.iterations for x in sliced))
+        self.assertAlmostEqual(50, sum(x.arrival_rate for x in sliced))
+
+    def test_persistent_runner(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 3
+        params.runner = "persistent"
+        params.report = outfile.name
+        params.tests = dummy_tests
+
+        worker = Worker(params)
+        worker.start()
+        worker.join()
+
+        with open(outfile.name) as fds:
+            result = [json.loads(line) for line in fds.readlines()]
+        self.assertEqual(2 * 3 * 2, len(result))
+        self.assertEqual(6, len([sample for sample in result if sample["test_case"] == "test_case2"]))
+
+    def test_persistent_runner_empty_test_file(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 2
+        params.runner = "persistent"
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_invalid.py")]
+
+        worker = Worker(params)
+        self.assertRaises(RuntimeError, worker.start)
+
+    def test_native_runner(self):
+        def run(runner, engine="threads"):
+            outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+            params = Params()
+            params.concurrency = 1
+            params.iterations = 2
+            params.runner = runner
+            params.engine = engine
+            params.report = outfile.name
+            params.tests = [os.path.join(RESOURCES_DIR, "test_functions.py")]
+
+            worker = AsyncWorker(params) if engine == "asyncio" else Worker(params)
+            worker.start()
+            worker.join()
+
+            with open(outfile.name) as fds:
+                samples = [json.loads(line) for line in fds.readlines()]
+            return sorted((s["test_suite"], s["test_case"], s["status"], s["error_msg"]) for s in samples)
+
+        native = run("native")
+        self.assertEqual(2 * 5, len(native))
+        self.assertIn(("TestMethods", "test_broken", "FAILED", "method broken"), native)
+        self.assertIn(("TestMethods", "test_skipped", "SKIPPED", None), native)
+        self.assertIn(("test_functions", "test_failed_function", "FAILED", "function failed"), native)
+        self.assertEqual(run("nose2"), native)
+        self.assertEqual(run("native", engine="asyncio"), native)
+
+    def test_asyncio_engine(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 100
+        params.iterations = 2
+        params.engine = "asyncio"
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_coroutines.py")]
+
+        start = time.time()
+        worker = AsyncWorker(params)
+        worker.start()
+        worker.join()
+        self.assertLess(time.time() - start, 5)  # VUs await sleeps concurrently
+
+        with open(outfile.name) as fds:
+            samples = [json.loads(line) for line in fds.readlines()]
+        statuses = {}
+        for sample in samples:
+            key = (sample["test_case"], sample["status"], sample["error_msg"])
+            statuses[key] = statuses.get(key, 0) + 1
+
+        expected = {
+            ("test_vu_context", "PASSED", None): 200,
+            ("test_smart_transaction", "PASSED", None): 200,
+            ("test_failed", "FAILED", "coroutine failed"): 200,
+            ("test_regular", "PASSED", None): 200}
+        self.assertEqual(expected, statuses)
+
+    def test_fixtures_scope(self):
+        for scope, setups in (("iteration", 3), ("vu", 1)):
+            outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+            params = Params()
+            params.concurrency = 1
+            params.iterations = 3
+            params.runner = "native"
+            params.fixtures_scope = scope
+            params.report = outfile.name
+            params.tests = [os.path.join(RESOURCES_DIR, "test_functions.py")]
+
+            counters = ["module_setups", "module_teardowns", "class_setups", "class_teardowns"]
+            apiritif.put_into_thread_store(**{name: 0 for name in counters})
+            worker = Worker(params)
+            with store.writer:
+                worker.run_nose(params)
+
+            self.assertEqual([setups] * 4, apiritif.get_from_thread_store(counters))
+            with open(outfile.name) as fds:
+                self.assertEqual(3 * 5, len(fds.readlines()))
+
+    def test_native_runner_errors(self):
+        outfile = tempfile.NamedTemporaryFile()
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 1
+        params.runner = "native"
+        params.report = outfile.name
+
+        params.tests = [os.path.join(RESOURCES_DIR, "test_invalid.py")]
+        self.assertRaises(RuntimeError, Worker(params).start)
+
+        params.tests = [os.path.join(RESOURCES_DIR, "test_setup_errors.py")]
+        with self.assertRaises(BaseException) as context:
+            Worker(params).run_nose(params)
+        self.assertIs(BaseException, type(context.exception))  # error of setUpModule isn't wrapped or replaced
+        self.assertEqual("module setup failed", str(context.exception))
+
+    def test_connections_closed(self):
+        get_shared_adapter, get_shared_session = http.get_shared_adapter, http.get_shared_session
+        adapters, sessions = [], []
+
+        def track_adapter():
+            adapters.append(get_shared_adapter())
+            return adapters[-1]
+
+        def track_session(*args):
+            sessions.append(get_shared_session(*args))
+            return sessions[-1]
+
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = 2
+        params.runner = "native"
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_shared_connections.py")]
+        with mock.patch.dict(os.environ, SHARED_CONNECTIONS_ADDRESS=self.start_server(KeepAliveHandler)):
+            with mock.patch.object(http, "get_shared_adapter", track_adapter), \
+                    mock.patch.object(http, "get_shared_session", track_session):
+                for engine in ("threads", "asyncio"):
+                    params.engine = engine
+                    adapters.clear()
+                    sessions.clear()
+                    worker = AsyncWorker(params) if engine == "asyncio" else Worker(params)
+                    worker.start()
+                    worker.join()
+
+                    self.assertEqual(2, len(set(map(id, adapters))))  # one adapter per VU
+                    self.assertEqual(2, len(set(map(id, sessions))))  # one session per VU
+                    adapters.extend(adapter for session in sessions for adapter in session.adapters.values())
+                    leftovers = [adapter for adapter in adapters if adapter.poolmanager.pools]
+                    self.assertEqual([], leftovers, engine)
+
+    def test_samples_not_retained(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 1
+        params.iterations = 100
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_shared_connections.py")]
+        with mock.patch.dict(os.environ, SHARED_CONNECTIONS_ADDRESS=self.start_server(KeepAliveHandler)):
+            for runner in ("persistent", "native"):
+                params.runner = runner
+                worker = Worker(params)
+                with store.writer:
+                    worker.run_nose(params)
+
+                controller = apiritif.get_from_thread_store("controller")
+                self.assertEqual(2, len(controller.apiritif_extractor.response_map), runner)  # of the last test
+
+        result = ApiritifTestResult(VUSession())
+        result.addDuration(self, 0.1)
+        self.assertEqual([], getattr(result, "collectedDurations", []))
+
     def test_unicode_ldjson(self):
         outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
         params = Params()
@@ -290,6 +551,45 @@ class TestWriter(TestCase):
         for generator in sample_generators:
             self.assertTrue(len(generator.written_results) > 1)
 
+    def test_batched_flushes(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        samples = [Sample(start_time=i, duration=i, test_case="Sample %s" % i) for i in range(10)]
+
+        writer = LDJSONSampleWriter(outfile.name, flush_interval=60, flush_size=sys.maxsize)
+        with writer:
+            for sample in samples:
+                writer.add(sample, 1, 1)
+            time.sleep(0.2)
+            with open(outfile.name) as fds:
+                self.assertEqual([], fds.readlines())  # neither interval nor size threshold is reached yet
+
+        with open(outfile.name) as fds:
+            self.assertEqual(10, len(fds.readlines()))
+        self.assertEqual(10, writer.samples_count)
+        self.assertGreater(writer.capacity, 0)
+
+        writer = LDJSONSampleWriter(outfile.name, flush_interval=60, flush_size=1)
+        with writer:
+            writer.add(samples[0], 1, 1)
+            time.sleep(0.2)
+            with open(outfile.name) as fds:
+                self.assertEqual(1, len(fds.readlines()))
+
+    def test_compressed_output(self):
+        for ext, lines_count in ((".csv.gz", 1 + 10), (".ldjson.gz", 10)):
+            outfile = tempfile.NamedTemporaryFile(suffix=ext)
+            writer = get_writer_class(outfile.name)(outfile.name, flush_interval=0.01)
+            with writer:
+                for i in range(10):
+                    writer.add(Sample(start_time=i, duration=i, test_case="Sample %s" % i), 1, 1)
+                time.sleep(0.2)
+                with open(outfile.name, "rb") as fds:  # gzip stream isn't finished yet
+                    data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(fds.read())
+                self.assertEqual(lines_count, len(data.splitlines()))
+
+            with gzip.open(outfile.name) as fds:
+                self.assertEqual(lines_count, len(fds.readlines()))
+
     def test_writers_x3(self):
         # writers must:
         #   1. be the same for threads of one process
@@ -340,6 +640,92 @@ class TestWriter(TestCase):
                 os.remove(params.report % i)
 
 
+class TestArrivalScheduler(TestCase):
+    def test_dropped_without_idle_vus(self):
+        params = Params()
+        params.arrival_rate = 100
+        params.hold_for = 0.2
+        params.iterations = sys.maxsize
+        params.concurrency = 0
+        scheduler = ArrivalScheduler(params)
+        scheduler.start()
+        scheduler.join()
+        self.assertEqual(0, scheduler.started)
+        self.assertEqual(20, scheduler.dropped)
+        self.assertIsNone(scheduler.next_iteration())
+
+    def test_ramp_up_offsets(self):
+        params = Params()
+        params.arrival_rate = 10
+        params.ramp_up = 10
+        params.hold_for = 10
+        scheduler = ArrivalScheduler(params)
+        offsets = [scheduler.profile.get_offset(number) for number in range(150)]
+        self.assertEqual(sorted(offsets), offsets)
+        self.assertAlmostEqual(10, scheduler.profile.get_offset(50))  # half of full rate during ramp-up
+        self.assertAlmostEqual(11, scheduler.profile.get_offset(60))
+        self.assertIsNone(scheduler.profile.get_offset(150))
+
+
+class TestLoadProfile(TestCase):
+    def test_parse(self):
+        profile = LoadProfile.parse("1m:10, 30:10,0:20,1h:0")
+        self.assertEqual([(60, 10), (30, 10), (0, 20), (3600, 0)], profile.stages)
+        self.assertEqual(3690, profile.duration)
+        self.assertEqual(20, profile.max_target)
+
+        profile_file = tempfile.NamedTemporaryFile(mode="w", suffix=".json")
+        json.dump([{"duration": "10s", "target": 5}, {"duration": 20, "target": 0}], profile_file)
+        profile_file.flush()
+        self.assertEqual([(10, 5), (20, 0)], LoadProfile.parse(profile_file.name).stages)
+
+        self.assertRaises(ValueError, LoadProfile.parse, "10:-1")
+        self.assertRaises(ValueError, LoadProfile.parse, "10")
+
+    def test_activation(self):
+        profile = LoadProfile([(10, 10), (10, 10), (10, 0), (0, 5), (10, 5)])
+        self.assertEqual(0, profile.get_activation_offset(0, 0))
+        self.assertAlmostEqual(5, profile.get_activation_offset(5, 0))  # ramp-up
+        self.assertEqual(15, profile.get_activation_offset(9, 15))  # plateau
+        self.assertEqual(26, profile.get_activation_offset(3, 26))  # ramp-down
+        self.assertEqual(30, profile.get_activation_offset(3, 28))  # step after ramp-down
+        self.assertIsNone(profile.get_activation_offset(7, 25))
+        self.assertIsNone(profile.get_activation_offset(0, 41))
+
+    def test_rate_offsets(self):
+        profile = LoadProfile([(10, 10), (10, 0)])  # spike: 50 iterations up, 50 down
+        offsets = [profile.get_offset(number) for number in range(100)]
+        self.assertEqual(sorted(offsets), offsets)
+        self.assertAlmostEqual(10, profile.get_offset(50))
+        self.assertAlmostEqual(20 - 10 ** 0.5, profile.get_offset(95))
+        self.assertIsNone(profile.get_offset(100))
+
+    def test_closed_model(self):
+        outfile = tempfile.NamedTemporaryFile(suffix=".ldjson")
+        params = Params()
+        params.concurrency = 2
+        params.iterations = sys.maxsize
+        params.load_profile = LoadProfile([(0, 1), (0.3, 1), (0, 2), (0.3, 2), (0, 0)])
+        params.report = outfile.name
+        params.tests = [os.path.join(RESOURCES_DIR, "test_vu_index.py")]
+
+        worker = Worker(params)
+        started = time.time()
+        worker.start()
+        worker.join()
+        self.assertGreaterEqual(time.time() - started, 0.6)
+
+        first_starts = {}  # transaction is named by VU index
+        with open(outfile.name) as fds:
+            for line in fds:
+                transaction = json.loads(line)["subsamples"][0]
+                label = transaction["test_case"]
+                first_starts[label] = min(first_starts.get(label, sys.maxsize), transaction["start_time"])
+        self.assertEqual(["vu 0", "vu 1"], sorted(first_starts))
+        self.assertLess(first_starts["vu 0"], worker.start_time + 0.1)
+        self.assertGreaterEqual(first_starts["vu 1"], worker.start_time + 0.3)  # after ramp step only
+
+
 def mock_spawn_worker(params):
     with open(params.report, 'w') as log:
         log.write(str(os.getpid()))
@@ -39,3 +39,27 @@ class TestRecorder(TestCase):
             generator.join()
         for generator in event_generators:
             self.assertEqual(generator.events, generator.result_events)
+
+    def test_windows(self):
+        recorder = _EventRecorder()
+        recorder.local.recording = None  # clean recording of this thread
+        events = [Event() for _ in range(6)]
+        for idx, event in enumerate(events):
+            event.timestamp = idx
+            recorder.record_event(event)
+
+        self.assertEqual(events[2:4], recorder.pop_events(from_ts=2, to_ts=3))
+        self.assertEqual([events[4]], recorder.pop_events(from_ts=4, to_ts=4))
+        self.assertEqual(events[:2] + [events[5]], recorder.pop_events(from_ts=-1, to_ts=sys.maxsize))
+        self.assertEqual([], recorder.pop_events(from_ts=-1, to_ts=sys.maxsize))
+
+    def test_overflow(self):
+        recorder = _EventRecorder()
+        recorder.local.recording = None
+        recorder.MAX_EVENTS = 3
+        events = [Event() for _ in range(5)]
+        for event in events:
+            recorder.record_event(event)
+
+        self.assertEqual(2, recorder.get_dropped_count())
+        self.assertEqual(events[2:], recorder.pop_events(from_ts=-1, to_ts=sys.maxsize))
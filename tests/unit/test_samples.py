@@ -1,11 +1,18 @@
+import json
 import os
+import sys
+from http.server import BaseHTTPRequestHandler
 from unittest import TestCase
 
 import nose2
+import requests
 
-from apiritif import store
+import apiritif
+from apiritif import store, thread
+from apiritif.samples import Sample, ApiritifSampleExtractor
+from apiritif.utils import to_json_line
 from . import Recorder  # required for nose2. unittest.cfg loads this plugin from here
-from tests.unit import RESOURCES_DIR
+from tests.unit import RESOURCES_DIR, LocalServerMixin
 
 
 class CachingWriter(object):
@@ -16,7 +23,22 @@ class CachingWriter(object):
         self.samples.append(sample)
 
 
-class TestSamples(TestCase):
+class BodyHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "4")
+        self.end_headers()
+        self.wfile.write(b"body")
+
+
+class KeepAliveHandler(BodyHandler):
+    protocol_version = "HTTP/1.1"
+
+
+class TestSamples(LocalServerMixin, TestCase):
     def test_transactions(self):
         test_file = os.path.join(RESOURCES_DIR, "test_transactions.py")
         self.assertTrue(os.path.exists(test_file))
@@ -144,3 +166,103 @@ class TestSamples(TestCase):
         self.assertEqual(1, len(second.subsamples))
         self.assertEqual(second.subsamples[0].test_case, "2nd")
         self.assertEqual(second.subsamples[0].subsamples[0].test_case, 'https://blazedemo.com/vacation.html')
+
+    def test_serialization(self):
+        sample = Sample(test_case="request", status="PASSED", start_time=1, duration=0.5)
+        sample.extras.update({"responseHeaders": {"Server": "test"}, "assertions": [{"name": "custom"}], 1: "int key"})
+        sample.add_assertion("assert_ok", {"args": [], "kwargs": {}})
+        parent = Sample(test_case="test", status="PASSED")
+        parent.add_subsample(sample)
+
+        data = parent.to_dict()
+        extras = data["subsamples"][0]["extras"]
+        self.assertEqual(["custom", "assert_ok"], [ass["name"] for ass in extras["assertions"]])
+        self.assertEqual([{"name": "custom"}], sample.extras["assertions"])  # original extras aren't changed
+        self.assertIs(sample.extras["responseHeaders"], extras["responseHeaders"])  # values aren't copied
+
+        line = to_json_line(data)
+        self.assertTrue(line.endswith(b"\n"))
+        restored = json.loads(line.decode('utf-8'))
+        self.assertEqual("int key", restored["subsamples"][0]["extras"]["1"])
+        self.assertEqual(json.loads(json.dumps(data)), restored)
+        self.assertEqual({"big": 2 ** 70}, json.loads(to_json_line({"big": 2 ** 70}).decode('utf-8')))
+
+    def test_compact_objects(self):
+        self.assertFalse(hasattr(Sample(), "__dict__"))
+
+        class CustomEvent(apiritif.Event):  # extenders can still add attributes
+            def __init__(self, data):
+                super(CustomEvent, self).__init__()
+                self.data = data
+
+        self.assertEqual("data", CustomEvent("data").data)
+
+    def test_recording_levels(self):
+        address = self.start_server(BodyHandler) + "/"
+        try:
+            results = {}
+            for level in apiritif.recorder.LEVELS:
+                apiritif.recorder.set_level(level)
+                apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+                with apiritif.transaction("tran"):
+                    response = apiritif.http.get(address)
+                    response.assert_ok()
+                    self.assertRaises(AssertionError, response.assert_in_body, "missing")
+                recording = apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+                results[level] = ApiritifSampleExtractor().parse_recording(recording, Sample(test_case="test"))[0]
+        finally:
+            apiritif.recorder.set_level("full")
+
+        full, timings = results["full"].subsamples[0], results["timings"].subsamples[0]
+        self.assertEqual(["assert_ok", "assert_in_body"], [ass.name for ass in full.subsamples[0].assertions])
+        self.assertEqual(["assert_in_body"], [ass.name for ass in timings.subsamples[0].assertions])
+        for request in (full.subsamples[0], timings.subsamples[0]):
+            self.assertEqual("FAILED", request.status)
+            self.assertEqual(200, request.extras["responseCode"])
+            self.assertEqual(4, request.extras["responseBodySize"])
+        self.assertEqual(full.subsamples[0].extras["responseHeadersSize"],
+                         timings.subsamples[0].extras["responseHeadersSize"])
+        self.assertNotIn("responseBody", timings.subsamples[0].extras)
+        payload = {"responseBody", "requestBody", "requestCookies", "requestCookiesRaw", "requestHeaders",
+                   "responseHeaders"}
+        self.assertEqual(set(full.subsamples[0].extras) - payload, set(timings.subsamples[0].extras))
+        self.assertEqual(full.subsamples[0].extras["connectionRequests"],
+                         timings.subsamples[0].extras["connectionRequests"])
+        self.assertEqual([], results["off"].subsamples[0].subsamples)
+        self.assertRaises(ValueError, apiritif.recorder.set_level, "unknown")
+
+    def test_connection_reuse(self):
+        address = self.start_server(KeepAliveHandler) + "/"
+        apiritif.http.close_shared_adapters()
+        self.addCleanup(apiritif.http.close_shared_adapters)
+        apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        responses = [apiritif.http.get(address) for _ in range(3)]
+        apiritif.http.close_shared_adapters()
+        responses.append(apiritif.http.get(address))
+        recording = apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+
+        self.assertEqual([1, 2, 3, 1], [response.connection_requests for response in responses])
+        samples = ApiritifSampleExtractor().parse_recording(recording, Sample(test_case="test"))[0].subsamples
+        self.assertEqual([False, True, True, False], [sample.extras["connectionReused"] for sample in samples])
+        self.assertEqual(3, samples[2].extras["connectionRequests"])
+
+    def test_shared_target_session(self):
+        address = self.start_server(KeepAliveHandler)
+        reused, not_shared = [], []
+        try:
+            for iteration in range(4):
+                thread.set_iteration(iteration)
+                target = apiritif.http.target(address, share_session=True, session_iterations=2)  # made in setUp
+                reused.append(target.get("/").connection_requests)
+                target.get("/")
+                not_shared.append(apiritif.http.target(address).get("/").connection_requests)
+                session = apiritif.http.get_shared_session(("key",), requests.Session)
+                self.assertEqual(0, len(session.cookies))  # cookies of previous iteration are cleared
+                session.cookies.set("name", "value")
+                self.assertIs(session, apiritif.http.get_shared_session(("key",), requests.Session))
+        finally:
+            thread.set_iteration(0)
+            apiritif.http.close_shared_sessions()
+
+        self.assertEqual([1, 3, 1, 3], reused)
+        self.assertEqual([1, 1, 1, 1], not_shared)
@@ -1,11 +1,19 @@
 import os
+import shutil
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler
 
 import OpenSSL
 from unittest import TestCase
+
+import apiritif
+from apiritif.samples import ApiritifSampleExtractor, Sample
 from apiritif.http import http
 from apiritif import ssl_adapter
 
-from tests.unit import RESOURCES_DIR
+from tests.unit import RESOURCES_DIR, LocalServerMixin
 
 
 class CryptoMock:
@@ -82,16 +90,30 @@ class PyOpenSSLContextMock:
         self.ssl_protocol = ssl_protocol
 
 
+class CloseHandler(BaseHTTPRequestHandler):  # HTTP/1.0 closes connection after response
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+
 class TestSSLAdapter(TestCase):
     def setUp(self):
         self.real_crypto = ssl_adapter.crypto
         self.real_PyOpenSSLContext = ssl_adapter.PyOpenSSLContext
         ssl_adapter.crypto = CryptoMock()
         ssl_adapter.PyOpenSSLContext = PyOpenSSLContextMock
+        ssl_adapter.CertificateReader._certificates.clear()
 
     def tearDown(self):
         ssl_adapter.crypto = self.real_crypto
         ssl_adapter.PyOpenSSLContext = self.real_PyOpenSSLContext
+        ssl_adapter.CertificateReader._certificates.clear()
+        http.close_shared_adapters()
 
     def test_adapter_with_p12_cert(self):
         certificate_file_path = os.path.join(RESOURCES_DIR, "certificates/dump-file.p12")
@@ -113,6 +135,33 @@ class TestSSLAdapter(TestCase):
         self.assertEqual(1, ssl_adapter.crypto.load_certificate_called)
         self.assertEqual(1, ssl_adapter.crypto.load_privatekey_called)
 
+    def test_context_cache(self):
+        temp_dir = tempfile.mkdtemp()
+        try:
+            certificate_file_path = os.path.join(temp_dir, "cert.p12")
+            shutil.copy(os.path.join(RESOURCES_DIR, "certificates/dump-file.p12"), certificate_file_path)
+            adapter = http.get_ssl_adapter(certificate_file_path, 'pass')
+            self.assertIs(adapter, http.get_ssl_adapter(certificate_file_path, 'pass'))
+            other = ssl_adapter.SSLAdapter(certificate_file_path=certificate_file_path, passphrase='pass')
+            self.assertIsNot(adapter.ssl_context, other.ssl_context)  # urllib3 changes context for connections
+            thread_adapters = []
+            thread = threading.Thread(target=lambda: thread_adapters.append(
+                http.get_ssl_adapter(certificate_file_path, 'pass')))
+            thread.start()
+            thread.join()
+            self.assertIsNot(adapter.ssl_context, thread_adapters[0].ssl_context)
+            self.assertEqual(1, ssl_adapter.crypto.load_pkcs12_called)  # file is read once
+
+            http.get_ssl_adapter(certificate_file_path, 'other pass')
+            self.assertEqual(2, ssl_adapter.crypto.load_pkcs12_called)
+
+            mtime = os.path.getmtime(certificate_file_path)
+            os.utime(certificate_file_path, (mtime + 10, mtime + 10))  # file is changed
+            self.assertIsNot(adapter, http.get_ssl_adapter(certificate_file_path, 'pass'))
+            self.assertEqual(3, ssl_adapter.crypto.load_pkcs12_called)
+        finally:
+            shutil.rmtree(temp_dir)
+
 
 # TODO: This class contains integration tests. Need to be removed in future
 class TestSSL(TestCase):
@@ -149,3 +198,25 @@ class TestSSL(TestCase):
         encrypted_cert = (self.certificate_file_p12, self.passphrase)
         response = http.get(cert_missing_url, encrypted_cert=encrypted_cert)
         self.assertEqual(400, response.status_code)
+
+
+class TestTLSResumption(LocalServerMixin, TestCase):
+    def setUp(self):
+        self.address = self.start_server(CloseHandler, tls=True)
+        http.close_shared_adapters()
+        self.addCleanup(http.close_shared_adapters)
+
+    def test_handshake_timings(self):
+        apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        responses = [http.target(self.address, tls_resumption=resumption).get("/")
+                     for resumption in (False, False, True, True)]
+        self.assertEqual([False, False, False, True], [response.tls_resumed for response in responses])
+        for response in responses:
+            self.assertEqual(1, response.connection_requests)
+            self.assertGreater(response.tls_handshake_time, 0)
+
+        recording = apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        samples = ApiritifSampleExtractor().parse_recording(recording, Sample(test_case="test"))[0].subsamples
+        self.assertEqual([False, False, False, True], [sample.extras["tlsResumed"] for sample in samples])
+        self.assertIn("tlsHandshakeTime", samples[0].extras)
+        self.assertIn("connectTime", samples[0].extras)
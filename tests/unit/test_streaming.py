@@ -0,0 +1,65 @@
+import hashlib
+import sys
+import tracemalloc
+from http.server import BaseHTTPRequestHandler
+from unittest import TestCase
+
+import apiritif
+from apiritif import http
+from apiritif.samples import ApiritifSampleExtractor, Sample
+from tests.unit import LocalServerMixin
+
+CHUNK = b"0123456789abcdef" * 4096
+CHUNKS_COUNT = 320  # 20 MB
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(CHUNK) * CHUNKS_COUNT))
+        self.end_headers()
+        for _ in range(CHUNKS_COUNT):
+            self.wfile.write(CHUNK)
+
+
+class TestStreaming(LocalServerMixin, TestCase):
+    def setUp(self):
+        self.address = self.start_server(Handler) + "/"
+        apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+
+    def test_stream(self):
+        sizes = []
+        tracemalloc.start()
+        try:
+            response = http.get(self.address, stream=True, hash_algorithm="md5",
+                                chunk_callback=lambda chunk: sizes.append(len(chunk)))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        expected_hash = hashlib.md5(CHUNK * CHUNKS_COUNT).hexdigest()
+        self.assertLess(peak, len(CHUNK) * 10)  # body isn't kept in memory
+        self.assertEqual(b"", response.content)
+        self.assertEqual(len(CHUNK) * CHUNKS_COUNT, sum(sizes))
+        self.assertGreaterEqual(response.elapsed, response.latency)
+        response.assert_body_size(len(CHUNK) * CHUNKS_COUNT).assert_body_hash(expected_hash)
+        self.assertRaises(AssertionError, response.assert_body_hash, "0" * 32)
+
+        recording = apiritif.recorder.pop_events(from_ts=-1, to_ts=sys.maxsize)
+        sample = ApiritifSampleExtractor().parse_recording(recording, Sample(test_case="test"))[0].subsamples[0]
+        self.assertEqual(len(CHUNK) * CHUNKS_COUNT, sample.extras["responseBodySize"])
+        self.assertEqual(expected_hash, sample.extras["responseBodyHash"])
+
+    def test_regular_response(self):
+        target = http.target(self.address)
+        response = target.get("/")
+        response.assert_body_size(len(CHUNK) * CHUNKS_COUNT)
+        response.assert_body_hash(hashlib.sha256(response.content).hexdigest())
+
+        streamed = target.get("/", stream=True)
+        self.assertRaises(ValueError, streamed.assert_body_hash, "0" * 64)